@@ -1,24 +1,121 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, make_response, request, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import requests
-from time import time
+from sqlalchemy.exc import DBAPIError
+from concurrent.futures import as_completed
+from time import perf_counter
+import base64
+import binascii
+import gc
 import hashlib
+import json
+import math
 import os
+from urllib.parse import urlencode
 from dotenv import load_dotenv
+import numpy as np
+from spatial_index import haversine_km, haversine_km_many
+from cache import TTLCache, make_cache, quantize
+from permit_snapshot import COLUMNS, SnapshotStore
+from distance_client import DISTANCE_MATRIX_URL, DistanceMatrixClient
+from singleflight import SingleFlight
+from upstream_budget import make_budget
+from serialization import PERMIT_FIELDS, RowSerializer, dumps, parse_fields, project
+from metrics import Registry
+from profiling import RequestProfiler, record_timing, timing
+from road_grid import RoadGridStore
+from clusters import cell_deg
+from opening_hours import resolve_open_at, slot_of
 
 load_dotenv()  # take environment variables from .env only for local dev
 
-distance_cache = {}
 CACHE_TTL = 60 * 60  # 1 hour
+# Nearby queries are cached per ~50 m cell so neighbouring callers share results
+NEARBY_CACHE_GRID_M = float(os.getenv('NEARBY_CACHE_GRID_M', 50))
+NEARBY_CACHE_MAX_ENTRIES = int(os.getenv('NEARBY_CACHE_MAX_ENTRIES', 10000))
+NEARBY_CACHE_MAX_BYTES = int(os.getenv('NEARBY_CACHE_MAX_BYTES', 0)) or None
+# 'memory' keeps a private cache per worker; 'sqlite' shares one file across workers on a host
+NEARBY_CACHE_BACKEND = os.getenv('NEARBY_CACHE_BACKEND', 'memory')
+NEARBY_CACHE_PATH = os.getenv('NEARBY_CACHE_PATH', '/tmp/nearby_cache.sqlite3')
+distance_cache = make_cache(
+    NEARBY_CACHE_BACKEND,
+    path=NEARBY_CACHE_PATH,
+    max_entries=NEARBY_CACHE_MAX_ENTRIES,
+    ttl=CACHE_TTL,
+    max_bytes=NEARBY_CACHE_MAX_BYTES
+)
+# Concurrent misses for one key share a single computation; followers wait at most this long
+NEARBY_COALESCE_WAIT = float(os.getenv('NEARBY_COALESCE_WAIT', 10))
+# With the sqlite backend, also coalesce across the workers sharing the cache file
+NEARBY_COALESCE_SHARED = os.getenv('NEARBY_COALESCE_SHARED', '1') != '0' and NEARBY_CACHE_BACKEND == 'sqlite'
+nearby_flight = SingleFlight(
+    wait=NEARBY_COALESCE_WAIT,
+    shared=distance_cache if NEARBY_COALESCE_SHARED else None,
+    shared_lookup=lambda key: distance_cache.get(key, count=False)
+)
+# Road distance per (origin cell, permit) pair, shared by every nearby query from that cell
+PAIR_CACHE_GRID_M = float(os.getenv('PAIR_CACHE_GRID_M', 100))
+PAIR_CACHE_MAX_ENTRIES = int(os.getenv('PAIR_CACHE_MAX_ENTRIES', 200000))
+pair_distance_cache = TTLCache(max_entries=PAIR_CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+# Serve searches from an in-memory permit snapshot instead of querying per request
+USE_PERMIT_SNAPSHOT = os.getenv('PERMIT_SNAPSHOT', '1') != '0'
+# Default engine for /search_applicant: 'index' (trigram index), 'scan' (snapshot scan) or 'sql' (ILIKE)
+SEARCH_ENGINES = ('index', 'scan', 'sql')
+SEARCH_ENGINE = os.getenv('SEARCH_ENGINE', 'index')
+# How long a snapshot (and the spatial index built with it) is served before a reload
+SNAPSHOT_REFRESH_INTERVAL = int(os.getenv('SNAPSHOT_REFRESH_INTERVAL', 15 * 60))
+# How long the latest dataset_version, which ETags SQL-served responses, is reused
+DATASET_VERSION_TTL = float(os.getenv('DATASET_VERSION_TTL', 5))
+dataset_version_cache = TTLCache(max_entries=1, ttl=DATASET_VERSION_TTL)
+# Shared secret for the admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+NEARBY_MODES = ('road', 'straight_line', 'hybrid')
+COORDINATES_ERROR = 'latitude and longitude must be numbers within -90..90 and -180..180'
+# Straight-line answers from the in-process 'index' or from PostGIS KNN ('postgis', needs migration 0005)
+STRAIGHT_LINE_ENGINE = os.getenv('STRAIGHT_LINE_ENGINE', 'index')
+# Geometric candidates re-ranked by road distance in hybrid mode; 25 is one Distance Matrix batch.
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 25))
+# /search_applicant page size when paging with `cursor`/`page_size`, and its upper bound
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 30))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', 1000))
+# Rows fetched per round trip from the server-side cursor when streaming
+SEARCH_STREAM_BATCH = int(os.getenv('SEARCH_STREAM_BATCH', 500))
+# Limits for /search_nearby/batch
+BATCH_MAX_ORIGINS = int(os.getenv('BATCH_MAX_ORIGINS', 1000))
+BATCH_MAX_K = int(os.getenv('BATCH_MAX_K', 50))
+# /search_food page size without and with a location, and its upper bound
+FOOD_SEARCH_LIMIT = int(os.getenv('FOOD_SEARCH_LIMIT', 30))
+FOOD_NEARBY_LIMIT = int(os.getenv('FOOD_NEARBY_LIMIT', 5))
+FOOD_MODES = ('straight_line', 'hybrid')
+# /permits/in_bbox: clusters span at most BBOX_MAX_CELLS cells across the viewport; from zoom
+# BBOX_PERMITS_ZOOM on, viewports holding at most BBOX_MAX_PERMITS permits list them instead
+BBOX_MAX_CELLS = int(os.getenv('BBOX_MAX_CELLS', 32))
+BBOX_PERMITS_ZOOM = int(os.getenv('BBOX_PERMITS_ZOOM', 15))
+BBOX_MAX_PERMITS = int(os.getenv('BBOX_MAX_PERMITS', 200))
+# Distance Matrix caps: 25 origins, 25 destinations and this many elements per request
+MATRIX_MAX_ELEMENTS = int(os.getenv('DISTANCE_MATRIX_MAX_ELEMENTS', 100))
+# Most elements one request can carry: a 25-destination row always fits, whatever the cap
+MATRIX_MAX_REQUEST = max(MATRIX_MAX_ELEMENTS, 25)
+# Directory where gunicorn workers share metrics for /metrics; unset keeps them per process
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+# Profiling: `X-Profile` requests need this token; PROFILE_SAMPLE_RATE=N also profiles 1 in N requests
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = int(os.getenv('PROFILE_SAMPLE_RATE', 0))
+# 'sample' (stack sampling, cheap) or 'cprofile' (deterministic) for sampled requests
+PROFILE_SAMPLE_MODE = os.getenv('PROFILE_SAMPLE_MODE', 'sample')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/profiles')
+# Precomputed road-distance grid built by road_grid.py; road queries fall back to live calls without it
+ROAD_GRID_PATH = os.getenv('ROAD_GRID_PATH') or None
+road_grid = RoadGridStore(ROAD_GRID_PATH) if ROAD_GRID_PATH else None
 app = Flask(__name__)
 DB_USER = os.getenv('DB_USER')
 DB_PASS = os.getenv('DB_PASS')
 DB_NAME = os.getenv('DB_NAME')
 INSTANCE_CONNECTION_NAME = os.getenv('INSTANCE_CONNECTION_NAME')
 
-app.config['SQLALCHEMY_DATABASE_URI'] = (
+# DATABASE_URL points at any other database, e.g. a local Postgres for migrations and benchmarks
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL') or (
     f'postgresql+psycopg2://{DB_USER}:{DB_PASS}@/{DB_NAME}'
     f'?host=/cloudsql/{INSTANCE_CONNECTION_NAME}'
 )
@@ -28,6 +125,53 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 CORS(app)
 
 
+metrics_registry = Registry(path=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL)
+REQUEST_SECONDS = metrics_registry.histogram(
+    'http_request_duration_seconds', 'Request latency by route.', ('route', 'method', 'status')
+)
+STAGE_SECONDS = metrics_registry.histogram(
+    'stage_duration_seconds', 'Time spent in db_query, upstream_batch, cache_lookup and serialize.', ('stage',)
+)
+IN_FLIGHT = metrics_registry.gauge('http_requests_in_flight', 'Requests being served.')
+UPSTREAM_REQUESTS = metrics_registry.counter('upstream_requests_total', 'Distance Matrix requests sent.')
+UPSTREAM_ELEMENTS = metrics_registry.counter('upstream_elements_total', 'Distance Matrix elements requested.')
+UPSTREAM_FAILURES = metrics_registry.counter('upstream_failures_total', 'Distance Matrix requests that failed after retries.')
+CACHE_HITS = metrics_registry.counter('cache_hits_total', 'Cache hits.', ('cache',))
+CACHE_MISSES = metrics_registry.counter('cache_misses_total', 'Cache misses.', ('cache',))
+CACHE_EVICTIONS = metrics_registry.counter('cache_evictions_total', 'Entries evicted to stay within limits.', ('cache',))
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = perf_counter()
+    IN_FLIGHT.inc()
+
+
+@app.after_request
+def record_request(response):
+    # Route templates, not raw paths, keep the label set small
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.observe(perf_counter() - g.request_started, route, request.method, response.status_code)
+    return response
+
+
+@app.teardown_request
+def finish_request(error=None):
+    if 'request_started' in g:
+        IN_FLIGHT.dec()
+    metrics_registry.maybe_flush()
+
+
+profiler = RequestProfiler(
+    PROFILE_DIR, token=PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE, sample_mode=PROFILE_SAMPLE_MODE,
+    thread_prefixes=('distance-matrix',)
+)
+if profiler.enabled:
+    # Stage timings on the request thread also go into the profiled request's Server-Timing
+    STAGE_SECONDS.add_listener(lambda seconds, stage: record_timing(stage, seconds))
+profiler.init_app(app)
+
+
 @app.route('/')
 def home():
     return jsonify(message="Just to check flask is working")
@@ -43,97 +187,845 @@ class MobileFoodFacilityPermit(db.Model):
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
     zipcodes = db.Column(db.String)  # Adjust if column name is different
+    fooditems = db.Column(db.String)
+    dayshours = db.Column(db.String)
+
+
+class DatasetVersion(db.Model):
+    """One row per ingest.py run that changed the data (migration 0006)."""
+    __tablename__ = 'dataset_version'
+    version = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    source = db.Column(db.String)
+
 
 @app.route('/search_applicant', methods=['POST'])
 def search_applicant():
-    data = request.get_json()
+    return search_applicant_response(request.get_json())
+
+
+@app.route('/search_applicant', methods=['GET'])
+def search_applicant_get():
+    """HTTP-cacheable GET form of the search; same fields, as query parameters."""
+    return search_applicant_response(query_args(), conditional=True)
+
+
+def search_applicant_response(data, conditional=False):
+    """Run a search described by `data`; `conditional` adds ETag/304 handling."""
     applicant_query = data.get('applicant', '').strip()
     address_query = data.get('address', '').strip()
     user_statuses = data.get('statuses', ['APPROVED'])
+    engine = data.get('engine', SEARCH_ENGINE if USE_PERMIT_SNAPSHOT else 'sql')
 
     if not isinstance(user_statuses, list):
         return jsonify({'error': 'statuses must be a list'}), 400
 
+    if engine not in SEARCH_ENGINES:
+        return jsonify({'error': f"engine must be one of {', '.join(SEARCH_ENGINES)}"}), 400
+
+    try:
+        serialize = RowSerializer(parse_fields(data.get('fields')))
+        open_at = resolve_open_at(data.get('open_at'), data.get('open_now', False))
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    # Opening hours are parsed into the snapshot, not queried with SQL
+    if open_at is not None and engine == 'sql':
+        return jsonify({'error': 'open_at and open_now need the index or scan engine'}), 400
+
     # Normalize input (e.g., trim & uppercase)
     status_set = set(s.strip().upper() for s in user_statuses)
 
+    cursor = data.get('cursor')
+    page_size = data.get('page_size')
+    stream = bool(data.get('stream', False))
 
-    # Build the base query filtering by applicant name (case-insensitive)
-    query = MobileFoodFacilityPermit.query.filter(
-        MobileFoodFacilityPermit.applicant.ilike(f'%{applicant_query}%')
-    )
+    if conditional:
+        canonical = canonical_query(
+            applicant=applicant_query, address=address_query, statuses=status_set, engine=engine,
+            fields=serialize.fields, cursor=cursor, page_size=page_size,
+            open_at=open_at.isoformat() if open_at is not None else None
+        )
+        etag = make_etag(canonical, from_snapshot=(engine != 'sql'))
+        if request.if_none_match.contains(etag):
+            return not_modified(etag, SNAPSHOT_REFRESH_INTERVAL)
+        response = search_applicant_response(
+            dict(data, applicant=applicant_query, address=address_query,
+                 open_at=open_at.isoformat() if open_at is not None else None, open_now=False),
+            conditional=False
+        )
+        response = cacheable(response, etag, SNAPSHOT_REFRESH_INTERVAL, canonical)
+        if data.get('open_now'):
+            # The answer moves with the clock; revalidate instead of reusing it
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+    if stream or cursor is not None or page_size is not None:
+        if page_size is None:
+            page_size = SEARCH_PAGE_SIZE
+        if not isinstance(page_size, int) or isinstance(page_size, bool) or not 1 <= page_size <= SEARCH_MAX_PAGE_SIZE:
+            return jsonify({'error': f'page_size must be an integer between 1 and {SEARCH_MAX_PAGE_SIZE}'}), 400
+        try:
+            after = decode_cursor(cursor) if cursor is not None else None
+        except ValueError:
+            return jsonify({'error': 'invalid cursor'}), 400
+        if stream:
+            rows = iter_search_results(engine, applicant_query, address_query, status_set, after, open_at)
+            lines = (dumps(serialize(row)) + b'\n' for row in rows)
+            return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+        return json_response(
+            search_page(engine, applicant_query, address_query, status_set, after, page_size, serialize,
+                        open_at)
+        )
+
+    if engine != 'sql':
+        results = snapshot_store.get().search(
+            applicant_query, address_query, status_set, limit=30, use_index=(engine == 'index'),
+            open_at=open_at
+        )
+        return json_response(serialize.many(results))
 
-    # Always filter by status; use default "APPROVED" unless overridden
-    query = query.filter(MobileFoodFacilityPermit.status.in_(status_set))
+    # Plain column tuples, not ORM instances: no identity map or instrumentation per row
+    with STAGE_SECONDS.time('db_query'):
+        results = db.session.execute(
+            search_statement(applicant_query, address_query, status_set).limit(30)
+        ).all()
+    return json_response(serialize.many(results))
+
+
+def json_response(payload):
+    """200 response with `payload` encoded by the fast JSON encoder."""
+    with STAGE_SECONDS.time('serialize'):
+        body = dumps(payload)
+    return Response(body, mimetype='application/json')
+
+def encode_cursor(locationid):
+    """Opaque token for the page that starts after `locationid`."""
+    return base64.urlsafe_b64encode(json.dumps({'after': locationid}).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """The `locationid` a cursor resumes after; ValueError if it isn't one of ours."""
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode()))['after']
+    except (AttributeError, binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+        raise ValueError('invalid cursor')
+    if not isinstance(after, int) or isinstance(after, bool):
+        raise ValueError('invalid cursor')
+    return after
+
+
+def contains_pattern(query):
+    """ILIKE pattern matching `query` anywhere, its own `%`, `_` and `\\` taken literally."""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def search_statement(applicant_query, address_query, status_set, after=None):
+    """The ILIKE search as a Core select of the snapshot columns, keyset-ordered.
+
+    Queries match as plain substrings, as they do against the snapshot.
+    """
+    permit = MobileFoodFacilityPermit
+    stmt = db.select(*[getattr(permit, name) for name in COLUMNS]).where(
+        permit.applicant.ilike(contains_pattern(applicant_query), escape='\\'),
+        permit.status.in_(status_set)
+    )
     if address_query:
-        query = query.filter(MobileFoodFacilityPermit.address.ilike(f'%{address_query}%'))
+        stmt = stmt.where(permit.address.ilike(contains_pattern(address_query), escape='\\'))
+    if after is not None:
+        stmt = stmt.where(permit.locationid > after)
+    return stmt.order_by(permit.locationid)
 
 
-    results = query.limit(30).all()
+def search_page(engine, applicant_query, address_query, status_set, after, page_size, serialize,
+                open_at=None):
+    """One page of matches in `locationid` order plus the cursor for the next one."""
+    # One extra row tells us whether there is a next page
+    if engine == 'sql':
+        stmt = search_statement(applicant_query, address_query, status_set, after).limit(page_size + 1)
+        with STAGE_SECONDS.time('db_query'):
+            rows = db.session.execute(stmt).all()
+    else:
+        rows = snapshot_store.get().search(
+            applicant_query, address_query, status_set, limit=page_size + 1,
+            use_index=(engine == 'index'), after=after, open_at=open_at
+        )
+    next_cursor = encode_cursor(rows[page_size - 1].locationid) if len(rows) > page_size else None
+    return {'results': serialize.many(rows[:page_size]), 'next_cursor': next_cursor}
 
-    output = [{
-        'applicant': p.applicant,
-        'status': p.status,
-        'address': p.address,
-        'latitude': p.latitude,
-        'longitude': p.longitude,
-        'zipcodes': p.zipcodes
-    } for p in results]
 
-    return jsonify(output)
+def iter_search_results(engine, applicant_query, address_query, status_set, after, open_at=None):
+    """Every match in `locationid` order; SQL rows come off a server-side cursor."""
+    if engine != 'sql':
+        yield from snapshot_store.get().search(
+            applicant_query, address_query, status_set, use_index=(engine == 'index'), after=after,
+            open_at=open_at
+        )
+        return
+    stmt = search_statement(applicant_query, address_query, status_set, after)
+    yield from db.session.execute(stmt.execution_options(yield_per=SEARCH_STREAM_BATCH))
+
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# One pooled, keep-alive client and executor per process for every Distance Matrix call
+distance_client = DistanceMatrixClient(
+    GOOGLE_API_KEY,
+    url=os.getenv('DISTANCE_MATRIX_URL', DISTANCE_MATRIX_URL),
+    connect_timeout=float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.getenv('UPSTREAM_READ_TIMEOUT', 10)),
+    max_retries=int(os.getenv('UPSTREAM_MAX_RETRIES', 2)),
+    max_workers=int(os.getenv('UPSTREAM_MAX_WORKERS', 5))
+)
+
+# Distance Matrix elements we may spend; 0 means unlimited. Shared by workers with the sqlite backend.
+upstream_budget = make_budget(
+    os.getenv('UPSTREAM_BUDGET_BACKEND', NEARBY_CACHE_BACKEND),
+    path=os.getenv('UPSTREAM_BUDGET_PATH', '/tmp/upstream_budget.sqlite3'),
+    per_second=int(os.getenv('UPSTREAM_ELEMENTS_PER_SECOND', 0)),
+    burst=int(os.getenv('UPSTREAM_ELEMENTS_BURST', 0)) or None,
+    per_day=int(os.getenv('UPSTREAM_ELEMENTS_PER_DAY', 0)),
+    max_request=MATRIX_MAX_REQUEST
+)
+
+
+class UpstreamUnavailable(Exception):
+    """Road distances can't be had right now: budget spent or Google failing."""
+
 
 @app.route('/search_nearby', methods=['POST'])
 def search_nearby():
-    data = request.get_json()
+    return search_nearby_response(request.get_json())
+
+
+@app.route('/search_nearby', methods=['GET'])
+def search_nearby_get():
+    """HTTP-cacheable GET form, answered for the centre of the caller's cache cell."""
+    return search_nearby_response(query_args(), conditional=True)
+
+
+def search_nearby_response(data, conditional=False):
+    """Nearest permits for the request in `data`; `conditional` adds ETag/304 handling."""
+    try:
+        user_lat, user_lon, status_set, mode, fields, open_at = parse_nearby_request(data)
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    if not conditional:
+        return json_response(project(nearby_results(user_lat, user_lon, status_set, mode, open_at), fields))
+
+    user_lat, user_lon, canonical, etag = nearby_validator(user_lat, user_lon, status_set, mode, fields, open_at)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag, CACHE_TTL)
+    results = nearby_results(user_lat, user_lon, status_set, mode, open_at)
+    response = json_response(project(results, fields))
+    if is_estimate(results):
+        # Degraded answers must not be reused once road distances are back
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    response = cacheable(response, etag, CACHE_TTL, canonical)
+    if data.get('open_now'):
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def parse_nearby_request(data):
+    """Validate a nearby request; returns (lat, lon, status_set, mode, fields, open_at) or raises ValueError."""
     user_lat = data.get('latitude')
     user_lon = data.get('longitude')
     user_statuses = data.get('statuses', ['APPROVED'])
+    mode = data.get('mode', 'road')
 
     if not isinstance(user_statuses, list):
-        return jsonify({'error': 'statuses must be a list'}), 400
+        raise ValueError('statuses must be a list')
 
     status_set = set(s.strip().upper() for s in user_statuses)
 
-    if not user_lat or not user_lon:
-        return jsonify({'error': 'Latitude and longitude are required'}), 400
-    
-    # Check cache
-    cache_key = make_cache_key(user_lat, user_lon, status_set)
-    cached = distance_cache.get(cache_key)
-    if cached and time() - cached['timestamp'] < CACHE_TTL:
-        return jsonify(cached['data'])
+    user_lat, user_lon = parse_coordinates(user_lat, user_lon)
 
+    if mode not in NEARBY_MODES:
+        raise ValueError(f"mode must be one of {', '.join(NEARBY_MODES)}")
 
-    # Query all matching permits (~500)
-    permits = MobileFoodFacilityPermit.query.filter(
-        MobileFoodFacilityPermit.status.in_(status_set)
-    ).all()
+    fields = parse_fields(data.get('fields'))
+    open_at = resolve_open_at(data.get('open_at'), data.get('open_now', False))
+    return user_lat, user_lon, status_set, mode, fields, open_at
 
-    origins = f"{user_lat},{user_lon}"
 
-    results = []
-    # Batch permits into chunks of 25 for Google API Free tier
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = []
-        for chunk in chunk_list(permits, 25):
-            futures.append(executor.submit(get_distance_batch, origins, chunk))
+def valid_coordinates(lat, lon):
+    """Whether `lat` and `lon` are finite numbers (not bools) inside the globe."""
+    for value, limit in ((lat, 90), (lon, 180)):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        if not math.isfinite(value) or not -limit <= value <= limit:
+            return False
+    return True
 
-        for future in as_completed(futures):
-            results.extend(future.result())
 
+def parse_coordinates(lat, lon):
+    """(lat, lon) as numbers; raises ValueError unless both are finite and on the globe.
+
+    Numeric strings are accepted, as the frontend posts its text inputs.
+    """
+    if lat is None or lat == '' or lon is None or lon == '':
+        raise ValueError('Latitude and longitude are required')
+    try:
+        lat, lon = (float(v) if isinstance(v, str) else v for v in (lat, lon))
+    except ValueError:
+        raise ValueError(COORDINATES_ERROR)
+    if not valid_coordinates(lat, lon):
+        raise ValueError(COORDINATES_ERROR)
+    return lat, lon
+
+
+def nearby_validator(user_lat, user_lon, status_set, mode, fields, open_at=None):
+    """(cell lat, cell lon, canonical query, ETag) for a conditional nearby GET.
+
+    Every URL inside one cell gets the same answer, so one ETag (and CDN
+    entry) serves them all.
+    """
+    user_lat, user_lon = quantize(user_lat, user_lon, NEARBY_CACHE_GRID_M)
+    canonical = canonical_query(
+        latitude=user_lat, longitude=user_lon, statuses=status_set, mode=mode, fields=fields,
+        open_at=open_at.isoformat() if open_at is not None else None
+    )
+    return user_lat, user_lon, canonical, make_etag(canonical, nearby_reads_snapshot(mode, open_at))
+
+
+def nearby_reads_snapshot(mode, open_at=None):
+    """Whether a nearby answer is built from the snapshot rather than read from the database."""
+    if open_at is not None or mode == 'hybrid':
+        return True
+    if mode == 'straight_line':
+        return STRAIGHT_LINE_ENGINE != 'postgis'
+    return USE_PERMIT_SNAPSHOT or road_grid is not None
+
+
+def is_estimate(results):
+    return any(result.get('distance_source') == 'estimate' for result in results)
+
+
+def nearby_results(user_lat, user_lon, status_set, mode, open_at=None):
+    """Top 5 permits for the validated request, from cache when possible."""
+    cache_key = make_cache_key(user_lat, user_lon, status_set, mode, open_at)
+    results = ready_nearby(user_lat, user_lon, status_set, mode, cache_key, open_at)
+    if results is not None:
+        return results
+
+    return nearby_flight.do(
+        cache_key, lambda: compute_nearby(user_lat, user_lon, status_set, mode, cache_key, open_at)
+    )
+
+
+def ready_nearby(user_lat, user_lon, status_set, mode, cache_key, open_at=None):
+    """The answer if it needs no Distance Matrix call, else None.
+
+    Opening hours live in the snapshot, so `open_at` queries skip PostGIS
+    and the road grid, which know nothing of them.
+    """
+    # Straight-line answers come from the in-process index, no Google call needed
+    if mode == 'straight_line':
+        if STRAIGHT_LINE_ENGINE == 'postgis' and open_at is None:
+            return nearest_postgis(user_lat, user_lon, status_set)
+        return nearest_straight_line(user_lat, user_lon, status_set, open_at=open_at)
+
+    if mode == 'road' and open_at is None:
+        results = nearest_from_grid(user_lat, user_lon, status_set)
+        if results is not None:
+            return results
+
+    # Check cache; entries always hold every field so any projection can be served
+    with STAGE_SECONDS.time('cache_lookup'):
+        return distance_cache.get(cache_key)
+
+
+def nearest_from_grid(user_lat, user_lon, status_set):
+    """Top 5 by road distance from the precomputed grid, or None when it can't answer.
+
+    The grid only answers for the status set it was built for, inside its
+    bounds, and while the snapshot holds the permits it was built from.
+    """
+    if road_grid is None:
+        return None
+    snapshot = snapshot_store.get()
+    grid = road_grid.get(snapshot)
+    entries = grid.lookup(user_lat, user_lon) if grid is not None and status_set == grid.statuses else None
+    if entries is None:
+        road_grid.misses += 1
+        return None
+    road_grid.hits += 1
+    return [
+        dict(permit_dict(snapshot.record(locationid), distance_km), distance_source='road')
+        for locationid, distance_km in entries[:5]
+    ]
+
+
+def query_args(args=None):
+    """A GET query string (`request.args` by default) as the dict the POST bodies use.
+
+    `statuses` and `fields` may be repeated or comma-separated; numbers are
+    parsed, and anything unparseable is passed on for the usual 400.
+    """
+    args = request.args if args is None else args
+    data = {}
+    for name in ('applicant', 'address', 'query', 'engine', 'mode', 'cursor', 'open_at'):
+        if name in args:
+            data[name] = args[name]
+    if 'open_now' in args:
+        flag = args['open_now'].strip().lower()
+        data['open_now'] = {'1': True, 'true': True, '0': False, 'false': False}.get(flag, flag)
+    for name in ('statuses', 'fields'):
+        values = [v for arg in args.getlist(name) for v in arg.split(',') if v.strip()]
+        if values:
+            data[name] = values
+    for name, convert in (('latitude', float), ('longitude', float), ('page_size', int), ('limit', int)):
+        if name in args:
+            try:
+                data[name] = convert(args[name])
+            except ValueError:
+                data[name] = None if name in ('latitude', 'longitude') else args[name]
+    return data
+
+
+def canonical_query(**params):
+    """Query string with sorted keys and statuses and without unset values."""
+    pairs = []
+    for name, value in sorted(params.items()):
+        if value is None or value == '':
+            continue
+        if isinstance(value, (set, tuple, list)):
+            value = ','.join(sorted(value) if isinstance(value, set) else value)
+        pairs.append((name, value))
+    return urlencode(pairs)
+
+
+def make_etag(canonical, from_snapshot=True):
+    """Strong validator: changes with the permit data and with the query."""
+    return hashlib.md5(f'{data_version(from_snapshot)}?{canonical}'.encode()).hexdigest()
+
+
+def data_version(from_snapshot=True):
+    """Version of the data a response is built from.
+
+    Snapshot answers use the snapshot's digest, so the ETag only moves when
+    the body does. Database answers use the latest `dataset_version` that
+    ingest.py recorded, reused for DATASET_VERSION_TTL seconds, and never
+    load the snapshot. Without the table (migration 0006 not run, e.g. a
+    plain `\\copy` load) they fall back to the snapshot's digest.
+    """
+    if from_snapshot:
+        return snapshot_store.get().version
+    version = dataset_version_cache.get('latest', count=False)
+    if version is None:
+        try:
+            with STAGE_SECONDS.time('db_query'):
+                latest = db.session.execute(db.select(db.func.max(DatasetVersion.version))).scalar()
+            version = f'dataset-{latest or 0}'
+        except DBAPIError:
+            db.session.rollback()
+            app.logger.warning('No dataset_version table; ETags fall back to the snapshot version')
+            version = ''
+        dataset_version_cache.set('latest', version)
+    return version or snapshot_store.get().version
+
+
+def cacheable(response, etag, max_age, canonical):
+    """Add validators and freshness to a successful response."""
+    response = make_response(response)
+    if response.status_code != 200:
+        return response
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    response.headers['Content-Location'] = f'{request.path}?{canonical}'
+    return response
+
+
+def not_modified(etag, max_age):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    return response
+
+
+def compute_nearby(user_lat, user_lon, status_set, mode, cache_key, open_at=None):
+    """Rank permits by road distance and cache the top 5 under `cache_key`."""
+    permits = nearby_candidates(user_lat, user_lon, status_set, mode, open_at)
+    try:
+        results = get_distances(user_lat, user_lon, permits)
+    except UpstreamUnavailable:
+        return estimate_nearby(user_lat, user_lon, status_set, open_at)
+    return rank_nearby(results, user_lat, user_lon, mode, cache_key)
+
+
+def nearby_candidates(user_lat, user_lon, status_set, mode, open_at=None):
+    """The permits a road or hybrid query asks distances for."""
+    if mode == 'hybrid':
+        # Only the geometrically closest candidates are worth a Distance Matrix element
+        return [
+            permit for _, permit in snapshot_store.get().nearest(
+                user_lat, user_lon, HYBRID_CANDIDATES, status_set, open_at
+            )
+        ]
+    return permits_with_status(status_set, open_at)
+
+
+def estimate_nearby(user_lat, user_lon, status_set, open_at=None):
+    """Rank by great-circle distance instead of returning a short or empty list.
+
+    Not cached, so road distances come back as soon as the budget allows.
+    """
+    return [
+        dict(result, distance_source='estimate')
+        for result in nearest_straight_line(user_lat, user_lon, status_set, open_at=open_at)
+    ]
+
+
+def rank_nearby(results, user_lat, user_lon, mode, cache_key):
+    """Top 5 of `results` by road distance, cached under `cache_key`."""
     # Sort by closest and return top 5
     results.sort(key=lambda x: x['distance_km'])
     top5 = results[:5]
+    for result in top5:
+        result['distance_source'] = 'road'
+        if mode == 'hybrid':
+            result['straight_line_km'] = round(haversine_km(
+                user_lat, user_lon, result['latitude'], result['longitude']
+            ), 2)
 
     # Cache the result
-    distance_cache[cache_key] = {
-        'timestamp': time(),
-        'data': top5
-    }
+    distance_cache.set(cache_key, top5)
+    return top5
+
+
+@app.route('/search_nearby/batch', methods=['POST'])
+def search_nearby_batch():
+    """Nearest permits by road for many origins, streamed as NDJSON in input order."""
+    data = request.get_json()
+    origins = data.get('origins')
+    user_statuses = data.get('statuses', ['APPROVED'])
+    k = data.get('k', 5)
+
+    if not isinstance(user_statuses, list):
+        return jsonify({'error': 'statuses must be a list'}), 400
+    if not isinstance(origins, list) or not origins:
+        return jsonify({'error': 'origins must be a non-empty list'}), 400
+    if len(origins) > BATCH_MAX_ORIGINS:
+        return jsonify({'error': f'at most {BATCH_MAX_ORIGINS} origins per batch'}), 400
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= BATCH_MAX_K:
+        return jsonify({'error': f'k must be an integer between 1 and {BATCH_MAX_K}'}), 400
+    try:
+        fields = parse_fields(data.get('fields'))
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    points = []
+    for i, origin in enumerate(origins):
+        lat = origin.get('latitude') if isinstance(origin, dict) else None
+        lon = origin.get('longitude') if isinstance(origin, dict) else None
+        # Checked before the 200 goes out; a bad origin can't fail mid-stream
+        try:
+            points.append(parse_coordinates(lat, lon))
+        except ValueError as error:
+            return jsonify({'error': f'origins[{i}]: {error}'}), 400
+
+    status_set = set(s.strip().upper() for s in user_statuses)
+    permits = [p for p in permits_with_status(status_set) if p.latitude and p.longitude]
+
+    lines = (
+        dumps(dict(line, results=project(line['results'], fields))) + b'\n'
+        for line in nearby_batch_lines(points, status_set, k, permits)
+    )
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
+def nearby_batch_lines(points, status_set, k, permits):
+    """Yield one result dict per origin, fetching distances 25 origins at a time."""
+    for window in chunk_list(list(enumerate(points)), 25):
+        answers = {}
+        cells = {}
+        for i, (lat, lon) in window:
+            cached = distance_cache.get(make_cache_key(lat, lon, status_set)) if k <= 5 else None
+            if cached is not None:
+                answers[i] = cached[:k]
+            else:
+                cells[i] = quantize(lat, lon, PAIR_CACHE_GRID_M)
+
+        failed = fill_pair_distances(set(cells.values()), permits)
+
+        for i, (lat, lon) in window:
+            if i in cells and cells[i] in failed:
+                results = [
+                    dict(result, distance_source='estimate')
+                    for result in nearest_straight_line(lat, lon, status_set, k=k)
+                ]
+            elif i in cells:
+                results = ranked_from_pairs(cells[i], permits, k)
+                if k >= 5:
+                    distance_cache.set(make_cache_key(lat, lon, status_set), results[:5])
+            else:
+                results = answers[i]
+            yield {'index': i, 'latitude': lat, 'longitude': lon, 'results': results}
+
+
+def ranked_from_pairs(cell, permits, k):
+    """Top `k` permits by the cached road distances from `cell`."""
+    results = []
+    for permit in permits:
+        distance_km = pair_distance_cache.get((cell, permit.locationid))
+        if distance_km is not None:
+            results.append(permit_dict(permit, distance_km))
+    results.sort(key=lambda x: x['distance_km'])
+    for result in results[:k]:
+        result['distance_source'] = 'road'
+    return results[:k]
+
+
+@app.route('/permits/in_bbox')
+def permits_in_bbox():
+    """Everything in a map viewport: permits when zoomed in, cluster counts and centroids otherwise.
+
+    `bbox` is `west,south,east,north` in degrees. Clusters come from the
+    snapshot's precomputed per-zoom grid, coarsened so a viewport never
+    spans more than BBOX_MAX_CELLS cells, which bounds payload and work
+    whatever the box.
+    """
+    try:
+        west, south, east, north = (float(v) for v in request.args.get('bbox', '').split(','))
+        zoom = int(request.args.get('zoom', ''))
+    except ValueError:
+        return jsonify({'error': 'bbox (west,south,east,north) and an integer zoom are required'}), 400
+    if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180) or not 0 <= zoom <= 24:
+        return jsonify({'error': 'bbox must be west,south,east,north within -180..180 and -90..90; zoom 0-24'}), 400
+    data = query_args()
+    status_set = set(s.strip().upper() for s in data.get('statuses', ['APPROVED']))
+    try:
+        serialize = RowSerializer(parse_fields(data.get('fields')))
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    canonical = canonical_query(
+        bbox=','.join(repr(v) for v in (west, south, east, north)), zoom=zoom, statuses=status_set,
+        fields=serialize.fields
+    )
+    etag = make_etag(canonical)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag, SNAPSHOT_REFRESH_INTERVAL)
+
+    snapshot = snapshot_store.get()
+    index = snapshot.cluster_index
+    wanted = snapshot.status_wanted(status_set)
+    level = index.level_for(zoom, south, west, north, east, BBOX_MAX_CELLS)
+    box = (south, west, north, east)
+    if zoom >= BBOX_PERMITS_ZOOM and index.count(level, *box, wanted) <= BBOX_MAX_PERMITS:
+        permits = [snapshot.records[i] for i in index.within(level, *box, wanted)]
+        body = {'zoom': level, 'total': len(permits), 'permits': serialize.many(permits)}
+    else:
+        clusters = [
+            {'count': count, 'latitude': round(lat, 6), 'longitude': round(lon, 6)}
+            for count, lat, lon in index.clusters(level, *box, wanted)
+        ]
+        body = {
+            'zoom': level, 'total': sum(c['count'] for c in clusters), 'cell_deg': cell_deg(level),
+            'clusters': clusters,
+        }
+    return cacheable(json_response(body), etag, SNAPSHOT_REFRESH_INTERVAL, canonical)
+
+
+@app.route('/search_food', methods=['POST'])
+def search_food():
+    return search_food_response(request.get_json())
+
+
+@app.route('/search_food', methods=['GET'])
+def search_food_get():
+    """HTTP-cacheable GET form of the food search; same fields, as query parameters."""
+    return search_food_response(query_args(), conditional=True)
+
+
+def search_food_response(data, conditional=False):
+    """Permits ranked by how well their food items match `query` (BM25).
+
+    With `latitude` and `longitude` the matches are ordered by distance
+    instead: great-circle, or in `hybrid` mode the nearest candidates
+    re-ranked by road distance as /search_nearby does. Every result carries
+    its `score`. `open_at` or `open_now` keeps only permits open then.
+    """
+    query = data.get('query')
+    user_statuses = data.get('statuses', ['APPROVED'])
+    user_lat, user_lon = data.get('latitude'), data.get('longitude')
+    located = 'latitude' in data or 'longitude' in data
+    limit = data.get('limit', FOOD_NEARBY_LIMIT if located else FOOD_SEARCH_LIMIT)
+    mode = data.get('mode', 'straight_line')
+
+    if not isinstance(query, str) or not query.strip():
+        return jsonify({'error': 'query is required'}), 400
+    if not isinstance(user_statuses, list):
+        return jsonify({'error': 'statuses must be a list'}), 400
+    if located:
+        try:
+            user_lat, user_lon = parse_coordinates(user_lat, user_lon)
+        except ValueError as error:
+            return jsonify({'error': str(error)}), 400
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= SEARCH_MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit must be an integer between 1 and {SEARCH_MAX_PAGE_SIZE}'}), 400
+    if mode not in FOOD_MODES:
+        return jsonify({'error': f"mode must be one of {', '.join(FOOD_MODES)}"}), 400
+    try:
+        fields = parse_fields(data.get('fields'))
+        open_at = resolve_open_at(data.get('open_at'), data.get('open_now', False))
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    query = query.strip()
+    status_set = set(s.strip().upper() for s in user_statuses)
+
+    if conditional:
+        canonical = canonical_query(
+            query=query, statuses=status_set, latitude=user_lat, longitude=user_lon, limit=limit,
+            mode=mode if located else None, fields=fields,
+            open_at=open_at.isoformat() if open_at is not None else None
+        )
+        etag = make_etag(canonical)
+        if request.if_none_match.contains(etag):
+            return not_modified(etag, SNAPSHOT_REFRESH_INTERVAL)
+
+    snapshot = snapshot_store.get()
+    positions, scores = snapshot.food_matches(query, status_set, open_at)
+    if not located:
+        order = np.argsort(-scores, kind='stable')[:limit]
+        results = [dict(permit_dict(snapshot.records[positions[i]]), score=round(float(scores[i]), 3))
+                   for i in order]
+    else:
+        results = food_nearby(snapshot, positions, scores, user_lat, user_lon, mode, limit)
+    response = json_response(project(results, fields))
+    if not conditional:
+        return response
+    if is_estimate(results):
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    response = cacheable(response, etag, SNAPSHOT_REFRESH_INTERVAL, canonical)
+    if data.get('open_now'):
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def food_nearby(snapshot, positions, scores, user_lat, user_lon, mode, limit):
+    """The `limit` matching permits nearest to the caller, each with its score."""
+    distances = haversine_km_many(user_lat, user_lon, snapshot.latitudes[positions], snapshot.longitudes[positions])
+    located = np.flatnonzero(~np.isnan(distances) & (snapshot.latitudes[positions] != 0))
+    order = located[np.argsort(distances[located], kind='stable')]
+    if mode == 'straight_line':
+        return [
+            dict(permit_dict(snapshot.records[positions[i]], round(float(distances[i]), 2)),
+                 score=round(float(scores[i]), 3))
+            for i in order[:limit]
+        ]
+
+    candidates = order[:max(limit, HYBRID_CANDIDATES)]
+    permits = [snapshot.records[positions[i]] for i in candidates]
+    try:
+        get_distances(user_lat, user_lon, permits)
+    except UpstreamUnavailable:
+        return [
+            dict(permit_dict(snapshot.records[positions[i]], round(float(distances[i]), 2)),
+                 score=round(float(scores[i]), 3), distance_source='estimate')
+            for i in order[:limit]
+        ]
+    # get_distances cached every pair; unreachable permits have none and drop out
+    cell = quantize(user_lat, user_lon, PAIR_CACHE_GRID_M)
+    ranked = []
+    for i, permit in zip(candidates, permits):
+        distance_km = pair_distance_cache.get((cell, permit.locationid))
+        if distance_km is not None:
+            ranked.append((distance_km, dict(permit_dict(permit, distance_km), score=round(float(scores[i]), 3),
+                                             distance_source='road')))
+    ranked.sort(key=lambda pair: pair[0])
+    return [result for _, result in ranked[:limit]]
+
+
+def permits_with_status(status_set, open_at=None):
+    """Every permit whose status is in `status_set`, from the snapshot or as Core rows.
+
+    Filtering on `open_at` always uses the snapshot, which holds the parsed hours.
+    """
+    if USE_PERMIT_SNAPSHOT or open_at is not None:
+        return snapshot_store.get().with_status(status_set, open_at)
+    columns = [getattr(MobileFoodFacilityPermit, name) for name in COLUMNS]
+    with STAGE_SECONDS.time('db_query'):
+        return db.session.execute(
+            db.select(*columns).where(MobileFoodFacilityPermit.status.in_(status_set))
+        ).all()
+
+
+def nearest_straight_line(lat, lon, status_set, k=5, open_at=None):
+    """Top `k` permits by great-circle distance, answered from the spatial index."""
+    results = []
+    for distance, permit in snapshot_store.get().nearest(lat, lon, k, status_set, open_at):
+        results.append(dict(permit_dict(permit), distance_km=round(distance, 2)))
+    return results
+
+
+NEAREST_PERMITS_SQL = db.text("""
+    SELECT applicant, status, address, latitude, longitude, zipcodes, fooditems, dayshours,
+           ST_Distance(geog, origin.point) / 1000.0 AS distance_km
+    FROM mobile_food_facility_permit,
+         (SELECT ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography AS point) AS origin
+    WHERE geog IS NOT NULL AND status IN :statuses
+    ORDER BY geog <-> origin.point
+    LIMIT :k
+""").bindparams(db.bindparam('statuses', expanding=True))
+
+
+def nearest_postgis(lat, lon, status_set, k=5):
+    """Top `k` permits by great-circle distance via the GiST index on `geog`."""
+    with STAGE_SECONDS.time('db_query'):
+        rows = db.session.execute(NEAREST_PERMITS_SQL, {
+            'lat': float(lat), 'lon': float(lon), 'statuses': sorted(status_set), 'k': k
+        }).all()
+    return [dict(row._mapping, distance_km=round(row.distance_km, 2)) for row in rows]
+
+
+def load_permit_rows():
+    """Read just the columns the snapshot serves, as plain tuples."""
+    columns = [getattr(MobileFoodFacilityPermit, name) for name in COLUMNS]
+    with STAGE_SECONDS.time('db_query'):
+        return db.session.execute(db.select(*columns)).all()
+
+
+snapshot_store = SnapshotStore(load_permit_rows, refresh_interval=SNAPSHOT_REFRESH_INTERVAL)
+
+
+def warm_start():
+    """Load the snapshot and everything built from it now, not on the first request.
+
+    gunicorn.conf.py runs this in the master before it forks, so workers
+    start warm and share the snapshot's pages copy-on-write. Returns the
+    seconds it took; calling it again is cheap.
+    """
+    started = perf_counter()
+    with app.app_context():
+        snapshot = snapshot_store.get()
+        if road_grid is not None:
+            road_grid.get(snapshot)
+        # Pooled connections must not be inherited across a fork
+        db.session.remove()
+        db.engine.dispose()
+    # Keep the collector off everything loaded so far; its bookkeeping writes would unshare the pages
+    gc.collect()
+    gc.freeze()
+    return perf_counter() - started
 
-    return jsonify(top5)
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once this process holds a loaded snapshot, 503 until then."""
+    snapshot = snapshot_store.peek()
+    if snapshot is None:
+        return jsonify(ready=False), 503
+    return jsonify(ready=True, permits=len(snapshot), version=snapshot.version, loaded_at=snapshot.loaded_at)
+
+
+@app.route('/admin/reload', methods=['POST'])
+def reload_snapshot():
+    if not ADMIN_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'error': 'forbidden'}), 403
+    snapshot = snapshot_store.reload()
+    return jsonify(permits=len(snapshot), version=snapshot.version, loaded_at=snapshot.loaded_at)
 
 
 def chunk_list(data, size):
@@ -141,50 +1033,240 @@ def chunk_list(data, size):
     for i in range(0, len(data), size):
         yield data[i:i + size]
 
+serialize_permit = RowSerializer(PERMIT_FIELDS)
+
+
+def permit_dict(permit, distance_km=None):
+    """Public JSON shape of a permit, optionally with its distance."""
+    output = serialize_permit(permit)
+    if distance_km is not None:
+        output['distance_km'] = distance_km
+    return output
+
+
+def get_distances(user_lat, user_lon, permits):
+    """Road distances from the caller to each permit, reusing cached pairs.
+
+    Distances are cached per (origin cell, locationid), so only permits this
+    cell hasn't seen recently cost a Distance Matrix element. The misses are
+    packed into as few 25-destination batches as possible. Raises
+    UpstreamUnavailable when the budget can't cover them or Google fails.
+    """
+    cell = quantize(user_lat, user_lon, PAIR_CACHE_GRID_M)
+    results, misses = split_pair_distances(cell, permits)
+    if not misses:
+        return results
+
+    # Batch permits into chunks of 25 for Google API Free tier
+    chunks = list(chunk_list(misses, 25))
+    granted = budgeted_chunks(chunks)
+    if not granted:
+        raise UpstreamUnavailable('Distance Matrix budget exhausted')
+
+    # Ask from the cell centre so every cached pair for the cell is consistent
+    origins = f"{cell[0]},{cell[1]}"
+    futures = [
+        distance_client.executor.submit(fetch_distance_elements, origins, chunk)
+        for chunk in granted
+    ]
+    # Batches run on the executor; the request thread's share is waiting for them
+    with timing('upstream_wait'):
+        for future in as_completed(futures):
+            for permit, distance_km in future.result():
+                pair_distance_cache.set((cell, permit.locationid), distance_km)
+                results.append(permit_dict(permit, distance_km))
+
+    if len(granted) < len(chunks):
+        raise UpstreamUnavailable('Distance Matrix budget exhausted')
+    return results
+
+
+def budgeted_chunks(chunks):
+    """The leading `chunks` the budget covers, one request's elements at a time.
+
+    A query needing more than the bucket holds still gets some batches;
+    their pairs are cached, so the next query from the cell needs fewer.
+    """
+    granted = []
+    for chunk in chunks:
+        if not upstream_budget.try_consume(len(chunk)):
+            break
+        granted.append(chunk)
+    return granted
+
+
+def split_pair_distances(cell, permits):
+    """(results for the permits with a cached distance from `cell`, permits without one)."""
+    results = []
+    misses = []
+    with STAGE_SECONDS.time('cache_lookup'):
+        for permit in permits:
+            if not (permit.latitude and permit.longitude):
+                continue
+            distance_km = pair_distance_cache.get((cell, permit.locationid))
+            if distance_km is None:
+                misses.append(permit)
+            else:
+                results.append(permit_dict(permit, distance_km))
+    return results, misses
+
+
+def fill_pair_distances(cells, permits):
+    """Fetch the uncached (cell, permit) road distances for many origin cells at once.
+
+    Cells missing the same permits share multi-origin x multi-destination
+    matrix requests, so a cold batch costs a handful of requests instead of
+    one per origin. Returns the cells whose distances couldn't be fetched.
+    """
+    groups = {}
+    for cell in cells:
+        misses = [p for p in permits if pair_distance_cache.get((cell, p.locationid), count=False) is None]
+        if misses:
+            key = tuple(p.locationid for p in misses)
+            groups.setdefault(key, (misses, []))[1].append(cell)
+    if not groups:
+        return set()
+
+    futures = {}
+    failed = set()
+    for misses, group_cells in groups.values():
+        for destinations in chunk_list(misses, 25):
+            per_request = max(1, min(25, MATRIX_MAX_ELEMENTS // len(destinations)))
+            for origin_cells in chunk_list(sorted(group_cells), per_request):
+                # Budgeted per request; once it runs dry the remaining cells get estimates
+                if failed or not upstream_budget.try_consume(len(origin_cells) * len(destinations)):
+                    failed.update(origin_cells)
+                    continue
+                future = distance_client.executor.submit(fetch_matrix_elements, origin_cells, destinations)
+                futures[future] = origin_cells
+
+    with timing('upstream_wait'):
+        for future in as_completed(futures):
+            try:
+                for cell, permit, distance_km in future.result():
+                    pair_distance_cache.set((cell, permit.locationid), distance_km)
+            except UpstreamUnavailable:
+                failed.update(futures[future])
+    return failed
+
+
+def call_matrix(origins, destinations, elements):
+    """One timed and counted Distance Matrix request; raises UpstreamUnavailable unless OK."""
+    UPSTREAM_REQUESTS.inc()
+    UPSTREAM_ELEMENTS.inc(amount=elements)
+    with STAGE_SECONDS.time('upstream_batch'):
+        data = distance_client.matrix(origins, destinations)
+    return check_matrix(data)
+
+
+def check_matrix(data):
+    """`data` if the matrix request succeeded; raises UpstreamUnavailable otherwise."""
+    if data is None or data.get("status") != "OK":
+        UPSTREAM_FAILURES.inc()
+        raise UpstreamUnavailable(data.get("status") if data else 'request failed')
+    return data
+
+
+def fetch_matrix_elements(cells, permits_chunk):
+    """Return (cell, permit, distance_km) for every routable origin cell x permit pair.
+
+    Raises UpstreamUnavailable when the whole request fails.
+    """
+    origins = "|".join(f"{lat},{lon}" for lat, lon in cells)
+    destinations = "|".join(f"{p.latitude},{p.longitude}" for p in permits_chunk)
+    data = call_matrix(origins, destinations, len(cells) * len(permits_chunk))
+
+    distances = []
+    for row, cell in zip(data.get('rows', []), cells):
+        for element, permit in zip(row.get('elements', []), permits_chunk):
+            if element.get('status') == 'OK':
+                distances.append((cell, permit, round(element['distance']['value'] / 1000.0, 2)))
+    return distances
+
+
 def get_distance_batch(origins, permits_chunk):
+    try:
+        elements = fetch_distance_elements(origins, permits_chunk)
+    except UpstreamUnavailable:
+        return []
+    return [permit_dict(permit, distance_km) for permit, distance_km in elements]
+
+
+def fetch_distance_elements(origins, permits_chunk):
+    """Return (permit, distance_km) for each permit Google could route to.
+
+    Raises UpstreamUnavailable when the whole request fails.
+    """
+    # Permits without coordinates would shift every element after them
+    permits_chunk = [p for p in permits_chunk if p.latitude and p.longitude]
     destinations = "|".join([
-        f"{p.latitude},{p.longitude}" for p in permits_chunk if p.latitude and p.longitude
+        f"{p.latitude},{p.longitude}" for p in permits_chunk
     ])
-    response = requests.get("https://maps.googleapis.com/maps/api/distancematrix/json", params={
-        "origins": origins,
-        "destinations": destinations,
-        "key": GOOGLE_API_KEY,
-        "units": "metric"
-    })
-
-    if response.status_code != 200:
-        return []
+    data = call_matrix(origins, destinations, len(permits_chunk))
+    return distance_elements(data, permits_chunk)
 
-    data = response.json()
-    if data.get("status") != "OK":
-        return []
 
+def distance_elements(data, permits_chunk):
+    """(permit, distance_km) for each OK element of a one-origin matrix response."""
     distances = []
     for i, permit in enumerate(permits_chunk):
         try:
             element = data['rows'][0]['elements'][i]
             if element['status'] == 'OK':
-                distances.append({
-                    'applicant': permit.applicant,
-                    'status': permit.status,
-                    'address': permit.address,
-                    'latitude': permit.latitude,
-                    'longitude': permit.longitude,
-                    'zipcodes': permit.zipcodes,
-                    'distance_km': round(element['distance']['value'] / 1000.0, 2)
-                })
+                distances.append((permit, round(element['distance']['value'] / 1000.0, 2)))
         except (IndexError, KeyError):
             continue
 
     return distances
 
 
-def make_cache_key(lat, lon, statuses):
+def make_cache_key(lat, lon, statuses, mode='road', open_at=None):
+    lat, lon = quantize(lat, lon, NEARBY_CACHE_GRID_M)
     key = f"{lat}:{lon}:" + ",".join(sorted(statuses))
+    if mode != 'road':
+        key += f":{mode}"
+    if open_at is not None:
+        # Hours repeat weekly, so every week's same slot shares an entry
+        key += f":open{slot_of(open_at)}"
     return hashlib.md5(key.encode()).hexdigest()
 
 
+@app.route('/upstream/budget')
+def upstream_budget_status():
+    return jsonify(upstream_budget.remaining())
+
+
+def collect_cache_stats():
+    for name, cache in (('nearby', distance_cache), ('pairs', pair_distance_cache)):
+        stats = cache.stats()
+        CACHE_HITS.set(stats['hits'], name)
+        CACHE_MISSES.set(stats['misses'], name)
+        CACHE_EVICTIONS.set(stats['evictions'], name)
+    if road_grid is not None:
+        CACHE_HITS.set(road_grid.hits, 'road_grid')
+        CACHE_MISSES.set(road_grid.misses, 'road_grid')
+
+
+metrics_registry.add_collector(collect_cache_stats)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(
+        nearby=distance_cache.stats(),
+        pairs=pair_distance_cache.stats(),
+        coalescing=nearby_flight.stats(),
+        road_grid=road_grid.stats() if road_grid is not None else None
+    )
+
+
 port = int(os.environ.get("PORT", 8080))
 
 if __name__ == '__main__':
+    warm_start()
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file
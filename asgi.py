@@ -0,0 +1,226 @@
+"""ASGI entry point: nearby searches on an event loop, everything else through Flask.
+
+Under `gunicorn app:app` a cold `/search_nearby` holds its worker for the
+whole fan-out, most of it spent waiting on Distance Matrix batches. Here
+`GET` and `POST /search_nearby` run as coroutines instead: the batches go
+out concurrently through `AsyncDistanceMatrixClient`, and one process
+serves any number of searches while they wait. The snapshot, caches,
+budget and road grid are the ones app.py uses. What still blocks
+(snapshot loads and database reads, the SQLite cache and budget) runs on
+a small thread pool inside the Flask app context. Every other route,
+`/search_applicant` included, is the unchanged Flask app behind a WSGI
+adapter, so responses are the same in both modes.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+    gunicorn -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8080 asgi:app
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags, quote_etag
+
+from app import (
+    CACHE_TTL, GOOGLE_API_KEY, IN_FLIGHT, NEARBY_COALESCE_WAIT, PAIR_CACHE_GRID_M, REQUEST_SECONDS,
+    STAGE_SECONDS, UPSTREAM_ELEMENTS, UPSTREAM_REQUESTS, UpstreamUnavailable, app as flask_app,
+    budgeted_chunks, check_matrix, chunk_list, distance_client, distance_elements, estimate_nearby, is_estimate,
+    make_cache_key, metrics_registry, nearby_candidates, nearby_validator, pair_distance_cache,
+    parse_nearby_request, permit_dict, query_args, rank_nearby, ready_nearby, split_pair_distances,
+    warm_start,
+)
+from cache import quantize
+from distance_client import AsyncDistanceMatrixClient
+from serialization import dumps, project
+from singleflight import AsyncSingleFlight
+
+# Same endpoint, timeouts and retries as the sync client; concurrent requests share this many connections
+async_client = AsyncDistanceMatrixClient(
+    GOOGLE_API_KEY,
+    url=distance_client.url,
+    connect_timeout=distance_client.timeout[0],
+    read_timeout=distance_client.timeout[1],
+    max_retries=distance_client.max_retries,
+    pool_size=int(os.getenv('UPSTREAM_ASYNC_POOL_SIZE', 20))
+)
+# Threads for the calls that still block: database reads, snapshot loads, SQLite cache and budget
+blocking = ThreadPoolExecutor(
+    max_workers=int(os.getenv('ASGI_BLOCKING_THREADS', 8)), thread_name_prefix='asgi-blocking'
+)
+nearby_flight = AsyncSingleFlight(wait=NEARBY_COALESCE_WAIT)
+# Threads serving the Flask routes
+wsgi = WSGIMiddleware(flask_app, workers=int(os.getenv('ASGI_WSGI_THREADS', 10)))
+
+
+async def run_sync(fn, *args):
+    """`fn(*args)` on the blocking pool, inside the Flask app context `db.session` needs."""
+    def call():
+        with flask_app.app_context():
+            return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(blocking, call)
+
+
+async def fetch_distance_elements(origins, permits_chunk):
+    """Async twin of app.fetch_distance_elements."""
+    destinations = "|".join(f"{p.latitude},{p.longitude}" for p in permits_chunk)
+    UPSTREAM_REQUESTS.inc()
+    UPSTREAM_ELEMENTS.inc(amount=len(permits_chunk))
+    with STAGE_SECONDS.time('upstream_batch'):
+        data = await async_client.matrix(origins, destinations)
+    return distance_elements(check_matrix(data), permits_chunk)
+
+
+async def get_distances(user_lat, user_lon, permits):
+    """Async twin of app.get_distances: every uncached batch in flight at once."""
+    cell = quantize(user_lat, user_lon, PAIR_CACHE_GRID_M)
+    results, misses = split_pair_distances(cell, permits)
+    if not misses:
+        return results
+
+    chunks = list(chunk_list(misses, 25))
+    granted = await run_sync(budgeted_chunks, chunks)
+    if not granted:
+        raise UpstreamUnavailable('Distance Matrix budget exhausted')
+
+    origins = f"{cell[0]},{cell[1]}"
+    batches = await asyncio.gather(
+        *(fetch_distance_elements(origins, chunk) for chunk in granted),
+        return_exceptions=True
+    )
+    # Keep what did arrive, as the sync path does, before reporting a failed batch
+    failure = None
+    for batch in batches:
+        if isinstance(batch, Exception):
+            failure = failure or batch
+            continue
+        for permit, distance_km in batch:
+            pair_distance_cache.set((cell, permit.locationid), distance_km)
+            results.append(permit_dict(permit, distance_km))
+    if failure is not None:
+        raise failure
+    if len(granted) < len(chunks):
+        raise UpstreamUnavailable('Distance Matrix budget exhausted')
+    return results
+
+
+async def compute_nearby(user_lat, user_lon, status_set, mode, cache_key, open_at=None):
+    permits = await run_sync(nearby_candidates, user_lat, user_lon, status_set, mode, open_at)
+    try:
+        results = await get_distances(user_lat, user_lon, permits)
+    except UpstreamUnavailable:
+        return await run_sync(estimate_nearby, user_lat, user_lon, status_set, open_at)
+    return await run_sync(rank_nearby, results, user_lat, user_lon, mode, cache_key)
+
+
+async def nearby_results(user_lat, user_lon, status_set, mode, open_at=None):
+    """Async twin of app.nearby_results."""
+    cache_key = make_cache_key(user_lat, user_lon, status_set, mode, open_at)
+    results = await run_sync(ready_nearby, user_lat, user_lon, status_set, mode, cache_key, open_at)
+    if results is not None:
+        return results
+    return await nearby_flight.do(
+        cache_key, lambda: compute_nearby(user_lat, user_lon, status_set, mode, cache_key, open_at)
+    )
+
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def search_nearby(scope, receive):
+    """(status, body, extra headers) for GET or POST /search_nearby."""
+    if scope['method'] == 'GET':
+        data = query_args(MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)))
+    else:
+        try:
+            data = json.loads(await read_body(receive))
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return 400, {'error': 'request body must be a JSON object'}, []
+
+    try:
+        user_lat, user_lon, status_set, mode, fields, open_at = parse_nearby_request(data)
+    except ValueError as error:
+        return 400, {'error': str(error)}, []
+
+    if scope['method'] == 'POST':
+        return 200, project(await nearby_results(user_lat, user_lon, status_set, mode, open_at), fields), []
+
+    user_lat, user_lon, canonical, etag = await run_sync(
+        nearby_validator, user_lat, user_lon, status_set, mode, fields, open_at
+    )
+    validators = [('etag', quote_etag(etag)), ('cache-control', f'public, max-age={CACHE_TTL}')]
+    if parse_etags(header(scope, b'if-none-match')).contains(etag):
+        return 304, None, validators
+    results = await nearby_results(user_lat, user_lon, status_set, mode, open_at)
+    if is_estimate(results):
+        return 200, project(results, fields), [('cache-control', 'no-cache')]
+    if data.get('open_now'):
+        # Revalidate every time: the slot, and with it the answer, moves on
+        validators = [validators[0], ('cache-control', 'no-cache')]
+    return 200, project(results, fields), validators + [('content-location', f"{scope['path']}?{canonical}")]
+
+
+async def http(scope, receive, send):
+    started = perf_counter()
+    IN_FLIGHT.inc()
+    status = 500
+    try:
+        status, payload, headers = await search_nearby(scope, receive)
+        body = dumps(payload) if payload is not None else b''
+        headers = [('content-type', 'application/json'), ('content-length', str(len(body)))] + headers
+        origin = header(scope, b'origin')
+        if origin:
+            # What flask-cors sends for the Flask routes
+            headers += [('access-control-allow-origin', origin), ('vary', 'Origin')]
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.encode(), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+    finally:
+        IN_FLIGHT.dec()
+        REQUEST_SECONDS.observe(perf_counter() - started, '/search_nearby', scope['method'], status)
+        metrics_registry.maybe_flush()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await asyncio.get_running_loop().run_in_executor(blocking, warm_start)
+            except Exception:
+                # Serve anyway; the first search loads the snapshot and /ready says 503 until then
+                flask_app.logger.exception('Warm start failed')
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['path'] == '/search_nearby' and scope['method'] in ('GET', 'POST'):
+        return await http(scope, receive, send)
+    return await wsgi(scope, receive, send)
@@ -0,0 +1,551 @@
+"""Benchmark the API on a synthetic permit table and a local Distance Matrix stub.
+
+Generates `--rows` permits inside the San Francisco bounding box, loads
+them into `--database-url` (a throwaway SQLite file by default; the table
+is dropped and recreated, so never point it at real data), points the
+app at a `DistanceMatrixStub` and replays requests through the Flask test
+client. Each scenario starts with empty caches. The report gives p50/p95/
+p99 latency, throughput and peak RSS as JSON, so runs from two commits can
+be diffed or compared with `--compare`.
+
+    python benchmark.py --rows 500
+    python benchmark.py --rows 50000 --stub-latency-ms 80 --out after.json
+    python benchmark.py --compare before.json after.json
+
+`--load-test` also starts the sync deployment (`gunicorn app:app`, one sync
+worker, as in the Dockerfile) and the async one (`uvicorn asgi:app`, one
+process) on the benchmark database and stub, and fires `--requests` cold
+road searches at each from `--load-concurrency` clients. That needs a
+database both servers can open, i.e. the default SQLite file or a real
+`--database-url`.
+
+    python benchmark.py --rows 2000 --stub-latency-ms 80 --scenarios= --load-test
+
+`--startup-test` starts `gunicorn -w --startup-workers app:app` twice,
+warming each worker itself (GUNICORN_PRELOAD=0) and warming once in the
+master before forking, and reports the seconds until every worker can
+serve, the CPU spent getting there and each worker's memory. RSS counts
+pages shared with the master in every worker, so PSS and USS (from
+/proc, Linux only) are what show the sharing.
+
+    python benchmark.py --rows 50000 --scenarios= --startup-test
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+SF_BOUNDS = (37.70, 37.82, -122.52, -122.36)  # min lat, max lat, min lon, max lon
+STATUSES = (('APPROVED', 0.45), ('REQUESTED', 0.25), ('EXPIRED', 0.25), ('SUSPEND', 0.05))
+WORDS = ('taco', 'coffee', 'pizza', 'burrito', 'curry', 'noodle', 'bbq', 'crepe',
+         'kebab', 'dumpling', 'sushi', 'waffle', 'grill', 'express', 'kitchen', 'cart')
+STREETS = ('MARKET ST', 'MISSION ST', 'SANSOME ST', 'FOLSOM ST', 'HOWARD ST',
+           'BRYANT ST', 'VALENCIA ST', 'GEARY BLVD', 'OCTAVIA ST', 'SAN BRUNO AVE')
+
+SCENARIOS = (
+    'search_applicant_sql', 'search_applicant_index', 'search_applicant_scan',
+    'search_nearby_straight_line', 'search_nearby_hybrid', 'search_nearby_road',
+    'search_nearby_batch', 'snapshot_build',
+)
+# Road mode asks for a distance to every permit with a wanted status
+ROAD_MAX_ROWS = 50000
+# Deployments compared by --load-test; one process each
+LOAD_TEST_SERVERS = {
+    'sync': [sys.executable, '-m', 'gunicorn', '-b', '127.0.0.1:{port}', 'app:app'],
+    'async': [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', '{port}',
+              '--log-level', 'warning', 'asgi:app'],
+}
+
+
+def synthetic_rows(n, seed=0):
+    """Yield `n` permit dicts; about 1% have no coordinates, like the real export."""
+    rng = random.Random(seed)
+    names, weights = zip(*STATUSES)
+    min_lat, max_lat, min_lon, max_lon = SF_BOUNDS
+    for locationid in range(1, n + 1):
+        located = rng.random() >= 0.01
+        yield {
+            'locationid': locationid,
+            'applicant': f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {locationid}",
+            'status': rng.choices(names, weights)[0],
+            'address': f"{rng.randint(1, 3999)} {rng.choice(STREETS)}",
+            'latitude': rng.uniform(min_lat, max_lat) if located else None,
+            'longitude': rng.uniform(min_lon, max_lon) if located else None,
+            'zipcodes': str(rng.randint(28000, 29500)),
+        }
+
+
+def random_point(rng):
+    min_lat, max_lat, min_lon, max_lon = SF_BOUNDS
+    return round(rng.uniform(min_lat, max_lat), 6), round(rng.uniform(min_lon, max_lon), 6)
+
+
+def percentiles(samples):
+    """p50/p95/p99/mean/max of `samples` (seconds) in milliseconds, nearest-rank."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))] * 1000
+
+    return {
+        'p50': round(rank(50), 3),
+        'p95': round(rank(95), 3),
+        'p99': round(rank(99), 3),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 3),
+        'max': round(ordered[-1] * 1000, 3),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def measure(call, requests, concurrency=1):
+    """Run `call(rng)` `requests` times; returns latency, throughput and error counts."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        rng = random.Random(i)
+        started = perf_counter()
+        ok = call(rng)
+        elapsed = perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests)))
+    else:
+        for i in range(requests):
+            one(i)
+    seconds = perf_counter() - started
+    return {
+        'requests': requests,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(requests / seconds, 1) if seconds else None,
+        'latency_ms': percentiles(latencies),
+    }
+
+
+def load_dataset(app_module, rows, seed, batch_size=10000):
+    """Recreate the permit table holding `rows` synthetic permits."""
+    db = app_module.db
+    table = app_module.MobileFoodFacilityPermit.__table__
+    db.drop_all()
+    db.create_all()
+    batch = []
+    for row in synthetic_rows(rows, seed):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+
+def scenario_calls(app_module, batch_size):
+    """Map each scenario name to a `call(rng) -> ok` function."""
+    local = threading.local()
+
+    def post(path, payload):
+        # One test client per thread when running concurrently
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app_module.app.test_client()
+        response = client.post(path, json=payload)
+        response.get_data()
+        return response.status_code == 200
+
+    def applicant(engine):
+        def call(rng):
+            # One in five is the broad "everything" query that used to truncate
+            query = '' if rng.random() < 0.2 else rng.choice(WORDS)
+            return post('/search_applicant', {'applicant': query, 'engine': engine})
+        return call
+
+    def nearby(mode):
+        def call(rng):
+            lat, lon = random_point(rng)
+            return post('/search_nearby', {'latitude': lat, 'longitude': lon, 'mode': mode})
+        return call
+
+    def batch(rng):
+        origins = []
+        for _ in range(batch_size):
+            lat, lon = random_point(rng)
+            origins.append({'latitude': lat, 'longitude': lon})
+        return post('/search_nearby/batch', {'origins': origins})
+
+    def snapshot_build(rng):
+        return len(app_module.snapshot_store.reload()) >= 0
+
+    return {
+        'search_applicant_sql': applicant('sql'),
+        'search_applicant_index': applicant('index'),
+        'search_applicant_scan': applicant('scan'),
+        'search_nearby_straight_line': nearby('straight_line'),
+        'search_nearby_hybrid': nearby('hybrid'),
+        'search_nearby_road': nearby('road'),
+        'search_nearby_batch': batch,
+        'snapshot_build': snapshot_build,
+    }
+
+
+def reset_caches(app_module):
+    app_module.distance_cache.clear()
+    app_module.pair_distance_cache.clear()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def post_json(url, payload, timeout=120):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+        return response.status == 200
+
+
+def serve(command, env, timeout=30.0):
+    """Start a server from `command` (with a `{port}` slot); returns (process, base URL) once it answers."""
+    port = free_port()
+    process = subprocess.Popen(
+        [part.format(port=port) for part in command], env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base = f'http://127.0.0.1:{port}'
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{command[2]} exited with {process.returncode}')
+        try:
+            urllib.request.urlopen(base + '/', timeout=1).read()
+            return process, base
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{command[2]} did not start within {timeout}s')
+
+
+def load_test(database_url, stub, requests, concurrency, servers=LOAD_TEST_SERVERS):
+    """Cold road searches against each deployment in `servers`; returns results and the speedup."""
+    env = dict(os.environ, DATABASE_URL=database_url, DISTANCE_MATRIX_URL=stub.url)
+    env.pop('METRICS_DIR', None)
+    results = {}
+    for name, command in servers.items():
+        process, base = serve(command, env)
+        try:
+            # Load the snapshot before the clock starts
+            post_json(base + '/search_nearby', {'latitude': 37.77, 'longitude': -122.42, 'mode': 'straight_line'})
+
+            def call(rng):
+                lat, lon = random_point(rng)
+                try:
+                    return post_json(base + '/search_nearby', {'latitude': lat, 'longitude': lon})
+                except OSError:
+                    return False
+
+            elements_before = stub.elements
+            result = measure(call, requests, concurrency)
+            result['upstream_elements'] = stub.elements - elements_before
+            results[name] = result
+        finally:
+            process.terminate()
+            process.wait(10)
+    if 'sync' in results and 'async' in results and results['sync']['throughput_rps']:
+        results['async_speedup'] = round(results['async']['throughput_rps'] / results['sync']['throughput_rps'], 2)
+    return results
+
+
+# Deployments compared by --startup-test
+STARTUP_MODES = {'lazy': '0', 'preload': '1'}
+
+
+def children(pid):
+    """Pids of the processes whose parent is `pid`."""
+    found = []
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    # The command name can hold spaces; fields after it are fixed
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == pid:
+                found.append(int(name))
+    return found
+
+
+def cpu_seconds(pid):
+    """User plus system CPU time of `pid`."""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def memory_mb(pid):
+    """RSS, PSS (shared pages split between their users) and USS (private pages) of `pid`."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': values['Rss'],
+        'pss': values['Pss'],
+        'uss': values['Private_Clean'] + values['Private_Dirty'],
+    }
+
+
+def startup_test(database_url, requests, workers, modes=STARTUP_MODES, timeout=120.0):
+    """Start gunicorn with and without preload; returns readiness time, CPU and memory per worker."""
+    env = dict(os.environ, DATABASE_URL=database_url)
+    env.pop('METRICS_DIR', None)
+    results = {}
+    for name, preload in modes.items():
+        port = free_port()
+        base = f'http://127.0.0.1:{port}'
+        started = perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app'],
+            env=dict(env, GUNICORN_PRELOAD=preload), cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        # gunicorn.conf.py logs one line per warm start: once in the master, or once per worker
+        warmed = []
+
+        def read_log():
+            for line in process.stderr:
+                if 'Warm start took' in line:
+                    warmed.append(line)
+
+        threading.Thread(target=read_log, daemon=True).start()
+        try:
+            expected = 1 if preload == '1' else workers
+            deadline = started + timeout
+            while len(warmed) < expected or len(children(process.pid)) < workers:
+                if process.poll() is not None or perf_counter() > deadline:
+                    raise RuntimeError(f'gunicorn ({name}) did not warm up')
+                time.sleep(0.02)
+            while True:
+                try:
+                    urllib.request.urlopen(base + '/ready', timeout=1).read()
+                    break
+                except OSError:
+                    if perf_counter() > deadline:
+                        raise RuntimeError(f'gunicorn ({name}) never became ready')
+                    time.sleep(0.02)
+            ready_seconds = perf_counter() - started
+            pids = children(process.pid)
+            startup_cpu = cpu_seconds(process.pid) + sum(cpu_seconds(pid) for pid in pids)
+
+            def call(rng):
+                lat, lon = random_point(rng)
+                try:
+                    post_json(base + '/search_nearby', {'latitude': lat, 'longitude': lon, 'mode': 'straight_line'})
+                    return post_json(base + '/search_applicant', {'applicant': rng.choice(WORDS)})
+                except OSError:
+                    return False
+
+            # Traffic on every worker, so the memory below is that of a worker in use
+            result = measure(call, requests, concurrency=workers)
+            memory = [memory_mb(pid) for pid in pids]
+            result.update({
+                'workers': len(pids),
+                'ready_seconds': round(ready_seconds, 3),
+                'startup_cpu_seconds': round(startup_cpu, 3),
+                'worker_memory_mb': {
+                    key: round(sum(m[key] for m in memory) / len(memory), 1) for key in ('rss', 'pss', 'uss')
+                },
+            })
+            results[name] = result
+        finally:
+            process.terminate()
+            process.wait(10)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(rows=500, requests=200, scenarios=SCENARIOS, seed=0, concurrency=1,
+        stub_latency=0.0, stub_error_rate=0.0, batch_size=25, road_max_rows=ROAD_MAX_ROWS,
+        load_concurrency=None, startup_workers=None):
+    """Build the dataset, run `scenarios` and return the report dict.
+
+    The app module is imported here, so DATABASE_URL must point at the
+    benchmark database first.
+    """
+    import app as app_module
+    from distance_matrix_stub import DistanceMatrixStub
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'rows': rows,
+            'requests': requests,
+            'concurrency': concurrency,
+            'seed': seed,
+            'stub_latency_ms': stub_latency * 1000,
+            'stub_error_rate': stub_error_rate,
+        },
+        'scenarios': {},
+    }
+
+    with app_module.app.app_context():
+        started = perf_counter()
+        load_dataset(app_module, rows, seed)
+        report['meta']['load_seconds'] = round(perf_counter() - started, 3)
+
+    stub = DistanceMatrixStub(latency=stub_latency, error_rate=stub_error_rate, seed=seed).start()
+    original_url = app_module.distance_client.url
+    app_module.distance_client.url = stub.url
+    try:
+        calls = scenario_calls(app_module, batch_size)
+        for name in scenarios:
+            if name in ('search_nearby_road', 'search_nearby_batch') and rows > road_max_rows:
+                report['scenarios'][name] = {'skipped': f'more than {road_max_rows} rows'}
+                continue
+            with app_module.app.app_context():
+                reset_caches(app_module)
+                app_module.snapshot_store.reload()
+                count = requests
+                if name == 'snapshot_build':
+                    count = min(requests, 5)
+                elif name == 'search_nearby_batch':
+                    # `requests` origins in total, `batch_size` per call
+                    count = max(1, -(-requests // batch_size))
+                elements_before = stub.elements
+                result = measure(calls[name], count, 1 if name == 'snapshot_build' else concurrency)
+                result['upstream_elements'] = stub.elements - elements_before
+                result['peak_rss_mb'] = peak_rss_mb()
+                report['scenarios'][name] = result
+        if load_concurrency:
+            report['load_test'] = load_test(
+                app_module.app.config['SQLALCHEMY_DATABASE_URI'], stub, requests, load_concurrency
+            )
+        if startup_workers:
+            report['startup_test'] = startup_test(
+                app_module.app.config['SQLALCHEMY_DATABASE_URI'], requests, startup_workers
+            )
+    finally:
+        app_module.distance_client.url = original_url
+        stub.stop()
+
+    report['meta']['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+def compare(before, after):
+    """Lines showing how each scenario's p50/p95/p99 and throughput moved."""
+    lines = []
+    for name, new in after['scenarios'].items():
+        old = before['scenarios'].get(name)
+        if not old or 'latency_ms' not in old or 'latency_ms' not in new:
+            continue
+        parts = []
+        for key in ('p50', 'p95', 'p99'):
+            a, b = old['latency_ms'][key], new['latency_ms'][key]
+            parts.append(f"{key} {a:.1f}->{b:.1f}ms ({(b - a) / a * 100 if a else 0:+.0f}%)")
+        parts.append(f"{old['throughput_rps']}->{new['throughput_rps']} rps")
+        lines.append(f"{name}: " + ', '.join(parts))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500, help='synthetic permits, e.g. 500, 50000, 1000000')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stub-latency-ms', type=float, default=0.0)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    parser.add_argument('--batch-size', type=int, default=25, help='origins per /search_nearby/batch call')
+    parser.add_argument('--road-max-rows', type=int, default=ROAD_MAX_ROWS,
+                        help='skip road and batch scenarios above this many rows')
+    parser.add_argument('--database-url', default=os.getenv('BENCHMARK_DATABASE_URL'),
+                        help='scratch database to load (defaults to a temporary SQLite file)')
+    parser.add_argument('--load-test', action='store_true',
+                        help='also compare the sync and async deployments under concurrent road searches')
+    parser.add_argument('--load-concurrency', type=int, default=32, help='clients in the load test')
+    parser.add_argument('--startup-test', action='store_true',
+                        help='also compare gunicorn startup and worker memory with and without preload')
+    parser.add_argument('--startup-workers', type=int, default=4, help='gunicorn workers in the startup test')
+    parser.add_argument('--out', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='diff two reports')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        print('\n'.join(compare(before, after)))
+        return 0
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios).difference(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Never fall back to the app's DATABASE_URL: the benchmark drops the table
+        os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'benchmark.sqlite3')}"
+        report = run(args.rows, args.requests, scenarios, seed=args.seed, concurrency=args.concurrency,
+                     stub_latency=args.stub_latency_ms / 1000.0, stub_error_rate=args.stub_error_rate,
+                     batch_size=args.batch_size, road_max_rows=args.road_max_rows,
+                     load_concurrency=args.load_concurrency if args.load_test else None,
+                     startup_workers=args.startup_workers if args.startup_test else None)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""Bounded result caches for the search endpoints.
+
+`TTLCache` is an LRU map with a hard entry (and optional byte) budget whose
+expired entries are actually removed, not just ignored. `SQLiteCache` offers
+the same behaviour from a file shared by every worker on the host.
+`quantize` snaps a coordinate onto a metric grid so callers a few metres
+apart share a key.
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from math import cos, floor, radians
+from time import time
+
+METERS_PER_DEGREE = 111195.0
+
+
+def quantize(lat, lon, grid_m=50):
+    """Snap (lat, lon) to the centre of its `grid_m` x `grid_m` metre cell."""
+    lat_step = grid_m / METERS_PER_DEGREE
+    lat_q = (floor(float(lat) / lat_step) + 0.5) * lat_step
+    # Longitude degrees shrink with latitude; size the step at the snapped row
+    lon_step = grid_m / (METERS_PER_DEGREE * max(cos(radians(lat_q)), 1e-6))
+    lon_q = (floor(float(lon) / lon_step) + 0.5) * lon_step
+    return round(lat_q, 6), round(lon_q, 6)
+
+
+def estimate_size(value):
+    """Rough byte size of a JSON-serialisable cache value."""
+    return len(json.dumps(value, separators=(',', ':'), default=str))
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry and hit/miss counters.
+
+    Entries live for `ttl` seconds. Once `max_entries` (or `max_bytes`, when
+    set) is exceeded the least recently used entries are evicted. Expired
+    entries are dropped on access and by a full sweep at most every
+    `sweep_interval` seconds, so idle keys do not pile up forever.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600, max_bytes=None, sweep_interval=60, clock=time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._last_sweep = clock()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, count=True):
+        """Return the cached value for `key`, or None when absent or expired."""
+        with self._lock:
+            now = self.clock()
+            self._maybe_sweep(now)
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[2]
+
+    def set(self, key, value):
+        """Store `value` under `key`, evicting LRU entries to stay in budget."""
+        size = estimate_size(value) if self.max_bytes else 0
+        with self._lock:
+            now = self.clock()
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (now + self.ttl, size, value)
+            self._bytes += size
+            self._maybe_sweep(now)
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def purge_expired(self):
+        """Drop every expired entry now; returns how many were removed."""
+        with self._lock:
+            return self._purge(self.clock())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def _maybe_sweep(self, now):
+        if now - self._last_sweep >= self.sweep_interval:
+            self._purge(now)
+
+    def _purge(self, now):
+        self._last_sweep = now
+        expired = [key for key, (expires_at, _, _) in self._data.items() if expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+
+class SQLiteCache:
+    """TTL/LRU cache stored in a local SQLite file shared by every worker.
+
+    Gunicorn workers on one host open the same WAL-mode database, so a hot
+    query only misses once per host and the entries are stored once. WAL lets
+    readers run alongside each other and alongside the single writer. Values
+    must be JSON-serialisable; eviction and expiry follow `TTLCache`.
+    Counters are per process, the entry and byte totals are shared.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=3600, max_bytes=None, sweep_interval=60,
+                 touch_interval=1.0, clock=time):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        # Refreshing LRU order is a write; skip it for entries touched very recently
+        self.touch_interval = touch_interval
+        self.clock = clock
+        self._local = threading.local()
+        self._last_sweep = clock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                ' key TEXT PRIMARY KEY,'
+                ' value TEXT NOT NULL,'
+                ' expires_at REAL NOT NULL,'
+                ' last_access REAL NOT NULL,'
+                ' size INTEGER NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS locks ('
+                ' name TEXT PRIMARY KEY,'
+                ' owner TEXT NOT NULL,'
+                ' expires_at REAL NOT NULL)'
+            )
+
+    def _connect(self):
+        # One connection per thread and per process; forked workers reconnect
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _key(key):
+        return key if isinstance(key, str) else json.dumps(key)
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, count=True):
+        """Return the cached value for `key`, or None when absent or expired."""
+        conn = self._connect()
+        now = self.clock()
+        self._maybe_sweep(now)
+        key = self._key(key)
+        row = conn.execute(
+            'SELECT value, expires_at, last_access FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is not None and row[1] <= now:
+            conn.execute('DELETE FROM cache WHERE key = ? AND expires_at <= ?', (key, now))
+            self.expirations += 1
+            row = None
+        if row is None:
+            if count:
+                self.misses += 1
+            return None
+        if now - row[2] >= self.touch_interval:
+            conn.execute('UPDATE cache SET last_access = ? WHERE key = ?', (now, key))
+        if count:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store `value` under `key`, evicting LRU entries to stay in budget."""
+        conn = self._connect()
+        now = self.clock()
+        payload = json.dumps(value, separators=(',', ':'), default=str)
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at, last_access, size) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (self._key(key), payload, now + self.ttl, now, len(payload))
+        )
+        self._maybe_sweep(now)
+        self._evict(conn)
+
+    def _evict(self, conn):
+        overflow = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.max_entries
+        if overflow > 0:
+            self._evict_oldest(conn, overflow)
+        if self.max_bytes:
+            while conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0] > self.max_bytes:
+                if not self._evict_oldest(conn, 1):
+                    break
+
+    def _evict_oldest(self, conn, count):
+        removed = conn.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access LIMIT ?)',
+            (count,)
+        ).rowcount
+        self.evictions += removed
+        return removed
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache WHERE key = ?', (self._key(key),))
+
+    def _owner(self):
+        return f'{os.getpid()}:{threading.get_ident()}'
+
+    def acquire_lock(self, name, ttl=10.0):
+        """Take a host-wide named lock; it lapses after `ttl` seconds if never released."""
+        conn = self._connect()
+        now = self.clock()
+        conn.execute('DELETE FROM locks WHERE name = ? AND expires_at <= ?', (name, now))
+        acquired = conn.execute(
+            'INSERT OR IGNORE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)',
+            (name, self._owner(), now + ttl)
+        ).rowcount
+        return acquired == 1
+
+    def release_lock(self, name):
+        self._connect().execute(
+            'DELETE FROM locks WHERE name = ? AND owner = ?', (name, self._owner())
+        )
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache')
+
+    def purge_expired(self):
+        """Drop every expired entry now; returns how many were removed."""
+        return self._purge(self.clock())
+
+    def stats(self):
+        entries, size = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache'
+        ).fetchone()
+        return {
+            'entries': entries,
+            'bytes': size,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def _maybe_sweep(self, now):
+        if now - self._last_sweep >= self.sweep_interval:
+            self._purge(now)
+
+    def _purge(self, now):
+        self._last_sweep = now
+        removed = self._connect().execute('DELETE FROM cache WHERE expires_at <= ?', (now,)).rowcount
+        self.expirations += removed
+        return removed
+
+
+def make_cache(backend='memory', path=None, **kwargs):
+    """Build a cache for `backend`: 'memory' (per process) or 'sqlite' (per host)."""
+    if backend == 'memory':
+        return TTLCache(**kwargs)
+    if backend == 'sqlite':
+        if not path:
+            raise ValueError('the sqlite cache backend needs a path')
+        return SQLiteCache(path, **kwargs)
+    raise ValueError(f'unknown cache backend: {backend}')
@@ -0,0 +1,124 @@
+"""Multi-resolution permit counts for map viewports.
+
+For every zoom level up to `MAX_LEVEL` the permits are bucketed into a
+square latitude/longitude grid whose cells are `cell_deg(zoom)` wide,
+about 32 px on a 256 px web-map tile. Each level keeps one group per
+populated (cell, status) pair, sorted by cell, with the permit count and
+coordinate sums, plus the permit positions in group order. A viewport is
+one contiguous run of groups per grid row, so clusters (count and
+centroid) come from a bounded number of cells, and the permits of a small
+viewport are read straight from its cells, however many permits the
+table holds.
+"""
+import numpy as np
+
+# Zoom levels with precomputed cells; past this the map shows permits
+MAX_LEVEL = 16
+# Grid cells per 256 px tile edge
+CELLS_PER_TILE = 8
+
+
+def cell_deg(zoom):
+    """Cell edge in degrees at web-map zoom `zoom`."""
+    return 360.0 / (CELLS_PER_TILE * 2 ** zoom)
+
+
+def _ranges(starts, stops):
+    """Concatenated `arange(start, stop)` for each pair."""
+    lengths = stops - starts
+    return np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+
+class _Level:
+    __slots__ = ('cell', 'cols', 'keys', 'starts', 'stops', 'order', 'counts', 'lat_sums', 'lon_sums')
+
+
+class ClusterIndex:
+    """Per-zoom cell aggregates over coordinate arrays.
+
+    `latitudes` and `longitudes` are float arrays with NaN for permits
+    without a location; `status_codes` index `n_statuses` statuses, -1 for
+    none. Results refer to permits by position in those arrays.
+    """
+
+    def __init__(self, latitudes, longitudes, status_codes, n_statuses):
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.status_codes = status_codes
+        self.n_statuses = max(n_statuses, 1)
+        located = np.flatnonzero(
+            ~np.isnan(latitudes) & ~np.isnan(longitudes) & (latitudes != 0) & (longitudes != 0)
+            & (status_codes >= 0)
+        )
+        self.levels = tuple(self._build(zoom, located) for zoom in range(MAX_LEVEL + 1))
+
+    def _build(self, zoom, located):
+        level = _Level()
+        level.cell = cell_deg(zoom)
+        level.cols = CELLS_PER_TILE * 2 ** zoom
+        row, col = self._row_col(level, self.latitudes[located], self.longitudes[located])
+        keys = (row * level.cols + col) * self.n_statuses + self.status_codes[located]
+        order = np.argsort(keys, kind='stable')
+        level.order = located[order].astype(np.int32)
+        level.keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        level.starts = starts.astype(np.int32)
+        level.stops = (starts + counts).astype(np.int32)
+        level.counts = counts.astype(np.int32)
+        level.lat_sums = np.add.reduceat(self.latitudes[level.order], starts) if len(starts) else np.empty(0)
+        level.lon_sums = np.add.reduceat(self.longitudes[level.order], starts) if len(starts) else np.empty(0)
+        for array in (level.order, level.keys, level.starts, level.stops, level.counts,
+                      level.lat_sums, level.lon_sums):
+            array.flags.writeable = False
+        return level
+
+    @staticmethod
+    def _row_col(level, lat, lon):
+        return (np.floor((lat + 90.0) / level.cell).astype(np.int64),
+                np.floor((lon + 180.0) / level.cell).astype(np.int64))
+
+    def level_for(self, zoom, south, west, north, east, max_cells):
+        """`zoom`, coarsened until the box is at most `max_cells` cells across."""
+        zoom = max(0, min(int(zoom), MAX_LEVEL))
+        while zoom > 0 and max(north - south, east - west) / cell_deg(zoom) > max_cells - 1:
+            zoom -= 1
+        return zoom
+
+    def _groups(self, level, south, west, north, east, wanted):
+        """Indexes of the wanted-status groups in cells overlapping the box."""
+        (row0, row1), (col0, col1) = self._row_col(level, np.array([south, north]), np.array([west, east]))
+        rows = np.arange(row0, row1 + 1)
+        lo = np.searchsorted(level.keys, (rows * level.cols + col0) * self.n_statuses, side='left')
+        hi = np.searchsorted(level.keys, (rows * level.cols + col1 + 1) * self.n_statuses, side='left')
+        groups = _ranges(lo, hi)
+        return groups[wanted[level.keys[groups] % self.n_statuses]]
+
+    def clusters(self, zoom, south, west, north, east, wanted):
+        """(count, latitude, longitude) per cell at `zoom` overlapping the box, row by row.
+
+        `wanted` is a boolean array over the statuses; cells without a
+        wanted permit are left out.
+        """
+        level = self.levels[zoom]
+        groups = self._groups(level, south, west, north, east, wanted)
+        if not len(groups):
+            return []
+        # Groups of one cell are adjacent
+        _, firsts = np.unique(level.keys[groups] // self.n_statuses, return_index=True)
+        counts = np.add.reduceat(level.counts[groups], firsts)
+        lats = np.add.reduceat(level.lat_sums[groups], firsts) / counts
+        lons = np.add.reduceat(level.lon_sums[groups], firsts) / counts
+        return list(zip(counts.tolist(), lats.tolist(), lons.tolist()))
+
+    def count(self, zoom, south, west, north, east, wanted):
+        """Wanted permits in the cells at `zoom` overlapping the box; an upper bound for the box."""
+        level = self.levels[zoom]
+        return int(level.counts[self._groups(level, south, west, north, east, wanted)].sum())
+
+    def within(self, zoom, south, west, north, east, wanted):
+        """Ascending positions of the wanted permits inside the box, read from the cells at `zoom`."""
+        level = self.levels[zoom]
+        groups = self._groups(level, south, west, north, east, wanted)
+        positions = level.order[_ranges(level.starts[groups], level.stops[groups])]
+        lat, lon = self.latitudes[positions], self.longitudes[positions]
+        inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+        return np.sort(positions[inside])
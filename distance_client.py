@@ -0,0 +1,200 @@
+"""Long-lived client for the Google Distance Matrix API.
+
+One `requests.Session` per process keeps a pool of keep-alive connections to
+Google, so batches after the first skip the TCP and TLS handshakes. Every
+call has a connect and read timeout, and 5xx responses, network errors and
+OVER_QUERY_LIMIT are retried with jittered exponential backoff. Batches run
+on a single bounded thread pool shared by all requests in the process
+instead of a new pool per request.
+
+`AsyncDistanceMatrixClient` is the same client for the ASGI mode: one
+`httpx.AsyncClient` pool per event loop, with the same timeouts and retry
+rules, so a worker can have many batches in flight without a thread each.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    # Only the async serving mode (asgi.py) needs it
+    httpx = None
+
+DISTANCE_MATRIX_URL = 'https://maps.googleapis.com/maps/api/distancematrix/json'
+
+# Google statuses worth another try; everything else is final
+RETRYABLE_STATUSES = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+
+
+class DistanceMatrixClient:
+    """Pooled, retrying Distance Matrix client with a shared executor."""
+
+    def __init__(self, api_key, url=DISTANCE_MATRIX_URL, connect_timeout=3.05, read_timeout=10.0,
+                 max_retries=2, backoff=0.25, pool_size=10, max_workers=5, sleep=time.sleep):
+        self.api_key = api_key
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.max_workers = max_workers
+        self.sleep = sleep
+        self.session = self._new_session()
+        self._executor = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _check_fork(self):
+        # Sockets and threads don't survive a fork; a forked worker starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self.session = self._new_session()
+                    self._executor = None
+                    self._pid = os.getpid()
+
+    @property
+    def executor(self):
+        """The process-wide pool that upstream batches run on."""
+        self._check_fork()
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix='distance-matrix'
+                    )
+        return self._executor
+
+    def _backoff_delay(self, attempt):
+        # "Full jitter": spread retries from many workers instead of syncing them
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def matrix(self, origins, destinations):
+        """Fetch one origins x destinations matrix.
+
+        Returns the decoded JSON body (whatever its top-level status) or None
+        when the request failed even after retries.
+        """
+        self._check_fork()
+        params = {
+            'origins': origins,
+            'destinations': destinations,
+            'key': self.api_key,
+            'units': 'metric'
+        }
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.get(self.url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    return None
+                self.sleep(self._backoff_delay(attempt))
+                continue
+
+            if response.status_code >= 500 and not last_attempt:
+                self.sleep(self._backoff_delay(attempt))
+                continue
+            if response.status_code != 200:
+                return None
+
+            try:
+                data = response.json()
+            except ValueError:
+                return None
+            if data.get('status') in RETRYABLE_STATUSES and not last_attempt:
+                self.sleep(self._backoff_delay(attempt))
+                continue
+            return data
+        return None
+
+
+class AsyncDistanceMatrixClient:
+    """`DistanceMatrixClient` for asyncio; `matrix()` is a coroutine."""
+
+    def __init__(self, api_key, url=DISTANCE_MATRIX_URL, connect_timeout=3.05, read_timeout=10.0,
+                 max_retries=2, backoff=0.25, pool_size=20, sleep=asyncio.sleep, transport=None):
+        if httpx is None:
+            raise ImportError('AsyncDistanceMatrixClient needs httpx')
+        self.api_key = api_key
+        self.url = url
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.sleep = sleep
+        self.transport = transport
+        self._clients = {}
+
+    def _pool(self):
+        """(client, semaphore) of the running event loop."""
+        loop = asyncio.get_running_loop()
+        pool = self._clients.get(loop)
+        if pool is None:
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                transport=self.transport,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            )
+            # Queue here rather than in httpx, whose pool rescans its whole wait list on every event
+            pool = self._clients[loop] = (client, asyncio.Semaphore(self.pool_size))
+        return pool
+
+    async def aclose(self):
+        """Close the running loop's pool."""
+        pool = self._clients.pop(asyncio.get_running_loop(), None)
+        if pool is not None:
+            await pool[0].aclose()
+
+    def _backoff_delay(self, attempt):
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    async def matrix(self, origins, destinations):
+        """Fetch one origins x destinations matrix; the decoded body or None, as in the sync client."""
+        params = {
+            'origins': origins,
+            'destinations': destinations,
+            'key': self.api_key,
+            'units': 'metric'
+        }
+        client, slots = self._pool()
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                async with slots:
+                    response = await client.get(self.url, params=params)
+            except (httpx.TransportError, httpx.TimeoutException):
+                if last_attempt:
+                    return None
+                await self.sleep(self._backoff_delay(attempt))
+                continue
+
+            if response.status_code >= 500 and not last_attempt:
+                await self.sleep(self._backoff_delay(attempt))
+                continue
+            if response.status_code != 200:
+                return None
+
+            try:
+                data = response.json()
+            except ValueError:
+                return None
+            if data.get('status') in RETRYABLE_STATUSES and not last_attempt:
+                await self.sleep(self._backoff_delay(attempt))
+                continue
+            return data
+        return None
@@ -0,0 +1,153 @@
+"""Local stand-in for the Distance Matrix API, for tests and benchmarks.
+
+Answers `/maps/api/distancematrix/json` with a road distance of
+`road_factor` times the great-circle distance, after an optional delay,
+and fails a configurable fraction of requests with HTTP 500 or
+OVER_QUERY_LIMIT.
+
+    python distance_matrix_stub.py --port 8099 --latency-ms 80
+    DISTANCE_MATRIX_URL=http://127.0.0.1:8099/maps/api/distancematrix/json gunicorn app:app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from spatial_index import haversine_km
+
+PATH = '/maps/api/distancematrix/json'
+
+
+def parse_points(value):
+    points = []
+    for pair in value.split('|'):
+        if pair:
+            lat, lon = pair.split(',')
+            points.append((float(lat), float(lon)))
+    return points
+
+
+class _Server(ThreadingHTTPServer):
+    # The default backlog of 5 drops connects when many requests arrive at once
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class DistanceMatrixStub:
+    """Threaded HTTP server speaking just enough of the Distance Matrix API."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0,
+                 over_query_limit_rate=0.0, road_factor=1.3, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.over_query_limit_rate = over_query_limit_rate
+        self.road_factor = road_factor
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.elements = 0
+        # Client (host, port) pairs seen; one per TCP connection
+        self.peers = set()
+        self._lock = threading.Lock()
+        self.server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}{PATH}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def respond(self, query):
+        """(HTTP status, body) for a parsed query string."""
+        with self._lock:
+            self.requests += 1
+            roll = self.random.random()
+        if roll < self.error_rate:
+            return 500, {'status': 'UNKNOWN_ERROR'}
+        if roll < self.error_rate + self.over_query_limit_rate:
+            return 200, {'status': 'OVER_QUERY_LIMIT', 'rows': []}
+
+        origins = parse_points(query.get('origins', [''])[0])
+        destinations = parse_points(query.get('destinations', [''])[0])
+        rows = []
+        for o_lat, o_lon in origins:
+            elements = []
+            for d_lat, d_lon in destinations:
+                meters = int(haversine_km(o_lat, o_lon, d_lat, d_lon) * 1000 * self.road_factor)
+                elements.append({
+                    'status': 'OK',
+                    'distance': {'value': meters, 'text': f'{meters / 1000:.1f} km'},
+                    'duration': {'value': meters // 8, 'text': ''}
+                })
+            rows.append({'elements': elements})
+        with self._lock:
+            self.elements += len(origins) * len(destinations)
+        return 200, {'status': 'OK', 'rows': rows}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.peers.add(self.client_address)
+                parsed = urlparse(self.path)
+                if parsed.path != PATH:
+                    status, body = 404, {'status': 'NOT_FOUND'}
+                else:
+                    if stub.latency:
+                        time.sleep(stub.latency)
+                    status, body = stub.respond(parse_qs(parsed.query))
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--over-query-limit-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = DistanceMatrixStub(args.host, args.port, latency=args.latency_ms / 1000.0,
+                              error_rate=args.error_rate,
+                              over_query_limit_rate=args.over_query_limit_rate)
+    print(f'serving {stub.url}')
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
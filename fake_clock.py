@@ -0,0 +1,11 @@
+"""A settable clock for tests of the modules that take a `clock` callable."""
+
+
+class FakeClock:
+    """Returns `now` until a test moves it."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
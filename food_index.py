@@ -0,0 +1,128 @@
+"""BM25-ranked full-text index over what each permit serves.
+
+`FoodItems` is free text ("Tacos: Burritos: Quesadillas: Sodas"). Every
+row is tokenized, lower-cased and stemmed once when the index is built, so
+"taco" finds "Tacos" and "sandwiches" finds "Sandwich". Each term keeps a
+posting list of ascending row ids, delta-encoded at the narrowest unsigned
+width its largest gap fits (1, 2 or 4 bytes), and its term frequencies,
+all packed into two shared byte buffers. A query decodes only its own
+terms' lists (one `cumsum` each) and scores them with vectorised BM25.
+"""
+import re
+from math import log
+
+import numpy as np
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+# Glue words in the dataset's item lists; they'd match nearly every truck
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'any', 'all', 'as', 'at', 'etc', 'for', 'from', 'in', 'is', 'of', 'on', 'or',
+    'other', 'the', 'to', 'w', 'with', 'items', 'item', 'food', 'foods', 'various', 'variety', 'assorted',
+))
+# BM25 parameters: term-frequency saturation and length normalisation
+K1 = 1.2
+B = 0.75
+_WIDTHS = (np.dtype('<u1'), np.dtype('<u2'), np.dtype('<u4'))
+
+
+def stem(word):
+    """Light suffix stripping: plurals, -ed, -ing and a final e or y.
+
+    Not a full Porter stemmer; it only has to map the inflections found in
+    menus to one form, the same way for documents and queries.
+    """
+    if len(word) <= 2 or word.isdigit():
+        return word
+    if word.endswith('ies'):
+        word = word[:-3] + 'i'
+    elif word.endswith(('sses', 'shes', 'ches', 'xes', 'zes')):
+        word = word[:-2]
+    elif word.endswith('s') and not word.endswith(('ss', 'us')):
+        word = word[:-1]
+    for suffix in ('ing', 'ed'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and re.search('[aeiouy]', word[:-len(suffix)]):
+            word = word[:-len(suffix)]
+            break
+    if word.endswith('e') and not word.endswith('ee') and len(word) > 3:
+        word = word[:-1]
+    elif word.endswith('y') and len(word) > 2:
+        word = word[:-1] + 'i'
+    return word
+
+
+def tokenize(text):
+    """Stemmed terms of `text`, stop words dropped, in order."""
+    return [stem(word) for word in TOKEN_RE.findall(text.lower()) if word not in STOP_WORDS]
+
+
+class FoodIndex:
+    """Inverted index over `values`, a sequence of strings or None.
+
+    Row ids are positions in `values`.
+    """
+
+    def __init__(self, values):
+        postings = {}
+        lengths = []
+        for row_id, text in enumerate(values):
+            terms = tokenize(text) if text else []
+            lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((row_id, tf))
+
+        self.size = len(lengths)
+        self.lengths = np.array(lengths, dtype=np.float32)
+        self.avg_length = float(self.lengths.mean()) if self.size and self.lengths.any() else 1.0
+        self.terms = {}
+        ids_buffer = bytearray()
+        tfs_buffer = bytearray()
+        offsets, widths, counts = [], [], []
+        for term_id, (term, entries) in enumerate(sorted(postings.items())):
+            self.terms[term] = term_id
+            ids = np.array([row_id for row_id, _ in entries], dtype=np.int64)
+            gaps = np.diff(ids, prepend=0)
+            width = next(w for w in _WIDTHS if gaps.max() <= np.iinfo(w).max)
+            offsets.append(len(ids_buffer))
+            widths.append(width.itemsize)
+            counts.append(len(ids))
+            ids_buffer += gaps.astype(width).tobytes()
+            tfs_buffer += np.minimum([tf for _, tf in entries], 255).astype(np.uint8).tobytes()
+        self.ids = bytes(ids_buffer)
+        self.tfs = bytes(tfs_buffer)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.widths = np.array(widths, dtype=np.uint8)
+        self.counts = np.array(counts, dtype=np.int64)
+        self.tf_offsets = np.concatenate(([0], np.cumsum(self.counts)[:-1])) if counts else self.counts
+        for array in (self.lengths, self.offsets, self.widths, self.counts, self.tf_offsets):
+            array.flags.writeable = False
+
+    def postings(self, term):
+        """(ascending row ids, term frequencies) of a stemmed term; empty when unknown."""
+        term_id = self.terms.get(term)
+        if term_id is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        count = int(self.counts[term_id])
+        width = _WIDTHS[(1, 2, 4).index(int(self.widths[term_id]))]
+        gaps = np.frombuffer(self.ids, dtype=width, count=count, offset=int(self.offsets[term_id]))
+        tfs = np.frombuffer(self.tfs, dtype=np.uint8, count=count, offset=int(self.tf_offsets[term_id]))
+        return np.cumsum(gaps, dtype=np.int64), tfs
+
+    def scores(self, query):
+        """BM25 score of every row for `query`; rows sharing no term score 0."""
+        scores = np.zeros(self.size, dtype=np.float64)
+        for term in set(tokenize(query)):
+            ids, tfs = self.postings(term)
+            if not len(ids):
+                continue
+            idf = log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+            tfs = tfs.astype(np.float64)
+            norm = K1 * (1 - B + B * self.lengths[ids] / self.avg_length)
+            scores[ids] += idf * tfs * (K1 + 1) / (tfs + norm)
+        return scores
+
+    def nbytes(self):
+        """Bytes held by the posting lists."""
+        return len(self.ids) + len(self.tfs)
@@ -0,0 +1,31 @@
+"""Gunicorn settings, read automatically from the working directory.
+
+The app is imported and warmed (`app.warm_start`) once in the master, then
+forked, so every worker starts with the permit snapshot, its indexes and
+the road grid already loaded and shares those pages with the master
+instead of building its own copy. `/ready` answers 200 from the first
+request on. GUNICORN_PRELOAD=0 goes back to importing in each worker,
+which then warms itself before taking traffic.
+"""
+import os
+
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+
+
+def _warm(log):
+    from app import warm_start
+    try:
+        log.info('Warm start took %.2fs', warm_start())
+    except Exception:
+        # Serve anyway; the first request loads the snapshot and /ready reports 503 until then
+        log.exception('Warm start failed')
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        _warm(server.log)
+
+
+def post_worker_init(worker):
+    if not worker.cfg.preload_app:
+        _warm(worker.log)
@@ -0,0 +1,257 @@
+"""Stream a Mobile Food Facility Permit CSV into Postgres incrementally.
+
+The file is read one row at a time, normalised (typed columns, upper-case
+status, 0/0 coordinates and empty strings as NULL) and COPYed into a
+temporary staging table in fixed-size batches, so client memory stays flat
+for any file size. One upsert then writes only rows whose content hash
+changed, keyed by locationid, and a new dataset_version is recorded when
+anything changed so caches can key on it. Requires migration 0006.
+
+    python ingest.py Mobile_Food_Facility_Permit.csv
+    python ingest.py city.csv --delete-missing --batch-size 50000
+"""
+import argparse
+import csv
+import hashlib
+import io
+import re
+import sys
+from time import perf_counter
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+from migrate import database_url
+
+TABLE = 'mobile_food_facility_permit'
+
+# (column, SQL type) in the order of sql_queries/create_table.sql
+COLUMNS = (
+    ('locationid', 'INTEGER'),
+    ('applicant', 'TEXT'),
+    ('facilitytype', 'TEXT'),
+    ('cnn', 'INTEGER'),
+    ('locationdescription', 'TEXT'),
+    ('address', 'TEXT'),
+    ('blocklot', 'TEXT'),
+    ('block', 'TEXT'),
+    ('lot', 'TEXT'),
+    ('permit', 'TEXT'),
+    ('status', 'TEXT'),
+    ('fooditems', 'TEXT'),
+    ('x', 'NUMERIC'),
+    ('y', 'NUMERIC'),
+    ('latitude', 'DOUBLE PRECISION'),
+    ('longitude', 'DOUBLE PRECISION'),
+    ('schedule', 'TEXT'),
+    ('dayshours', 'TEXT'),
+    ('noisent', 'TEXT'),
+    ('approved', 'TEXT'),
+    ('received', 'TEXT'),
+    ('priorpermit', 'TEXT'),
+    ('expirationdate', 'TEXT'),
+    ('location', 'TEXT'),
+    ('firepreventiondistricts', 'TEXT'),
+    ('policedistricts', 'TEXT'),
+    ('supervisordistricts', 'TEXT'),
+    ('zipcodes', 'TEXT'),
+    ('neighborhoods', 'TEXT'),
+)
+COLUMN_NAMES = tuple(name for name, _ in COLUMNS)
+INTEGER_COLUMNS = {'locationid', 'cnn'}
+FLOAT_COLUMNS = {'x', 'y', 'latitude', 'longitude'}
+
+# CSV headers that don't reduce to the column name on their own
+HEADER_ALIASES = {'neighborhoodsold': 'neighborhoods'}
+
+
+def column_for_header(header):
+    """'Zip Codes' -> 'zipcodes', 'Neighborhoods (old)' -> 'neighborhoods'."""
+    name = re.sub(r'[^a-z0-9]', '', header.lower())
+    return HEADER_ALIASES.get(name, name)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalise_row(raw):
+    """Turn a {column: text} dict into a COLUMN_NAMES-ordered tuple.
+
+    Returns None for rows without a usable locationid.
+    """
+    values = []
+    for name in COLUMN_NAMES:
+        value = raw.get(name)
+        if isinstance(value, str):
+            value = value.strip() or None
+        if name in INTEGER_COLUMNS:
+            value = _to_int(value)
+        elif name in FLOAT_COLUMNS:
+            value = _to_float(value)
+        elif name == 'status' and value is not None:
+            value = value.upper()
+        values.append(value)
+
+    row = dict(zip(COLUMN_NAMES, values))
+    if row['locationid'] is None:
+        return None
+    # The export uses 0/0 for permits without a location
+    if not row['latitude'] or not row['longitude']:
+        row['latitude'] = row['longitude'] = None
+    return tuple(row[name] for name in COLUMN_NAMES)
+
+
+def row_hash(row):
+    """Stable content hash of a normalised row."""
+    return hashlib.md5(repr(row).encode()).hexdigest()
+
+
+def iter_rows(f):
+    """Yield each CSV record as a normalised row plus its hash, or None if rejected."""
+    reader = csv.reader(f)
+    header = next(reader)
+    columns = [column_for_header(h) for h in header]
+    for record in reader:
+        row = normalise_row(dict(zip(columns, record)))
+        if row is None:
+            yield None
+            continue
+        yield row + (row_hash(row),)
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_buffer(rows):
+    """CSV text for COPY ... (FORMAT csv); None becomes an unquoted empty field (NULL)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    for row in rows:
+        writer.writerow(['' if v is None else v for v in row])
+    buf.seek(0)
+    return buf
+
+
+STAGING_COLUMNS = COLUMNS + (('row_hash', 'TEXT'),)
+STAGING_NAMES = ', '.join(name for name, _ in STAGING_COLUMNS)
+
+CREATE_STAGING_SQL = (
+    'CREATE TEMP TABLE permit_staging ('
+    + ', '.join(f'{name} {sql_type}' for name, sql_type in STAGING_COLUMNS)
+    + ') ON COMMIT DROP'
+)
+
+UPSERT_SQL = f"""
+WITH upserted AS (
+    INSERT INTO {TABLE} ({STAGING_NAMES})
+    SELECT DISTINCT ON (locationid) {STAGING_NAMES}
+    FROM permit_staging
+    ORDER BY locationid
+    ON CONFLICT (locationid) DO UPDATE SET
+        {', '.join(f'{name} = EXCLUDED.{name}' for name, _ in STAGING_COLUMNS if name != 'locationid')}
+    WHERE {TABLE}.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+    RETURNING (xmax = 0) AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+"""
+
+DELETE_MISSING_SQL = f"""
+DELETE FROM {TABLE} t
+WHERE NOT EXISTS (SELECT 1 FROM permit_staging s WHERE s.locationid = t.locationid)
+"""
+
+BUMP_VERSION_SQL = """
+INSERT INTO dataset_version (source, rows_inserted, rows_updated, rows_deleted)
+VALUES (%s, %s, %s, %s)
+RETURNING version
+"""
+
+
+def ingest(engine, f, source='', batch_size=10000, delete_missing=False, report=print):
+    """Load the CSV in `f`; returns a dict of counts, timing and the dataset version."""
+    started = perf_counter()
+    stats = {'rows': 0, 'rejected': 0, 'inserted': 0, 'updated': 0, 'deleted': 0, 'version': None}
+
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            cur.execute(CREATE_STAGING_SQL)
+            rows = iter_rows(f)
+            for batch in batched(rows, batch_size):
+                valid = [row for row in batch if row is not None]
+                stats['rejected'] += len(batch) - len(valid)
+                stats['rows'] += len(valid)
+                cur.copy_expert(
+                    f'COPY permit_staging ({STAGING_NAMES}) FROM STDIN WITH (FORMAT csv)',
+                    copy_buffer(valid)
+                )
+                elapsed = perf_counter() - started
+                report(f"staged {stats['rows']} rows ({stats['rows'] / elapsed:,.0f} rows/sec)")
+
+            cur.execute(UPSERT_SQL)
+            stats['inserted'], stats['updated'] = cur.fetchone()
+            if delete_missing:
+                cur.execute(DELETE_MISSING_SQL)
+                stats['deleted'] = cur.rowcount
+
+            if stats['inserted'] or stats['updated'] or stats['deleted']:
+                cur.execute(BUMP_VERSION_SQL, (source, stats['inserted'], stats['updated'], stats['deleted']))
+            else:
+                cur.execute('SELECT max(version) FROM dataset_version')
+            stats['version'] = cur.fetchone()[0]
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+    stats['seconds'] = perf_counter() - started
+    stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('csv_path')
+    parser.add_argument('--database-url', default=None, help='defaults to DATABASE_URL')
+    parser.add_argument('--batch-size', type=int, default=10000, help='rows per COPY batch')
+    parser.add_argument('--delete-missing', action='store_true',
+                        help='delete permits that are not in the file')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.database_url or database_url())
+    with open(args.csv_path, newline='', encoding='utf-8') as f:
+        stats = ingest(engine, f, source=args.csv_path, batch_size=args.batch_size,
+                       delete_missing=args.delete_missing)
+    print(
+        f"{stats['rows']} rows in {stats['seconds']:.1f}s ({stats['rows_per_sec']:,.0f} rows/sec): "
+        f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['deleted']} deleted, "
+        f"{stats['rejected']} rejected; dataset version {stats['version']}"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
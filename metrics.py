@@ -0,0 +1,274 @@
+"""In-process counters, gauges and histograms rendered in Prometheus text format.
+
+Recording a value is a dict lookup and a few additions under one lock, so
+timers can sit on the request path. Each worker keeps its own numbers.
+With a `path`, a worker also writes them to `metrics-<pid>.json` in that
+directory at most every `flush_interval` seconds and on exit. `collect()`
+merges those files with the caller's live values, so any worker can answer
+a scrape for all of them.
+
+Only files written by workers of the same parent process (the gunicorn
+master) are merged, so a restarted server doesn't inherit an old run's
+counters. Counters and histograms of workers that have exited still count;
+gauges only count for live workers.
+"""
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+from time import perf_counter, time
+
+# Seconds; tuned for requests from sub-millisecond index hits up to slow upstream fan-outs
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        if not self.labelnames and self.type != 'histogram':
+            # Unlabelled series exist from the start, so they read 0 rather than missing
+            self.values[()] = 0
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}')
+        return tuple(map(str, labels))
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, *labels):
+        """Copy in a running total kept elsewhere, e.g. a cache's hit count."""
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram; each value is [bucket counts..., sum, count]."""
+
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self.listeners = []
+
+    def add_listener(self, fn):
+        """Also call `fn(value, *labels)` for every observation."""
+        self.listeners.append(fn)
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            # Stored per bucket; made cumulative when rendered
+            if i < len(self.buckets):
+                counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+        for fn in self.listeners:
+            fn(value, *labels)
+
+    def time(self, *labels):
+        """Context manager observing the seconds spent inside it."""
+        return _Timer(self, labels)
+
+
+class _Timer:
+    # A plain class is several times cheaper than a @contextmanager generator
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.started, *self.labels)
+
+
+class Registry:
+    """A set of metrics, optionally shared with sibling workers through `path`."""
+
+    def __init__(self, path=None, flush_interval=5.0, clock=time):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.collectors = []
+        self._flushed = 0.0
+        if path:
+            os.makedirs(path, exist_ok=True)
+            atexit.register(self.flush)
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(self, name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self, name, help, labelnames, buckets))
+
+    def add_collector(self, fn):
+        """Call `fn()` before every snapshot, to copy in values kept elsewhere."""
+        self.collectors.append(fn)
+
+    def snapshot(self):
+        """This process's metrics as a JSON-serialisable dict."""
+        for fn in self.collectors:
+            fn()
+        with self.lock:
+            return {
+                m.name: {
+                    'type': m.type,
+                    'help': m.help,
+                    'labelnames': list(m.labelnames),
+                    'buckets': list(getattr(m, 'buckets', ())),
+                    'values': [[list(key), value if m.type != 'histogram' else list(value)]
+                               for key, value in m.values.items()],
+                }
+                for m in self.metrics
+            }
+
+    def _file(self, pid):
+        return os.path.join(self.path, f'metrics-{pid}.json')
+
+    def maybe_flush(self):
+        """Flush if the last flush is older than `flush_interval`; cheap otherwise."""
+        if self.path and self.clock() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.path:
+            return
+        self._flushed = self.clock()
+        data = {'pid': os.getpid(), 'ppid': os.getppid(), 'metrics': self.snapshot()}
+        target = self._file(os.getpid())
+        tmp = f'{target}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, target)
+        except OSError:
+            # Metrics must never fail a request; the next flush tries again
+            pass
+
+    def collect(self):
+        """Snapshots of this worker and every sibling worker that has flushed."""
+        own = self.snapshot()
+        if not self.path:
+            return [(own, True)]
+        snapshots = [(own, True)]
+        for filename in glob.glob(os.path.join(self.path, 'metrics-*.json')):
+            try:
+                with open(filename) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data['pid'] == os.getpid() or data['ppid'] != os.getppid():
+                continue
+            snapshots.append((data['metrics'], _alive(data['pid'])))
+        return snapshots
+
+    def render(self):
+        """Every worker's metrics, summed, in Prometheus text exposition format."""
+        return render(self.collect())
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge(snapshots):
+    """Sum (snapshot, alive) pairs into one snapshot."""
+    merged = {}
+    for snapshot, alive in snapshots:
+        for name, metric in snapshot.items():
+            if metric['type'] == 'gauge' and not alive:
+                continue
+            target = merged.setdefault(name, dict(metric, values={}))
+            for key, value in metric['values']:
+                key = tuple(key)
+                if metric['type'] == 'histogram':
+                    current = target['values'].get(key)
+                    target['values'][key] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    target['values'][key] = target['values'].get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def render(snapshots):
+    lines = []
+    for name, metric in sorted(merge(snapshots).items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric['labelnames']
+        for key, value in sorted(metric['values'].items()):
+            if metric['type'] != 'histogram':
+                lines.append(f'{name}{_labels(names, key)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'], value):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{name}_bucket{_labels(names, key, [le])} {cumulative}')
+            le = 'le="+Inf"'
+            lines.append(f'{name}_bucket{_labels(names, key, [le])} {value[-1]}')
+            lines.append(f'{name}_sum{_labels(names, key)} {_number(value[-2])}')
+            lines.append(f'{name}_count{_labels(names, key)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,89 @@
+"""Apply the versioned SQL migrations in sql_queries/migrations.
+
+Each NNNN_name.sql file runs once, in its own transaction, and is recorded
+in schema_migrations so re-running only applies what is new.
+
+    python migrate.py                 # apply pending migrations
+    python migrate.py --list          # show applied / pending
+"""
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql_queries', 'migrations')
+
+
+def database_url():
+    """DATABASE_URL, or the Cloud SQL socket URL the app uses by default."""
+    url = os.getenv('DATABASE_URL')
+    if url:
+        return url
+    return (
+        f"postgresql+psycopg2://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@/{os.getenv('DB_NAME')}"
+        f"?host=/cloudsql/{os.getenv('INSTANCE_CONNECTION_NAME')}"
+    )
+
+
+def available_migrations(directory=MIGRATIONS_DIR):
+    """(version, path) for every migration file, oldest first."""
+    migrations = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.sql'):
+            migrations.append((name[:-len('.sql')], os.path.join(directory, name)))
+    return migrations
+
+
+def applied_versions(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        ' version TEXT PRIMARY KEY,'
+        ' applied_at TIMESTAMPTZ NOT NULL DEFAULT now())'
+    ))
+    return {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def migrate(engine, directory=MIGRATIONS_DIR):
+    """Apply pending migrations; returns the versions applied."""
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+
+    applied = []
+    for version, path in available_migrations(directory):
+        if version in done:
+            continue
+        with open(path) as f:
+            sql = f.read()
+        with engine.begin() as conn:
+            conn.exec_driver_sql(sql)
+            conn.execute(text('INSERT INTO schema_migrations (version) VALUES (:version)'),
+                         {'version': version})
+        print(f'applied {version}')
+        applied.append(version)
+    return applied
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=None, help='defaults to DATABASE_URL')
+    parser.add_argument('--list', action='store_true', help='show migration status and exit')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.database_url or database_url())
+    if args.list:
+        with engine.begin() as conn:
+            done = applied_versions(conn)
+        for version, _ in available_migrations():
+            print(f"{'applied' if version in done else 'pending'}  {version}")
+        return 0
+
+    if not migrate(engine):
+        print('nothing to apply')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Weekly opening hours as bitsets of 15-minute slots.
+
+`dayshours` is free text such as `Mo-Fr:7AM-8AM/10AM-11AM` or
+`Sa-Su:10AM-6PM;Mo-Fr:10AM-10PM`. It is parsed once, when a snapshot is
+built, into 672 bits (7 days x 96 quarter hours, Monday 00:00 first)
+packed into 84 bytes per permit. "Is it open at t" is then one bit test,
+so it can sit next to the status filter while candidates are selected.
+Ranges ending at or before they start run past midnight into the next
+day, and Sunday night runs into Monday. Times are San Francisco local.
+"""
+import re
+from datetime import datetime
+from time import time
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+DAYS = ('Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su')
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+WEEK_SLOTS = 7 * SLOTS_PER_DAY
+WEEK_BYTES = WEEK_SLOTS // 8
+TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+TIME_RE = re.compile(r'^(\d{1,2})(?::(\d{2}))?\s*(AM|PM)$', re.IGNORECASE)
+
+
+def _minutes(text):
+    match = TIME_RE.match(text.strip())
+    if not match:
+        raise ValueError(f'bad time {text!r}')
+    hour, minute = int(match.group(1)), int(match.group(2) or 0)
+    if not 1 <= hour <= 12 or minute >= 60:
+        raise ValueError(f'bad time {text!r}')
+    return (hour % 12 + (12 if match.group(3).upper() == 'PM' else 0)) * 60 + minute
+
+
+def _days(text):
+    days = []
+    for part in text.split('/'):
+        first, _, last = part.strip().partition('-')
+        start = DAYS.index(first.strip().title())
+        stop = DAYS.index(last.strip().title()) if last else start
+        # Ranges may wrap: Fr-Mo
+        days.extend((start + i) % 7 for i in range((stop - start) % 7 + 1))
+    return days
+
+
+def parse_dayshours(text):
+    """84 bytes of open slots for a `dayshours` string, or None when it's empty or unparseable."""
+    if not text or not text.strip():
+        return None
+    bits = np.zeros(WEEK_SLOTS, dtype=np.uint8)
+    try:
+        for clause in text.split(';'):
+            days, _, ranges = clause.partition(':')
+            for span in ranges.split('/'):
+                start, end = (_minutes(t) for t in span.split('-'))
+                if end <= start:
+                    end += 24 * 60
+                first, last = start // SLOT_MINUTES, -(-end // SLOT_MINUTES)
+                for day in _days(days):
+                    slots = np.arange(day * SLOTS_PER_DAY + first, day * SLOTS_PER_DAY + last) % WEEK_SLOTS
+                    bits[slots] = 1
+    except ValueError:
+        return None
+    return np.packbits(bits, bitorder='little').tobytes()
+
+
+def local_slot_start(moment):
+    """`moment` in San Francisco time, floored to its slot; naive datetimes are taken as local."""
+    moment = moment.replace(tzinfo=TIMEZONE) if moment.tzinfo is None else moment.astimezone(TIMEZONE)
+    return moment.replace(minute=moment.minute - moment.minute % SLOT_MINUTES, second=0, microsecond=0)
+
+
+def resolve_open_at(open_at=None, open_now=False, clock=time):
+    """The slot start a request filters on, from an ISO `open_at` or `open_now`; None for neither.
+
+    Raises ValueError for a malformed `open_at` or a non-boolean `open_now`.
+    """
+    if not isinstance(open_now, bool):
+        raise ValueError('open_now must be a boolean')
+    if open_at is not None:
+        if not isinstance(open_at, str):
+            raise ValueError('open_at must be an ISO 8601 date and time')
+        try:
+            return local_slot_start(datetime.fromisoformat(open_at))
+        except ValueError:
+            raise ValueError('open_at must be an ISO 8601 date and time')
+    if open_now:
+        return local_slot_start(datetime.fromtimestamp(clock(), TIMEZONE))
+    return None
+
+
+def slot_of(moment):
+    """Index of `moment`'s slot in the week, for a slot start from `resolve_open_at`."""
+    return moment.weekday() * SLOTS_PER_DAY + (moment.hour * 60 + moment.minute) // SLOT_MINUTES
+
+
+def open_mask(hours, moment):
+    """Boolean array: which rows of `hours` (n x WEEK_BYTES bitsets) are open at `moment`."""
+    slot = slot_of(moment)
+    return ((hours[:, slot >> 3] >> (slot & 7)) & 1).astype(bool)
@@ -0,0 +1,273 @@
+"""Read-optimised, in-memory snapshot of the permit table.
+
+The dataset changes rarely, so instead of an ORM query per request the app
+loads the handful of columns it serves once, keeps coordinates in NumPy
+arrays and the rest in compact `__slots__` records, and swaps in a fresh
+snapshot on an interval or on demand. Readers always see one complete
+snapshot; a reload never mutates the one they hold.
+"""
+import hashlib
+import logging
+import sys
+import threading
+from time import time
+
+import numpy as np
+
+from clusters import ClusterIndex
+from food_index import FoodIndex
+from opening_hours import WEEK_BYTES, open_mask, parse_dayshours
+from spatial_index import SpatialIndex
+from text_index import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+# Column order of the rows a snapshot is built from
+COLUMNS = ('locationid', 'applicant', 'status', 'address', 'latitude', 'longitude', 'zipcodes', 'fooditems',
+           'dayshours')
+
+
+def rows_version(rows):
+    """Digest of `locationid`-ordered rows; equal digests mean identical data."""
+    digest = hashlib.md5()
+    for row in rows:
+        digest.update(repr(tuple(row)).encode())
+    return digest.hexdigest()
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class PermitRecord:
+    """One permit; attribute-compatible with `MobileFoodFacilityPermit`."""
+
+    __slots__ = COLUMNS
+
+    def __init__(self, locationid, applicant, status, address, latitude, longitude, zipcodes, fooditems=None,
+                 dayshours=None):
+        self.locationid = locationid
+        self.applicant = applicant
+        # Only a handful of distinct statuses/zipcodes; share one string each
+        self.status = _intern(status)
+        self.address = address
+        self.latitude = latitude
+        self.longitude = longitude
+        self.zipcodes = _intern(zipcodes)
+        self.fooditems = fooditems
+        self.dayshours = dayshours
+
+
+class PermitSnapshot:
+    """Immutable view of every permit, built from `COLUMNS`-ordered rows.
+
+    Records are kept in `locationid` order, which is what keyset pagination
+    walks.
+    """
+
+    def __init__(self, rows, loaded_at=None):
+        rows = sorted(rows, key=lambda row: row[0])
+        self.records = tuple(PermitRecord(*row) for row in rows)
+        self.version = rows_version(rows)
+        self.loaded_at = time() if loaded_at is None else loaded_at
+
+        self.locationids = np.array([r.locationid for r in self.records], dtype=np.int64)
+        # NULL coordinates become NaN so the arrays stay float64
+        self.latitudes = np.array(
+            [r.latitude if r.latitude is not None else np.nan for r in self.records], dtype=np.float64
+        )
+        self.longitudes = np.array(
+            [r.longitude if r.longitude is not None else np.nan for r in self.records], dtype=np.float64
+        )
+        # Lower-cased once here so substring search doesn't allocate per row
+        self.applicants_lower = tuple(
+            r.applicant.lower() if r.applicant is not None else None for r in self.records
+        )
+        self.addresses_lower = tuple(
+            r.address.lower() if r.address is not None else None for r in self.records
+        )
+        self.status_names = tuple(sorted({r.status for r in self.records if r.status is not None}))
+        codes = {status: i for i, status in enumerate(self.status_names)}
+        self.status_codes = np.array(
+            [codes.get(r.status, -1) for r in self.records], dtype=np.int16
+        )
+        # Opening hours as one week bitset per record; unknown hours are never open.
+        # Trucks share a few hundred distinct schedules, so each is parsed once.
+        self.hours = np.zeros((len(self.records), WEEK_BYTES), dtype=np.uint8)
+        weeks = {}
+        for i, r in enumerate(self.records):
+            if r.dayshours not in weeks:
+                weeks[r.dayshours] = parse_dayshours(r.dayshours)
+            if weeks[r.dayshours] is not None:
+                self.hours[i] = np.frombuffer(weeks[r.dayshours], dtype=np.uint8)
+        for array in (self.locationids, self.latitudes, self.longitudes, self.status_codes, self.hours):
+            array.flags.writeable = False
+
+        self.spatial_index = SpatialIndex(
+            (r, r.latitude, r.longitude, r.status) for r in self.records
+        )
+        self.cluster_index = ClusterIndex(
+            self.latitudes, self.longitudes, self.status_codes, len(self.status_names)
+        )
+        self.applicant_index = TrigramIndex(self.applicants_lower)
+        self.address_index = TrigramIndex(self.addresses_lower)
+        self.food_index = FoodIndex(tuple(r.fooditems for r in self.records))
+
+    def __len__(self):
+        return len(self.records)
+
+    def status_mask(self, status_set, open_at=None):
+        """Boolean array selecting the records whose status is in `status_set`.
+
+        With `open_at` (a slot start from `opening_hours.resolve_open_at`) only
+        records open then are selected.
+        """
+        wanted = [i for i, status in enumerate(self.status_names) if status in status_set]
+        mask = np.isin(self.status_codes, wanted)
+        if open_at is not None:
+            mask &= open_mask(self.hours, open_at)
+        return mask
+
+    def nearest(self, lat, lon, k, status_set, open_at=None):
+        """Up to `k` (distance_km, record) pairs from the spatial index, optionally open at `open_at`."""
+        allowed = open_mask(self.hours, open_at) if open_at is not None else None
+        return self.spatial_index.nearest(lat, lon, k=k, statuses=status_set, allowed=allowed)
+
+    def record(self, locationid):
+        """The record with `locationid`, or None."""
+        i = np.searchsorted(self.locationids, locationid)
+        if i < len(self.records) and self.locationids[i] == locationid:
+            return self.records[i]
+        return None
+
+    def status_wanted(self, status_set):
+        """Boolean array over `status_names` marking those in `status_set`."""
+        return np.array([status in status_set for status in self.status_names], dtype=bool)
+
+    def food_matches(self, query, status_set, open_at=None):
+        """(positions, BM25 scores) of the records with a wanted status whose food items match `query`."""
+        scores = self.food_index.scores(query)
+        positions = np.flatnonzero((scores > 0) & self.status_mask(status_set, open_at))
+        return positions, scores[positions]
+
+    def with_status(self, status_set, open_at=None):
+        """Records whose status is in `status_set`, in `locationid` order."""
+        return [self.records[i] for i in np.flatnonzero(self.status_mask(status_set, open_at))]
+
+    def search(self, applicant_query, address_query, status_set, limit=None, use_index=True,
+               after=None, open_at=None):
+        """Case-insensitive substring match, mirroring the ILIKE query.
+
+        NULL columns never match, just as `NULL ILIKE '%...%'` is not true.
+        With `use_index` the trigram indexes pick the candidate rows whenever
+        a query is long enough; otherwise every row with a wanted status is
+        scanned. Matches come in `locationid` order, starting after `after`.
+        `open_at` keeps only records open then, checked with the status.
+        """
+        applicant_query = applicant_query.lower()
+        address_query = address_query.lower()
+        mask = self.status_mask(status_set, open_at)
+
+        candidates = None
+        if use_index:
+            for index, query in ((self.applicant_index, applicant_query),
+                                 (self.address_index, address_query)):
+                ids = index.candidates(query)
+                if ids is not None:
+                    candidates = ids if candidates is None else np.intersect1d(
+                        candidates, ids, assume_unique=True
+                    )
+        if candidates is None:
+            candidates = np.flatnonzero(mask)
+        else:
+            candidates = candidates[mask[candidates]]
+        if after is not None:
+            start = np.searchsorted(self.locationids, after, side='right')
+            candidates = candidates[candidates >= start]
+
+        results = []
+        for i in candidates:
+            applicant = self.applicants_lower[i]
+            if applicant is None or applicant_query not in applicant:
+                continue
+            if address_query:
+                address = self.addresses_lower[i]
+                if address is None or address_query not in address:
+                    continue
+            results.append(self.records[i])
+            if limit is not None and len(results) >= limit:
+                break
+        return results
+
+
+class SnapshotStore:
+    """Holds the current `PermitSnapshot` and refreshes it on an interval.
+
+    `loader` returns an iterable of `COLUMNS`-ordered rows. The first `get()`
+    loads synchronously; after that a stale snapshot keeps being served while
+    a single caller rebuilds it, and the new one replaces it in one reference
+    assignment. A refresh that finds the same rows keeps the snapshot it
+    has, so memory shared with a pre-fork parent stays shared. A refresh
+    that fails is logged and retried one `refresh_interval` later; the stale
+    snapshot is served meanwhile.
+    """
+
+    def __init__(self, loader, refresh_interval=300, clock=time):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self._snapshot = None
+        self._retry_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+                return self._snapshot
+        now = self.clock()
+        if (self.refresh_interval and now - snapshot.loaded_at >= self.refresh_interval
+                and (self._retry_at is None or now >= self._retry_at)):
+            # Whoever gets the lock refreshes; everyone else keeps the old snapshot
+            if self._lock.acquire(blocking=False):
+                try:
+                    if self._snapshot is snapshot:
+                        self._refresh()
+                finally:
+                    self._lock.release()
+            return self._snapshot
+        return snapshot
+
+    def _refresh(self):
+        try:
+            self._snapshot = self._load()
+        except Exception:
+            logger.exception('Snapshot refresh failed; serving the one loaded at %s', self._snapshot.loaded_at)
+            self._retry_at = self.clock() + self.refresh_interval
+        else:
+            self._retry_at = None
+
+    def reload(self):
+        """Rebuild the snapshot now and return it."""
+        with self._lock:
+            self._snapshot = self._load()
+            return self._snapshot
+
+    def peek(self):
+        """The current snapshot, or None before the first load; never loads."""
+        return self._snapshot
+
+    def invalidate(self):
+        """Forget the snapshot so the next `get()` loads a fresh one."""
+        with self._lock:
+            self._snapshot = None
+
+    def _load(self):
+        rows = sorted(self.loader(), key=lambda row: row[0])
+        current = self._snapshot
+        if current is not None and current.version == rows_version(rows):
+            current.loaded_at = self.clock()
+            return current
+        return PermitSnapshot(rows, loaded_at=self.clock())
@@ -0,0 +1,199 @@
+"""Profile single requests in place, on demand or 1 in N.
+
+A request carrying `X-Profile: 1` (or `cprofile`, or `sample`) and the
+right `X-Profile-Token` runs under a profiler. So does one request in
+every `sample_rate`, picked at random. `cprofile` writes a `.pstats` file
+for `python -m pstats` or snakeviz. `sample` snapshots the request
+thread's stack every `interval` seconds and writes a `.collapsed` file for
+flamegraph.pl or speedscope. Work the request hands to a thread pool
+(Distance Matrix batches run on the `distance-matrix` executor) is only
+seen by `sample`: it also samples the busy threads whose names start with
+one of `thread_prefixes`, each stack rooted at the pool's name. The pools
+are shared, so under concurrency those stacks can include other requests'
+batches. cProfile only sees the request thread; there upstream work shows
+up as the `upstream_wait` stage alone. Profiled responses get a `Server-Timing`
+header with the stage breakdown and an `X-Profile-File` header naming the
+output. With neither a token nor a sample rate, `init_app` registers
+nothing and requests never touch this module.
+"""
+import cProfile
+import os
+import random
+import sys
+import threading
+from time import perf_counter, time
+
+from flask import g, request
+
+MODES = ('cprofile', 'sample')
+
+_local = threading.local()
+
+
+def record_timing(name, seconds):
+    """Add `seconds` to stage `name` of the request being profiled on this thread, if any."""
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+class timing:
+    """Context manager feeding `record_timing`; one attribute lookup when not profiling."""
+
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_timing(self.name, perf_counter() - self.started)
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a background thread.
+
+    Threads named with one of `thread_prefixes` are sampled too while they
+    run a task; an idle pool worker is skipped.
+    """
+
+    def __init__(self, thread_id, interval=0.001, thread_prefixes=()):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.thread_prefixes = tuple(thread_prefixes)
+        self.counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            self._add(frames.get(self.thread_id))
+            if not self.thread_prefixes:
+                continue
+            for thread in threading.enumerate():
+                prefix = next((p for p in self.thread_prefixes if thread.name.startswith(p)), None)
+                frame = frames.get(thread.ident) if prefix else None
+                # A pool worker waiting for work sits in `_worker` itself
+                if frame is not None and frame.f_code.co_name != '_worker':
+                    self._add(frame, root=prefix)
+
+    def _add(self, frame, root=None):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        if stack:
+            if root is not None:
+                stack.append(root)
+            key = ';'.join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def collapsed(self):
+        """Brendan Gregg's folded format: `outer;inner count` per line."""
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.counts.items()))
+
+
+class RequestProfiler:
+    """Flask extension that profiles selected requests."""
+
+    def __init__(self, directory, token=None, sample_rate=0, sample_mode='sample', interval=0.001,
+                 rand=random.random, thread_prefixes=()):
+        self.directory = directory
+        self.thread_prefixes = tuple(thread_prefixes)
+        self.token = token
+        self.sample_rate = sample_rate
+        self.sample_mode = sample_mode
+        self.interval = interval
+        self.rand = rand
+
+    @property
+    def enabled(self):
+        return bool(self.token) or self.sample_rate > 0
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    def _mode(self):
+        """The profiler to run this request under, or None."""
+        asked = request.headers.get('X-Profile')
+        if asked and self.token and request.headers.get('X-Profile-Token') == self.token:
+            return asked if asked in MODES else 'cprofile'
+        if self.sample_rate and self.rand() < 1.0 / self.sample_rate:
+            return self.sample_mode
+        return None
+
+    def _start(self):
+        mode = self._mode()
+        if mode is None:
+            return
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Only one cProfile may run at a time; sample this one instead
+                mode, profiler = 'sample', None
+        if mode == 'sample':
+            profiler = StackSampler(threading.get_ident(), self.interval, self.thread_prefixes).start()
+        _local.timings = {}
+        g.profile = (mode, profiler, perf_counter())
+
+    def _finish(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        mode, profiler, started = profile
+        total = perf_counter() - started
+        path = self._write(mode, profiler)
+        timings = getattr(_local, 'timings', None) or {}
+        _local.timings = None
+
+        entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in sorted(timings.items())]
+        entries.append(f'total;dur={total * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(entries)
+        response.headers['X-Profile-File'] = os.path.basename(path)
+        return response
+
+    def _teardown(self, error=None):
+        # A request that failed before after_request still has to stop its profiler
+        profile = g.pop('profile', None)
+        if profile is not None:
+            self._stop(profile[0], profile[1])
+        _local.timings = None
+
+    def _stop(self, mode, profiler):
+        if mode == 'cprofile':
+            profiler.disable()
+        else:
+            profiler.stop()
+
+    def _write(self, mode, profiler):
+        self._stop(mode, profiler)
+        endpoint = (request.endpoint or 'unmatched').replace('.', '_')
+        name = f'{time():.3f}-{os.getpid()}-{endpoint}'
+        if mode == 'cprofile':
+            path = os.path.join(self.directory, f'{name}.pstats')
+            profiler.dump_stats(path)
+        else:
+            path = os.path.join(self.directory, f'{name}.collapsed')
+            with open(path, 'w') as f:
+                f.write(profiler.collapsed())
+        return path
@@ -0,0 +1,329 @@
+"""Precomputed road distances from every grid cell over the city, memory-mapped.
+
+`python road_grid.py --out road_grid.bin` asks the Distance Matrix API for
+the road distance from the centre of every `cell_m` cell inside `bounds`
+to every permit with one of `statuses`, and keeps the `k` nearest per
+cell. Cells are the ones `cache.quantize(lat, lon, cell_m)` snaps to, so
+a grid built with `PAIR_CACHE_GRID_M` answers exactly what a live road
+query from the same cell would.
+
+The file is a short JSON header followed by fixed-size NumPy arrays:
+
+    b'ROADGRD1', uint32 header length, header JSON, padding to 8 bytes
+    int64[rows]              first quantize() column of each row
+    uint8[rows * cols]       1 once a cell is written, padded to 8 bytes
+    (uint32, uint32)[rows, cols, k]  (locationid, metres), nearest first
+
+Workers `np.memmap` it read-only, so a lookup is two floors and one slice
+and every process shares the OS page cache instead of holding a copy.
+
+The job writes to `<out>.partial` and marks each cell as it lands, so an
+interrupted or quota-limited run picks up where it stopped. Only a
+finished file is renamed to `<out>`. A grid records a fingerprint of the
+permits' ids and coordinates; it is only served while the live snapshot
+has the same permits at the same places.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from math import cos, floor, radians
+from time import sleep as default_sleep
+
+import numpy as np
+
+from cache import METERS_PER_DEGREE, quantize
+
+MAGIC = b'ROADGRD1'
+ENTRY = np.dtype([('locationid', '<u4'), ('distance_m', '<u4')])
+# Distance of an unused slot, when fewer than `k` permits are reachable
+MISSING = 0xFFFFFFFF
+SF_BOUNDS = (37.70, 37.82, -122.52, -122.36)  # min lat, max lat, min lon, max lon
+# Longest a build waits on the per-second budget for one request before giving up
+RESERVE_MAX_WAIT = 60.0
+
+
+class QuotaExhausted(Exception):
+    """The budget can't cover the next request; rerun later (tomorrow, for the daily cap) to resume."""
+
+
+def fingerprint(permits):
+    """Hash of the permits' ids and coordinates, the part of the data a grid depends on."""
+    digest = hashlib.md5()
+    for locationid, lat, lon in sorted(
+        (p.locationid, round(float(p.latitude), 6), round(float(p.longitude), 6))
+        for p in permits if p.latitude and p.longitude
+    ):
+        digest.update(f'{locationid}:{lat}:{lon};'.encode())
+    return digest.hexdigest()
+
+
+def _lon_step(row, cell_m):
+    # Same arithmetic as cache.quantize, so cells line up exactly
+    lat_q = (row + 0.5) * cell_m / METERS_PER_DEGREE
+    return cell_m / (METERS_PER_DEGREE * max(cos(radians(lat_q)), 1e-6))
+
+
+def layout(cell_m, bounds):
+    """(first row, first column of each row, number of columns) covering `bounds`."""
+    min_lat, max_lat, min_lon, max_lon = bounds
+    lat_step = cell_m / METERS_PER_DEGREE
+    row0 = floor(min_lat / lat_step)
+    rows = floor(max_lat / lat_step) - row0 + 1
+    col0 = []
+    cols = 0
+    for row in range(row0, row0 + rows):
+        lon_step = _lon_step(row, cell_m)
+        first = floor(min_lon / lon_step)
+        col0.append(first)
+        cols = max(cols, floor(max_lon / lon_step) - first + 1)
+    return row0, np.array(col0, dtype='<i8'), cols
+
+
+def _align(n):
+    return -(-n // 8) * 8
+
+
+class RoadGrid:
+    """Read-only view of a grid file."""
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a road grid file')
+            length = int.from_bytes(f.read(4), 'little')
+            self.header = json.loads(f.read(length))
+        self.cell_m = self.header['cell_m']
+        self.k = self.header['k']
+        self.statuses = frozenset(self.header['statuses'])
+        self.fingerprint = self.header['fingerprint']
+        self.row0 = self.header['row0']
+        self.rows = self.header['rows']
+        self.cols = self.header['cols']
+        self.lat_step = self.cell_m / METERS_PER_DEGREE
+
+        offset = _align(len(MAGIC) + 4 + length)
+        self.col0 = np.memmap(path, dtype='<i8', mode=mode, offset=offset, shape=(self.rows,))
+        offset += self.col0.nbytes
+        self.done = np.memmap(path, dtype='u1', mode=mode, offset=offset, shape=(self.rows, self.cols))
+        offset += _align(self.done.nbytes)
+        self.entries = np.memmap(path, dtype=ENTRY, mode=mode, offset=offset,
+                                 shape=(self.rows, self.cols, self.k))
+
+    @classmethod
+    def create(cls, path, cell_m, bounds, k, statuses, fingerprint):
+        """Write an empty grid file and open it for writing."""
+        row0, col0, cols = layout(cell_m, bounds)
+        header = json.dumps({
+            'cell_m': cell_m, 'bounds': list(bounds), 'k': k, 'statuses': sorted(statuses),
+            'fingerprint': fingerprint, 'row0': row0, 'rows': len(col0), 'cols': cols,
+        }).encode()
+        offset = _align(len(MAGIC) + 4 + len(header))
+        size = offset + col0.nbytes + _align(len(col0) * cols) + len(col0) * cols * k * ENTRY.itemsize
+        with open(path, 'wb') as f:
+            f.write(MAGIC + len(header).to_bytes(4, 'little') + header)
+            f.seek(offset)
+            f.write(col0.tobytes())
+            f.truncate(size)
+        return cls(path, mode='r+')
+
+    def cell(self, lat, lon):
+        """(row, column) of the cell holding (lat, lon), or None outside the grid."""
+        row = floor(float(lat) / self.lat_step) - self.row0
+        if not 0 <= row < self.rows:
+            return None
+        col = floor(float(lon) / _lon_step(row + self.row0, self.cell_m)) - int(self.col0[row])
+        if not 0 <= col < self.cols:
+            return None
+        return row, col
+
+    def centre(self, row, col):
+        """The point live queries from this cell ask from."""
+        lon_step = _lon_step(row + self.row0, self.cell_m)
+        return quantize((row + self.row0 + 0.5) * self.lat_step, (col + int(self.col0[row]) + 0.5) * lon_step,
+                        self.cell_m)
+
+    def lookup(self, lat, lon):
+        """[(locationid, distance_km), ...] nearest first, or None if the cell isn't covered."""
+        cell = self.cell(lat, lon)
+        if cell is None or not self.done[cell]:
+            return None
+        return [
+            (locationid, round(distance_m / 1000.0, 2))
+            for locationid, distance_m in self.entries[cell].tolist() if distance_m != MISSING
+        ]
+
+    def pending(self):
+        """Cells still to compute, row by row."""
+        rows, cols = np.nonzero(self.done == 0)
+        return list(zip(rows.tolist(), cols.tolist()))
+
+    def flush(self):
+        self.done.flush()
+        self.entries.flush()
+
+
+class RoadGridStore:
+    """The grid at `path` if it matches the live permits; reopened when the file is replaced."""
+
+    def __init__(self, path):
+        self.path = path
+        self._grid = None
+        self._stat = None
+        self._matched = None
+        self.hits = 0
+        self.misses = 0
+
+    def _current(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._grid = self._stat = None
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key != self._stat:
+            try:
+                grid = RoadGrid(self.path)
+            except (OSError, ValueError):
+                # Unreadable or truncated file: serve live answers until it is replaced
+                grid = None
+            self._grid, self._stat, self._matched = grid, key, None
+        return self._grid
+
+    def get(self, snapshot):
+        """The grid, if it was built for exactly the permits in `snapshot`."""
+        grid = self._current()
+        if grid is None:
+            return None
+        if self._matched is None or self._matched[0] != snapshot.version:
+            matches = fingerprint(snapshot.with_status(grid.statuses)) == grid.fingerprint
+            self._matched = (snapshot.version, matches)
+        return grid if self._matched[1] else None
+
+    def stats(self):
+        grid = self._grid
+        return {
+            'path': self.path,
+            'loaded': grid is not None,
+            'cells': int(grid.rows * grid.cols) if grid is not None else 0,
+            'matches_snapshot': bool(self._matched and self._matched[1]),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def _reserve(budget, elements, sleep, max_wait=RESERVE_MAX_WAIT):
+    """Wait for `elements` from the budget; raise QuotaExhausted if today's cap is the problem.
+
+    Also raises when the per-second bucket can never hold `elements`, or
+    hasn't for `max_wait` seconds.
+    """
+    if budget.per_second and elements > budget.burst:
+        raise QuotaExhausted(f'{elements} elements per request, but the burst is {budget.burst}')
+    waited = 0.0
+    while not budget.try_consume(elements):
+        remaining = budget.remaining()['remaining_today']
+        if remaining is not None and remaining < elements:
+            raise QuotaExhausted(f'{remaining} elements left today, {elements} needed')
+        if waited >= max_wait:
+            raise QuotaExhausted(f'no budget for {elements} elements after {max_wait:.0f}s')
+        sleep(0.1)
+        waited += 0.1
+
+
+def build(path, permits, fetch, budget=None, cell_m=100.0, bounds=SF_BOUNDS, k=10,
+          statuses=('APPROVED',), max_elements=100, sleep=default_sleep, log=print):
+    """Compute (or resume computing) the grid at `path`; return the number of cells written.
+
+    `fetch(centres, permits)` returns (centre, permit, distance_km) for every
+    routable pair. Origins are packed so each request holds at most
+    `max_elements` elements and 25 destinations. Progress is flushed after
+    every group of cells, so an exception or QuotaExhausted loses at most
+    one group.
+    """
+    permits = [p for p in permits if p.latitude and p.longitude]
+    if any(p.locationid > 0xFFFFFFFE for p in permits):
+        raise ValueError('locationids must fit in 32 bits')
+    partial = f'{path}.partial'
+    wanted = {'cell_m': cell_m, 'bounds': list(bounds), 'k': k, 'statuses': sorted(statuses),
+              'fingerprint': fingerprint(permits)}
+
+    grid = None
+    if os.path.exists(partial):
+        grid = RoadGrid(partial, mode='r+')
+        if any(grid.header[name] != value for name, value in wanted.items()):
+            log(f'{partial} was started with other settings or permits; starting over')
+            grid = None
+    if grid is None:
+        grid = RoadGrid.create(partial, cell_m, bounds, k, statuses, wanted['fingerprint'])
+
+    pending = grid.pending()
+    log(f'{len(pending)} of {grid.rows * grid.cols} cells to compute for {len(permits)} permits')
+    index = {p.locationid: i for i, p in enumerate(permits)}
+    locationids = np.array([p.locationid for p in permits], dtype='<u4')
+    per_request = max(1, min(25, max_elements // max(1, min(25, len(permits)))))
+
+    written = 0
+    try:
+        for start in range(0, len(pending), per_request):
+            cells = pending[start:start + per_request]
+            centres = [grid.centre(row, col) for row, col in cells]
+            distances = np.full((len(cells), len(permits)), np.inf)
+            position = {centre: i for i, centre in enumerate(centres)}
+            for chunk_start in range(0, len(permits), 25):
+                chunk = permits[chunk_start:chunk_start + 25]
+                if budget is not None:
+                    _reserve(budget, len(cells) * len(chunk), sleep)
+                for centre, permit, distance_km in fetch(centres, chunk):
+                    distances[position[centre], index[permit.locationid]] = distance_km * 1000.0
+
+            for i, cell in enumerate(cells):
+                nearest = np.argsort(distances[i], kind='stable')[:k]
+                nearest = nearest[np.isfinite(distances[i][nearest])]
+                entries = np.zeros(k, dtype=ENTRY)
+                entries['distance_m'] = MISSING
+                entries['locationid'][:len(nearest)] = locationids[nearest]
+                entries['distance_m'][:len(nearest)] = np.rint(distances[i][nearest])
+                grid.entries[cell] = entries
+                grid.done[cell] = 1
+            grid.flush()
+            written += len(cells)
+    finally:
+        grid.flush()
+
+    os.replace(partial, path)
+    log(f'wrote {path}')
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', default=os.getenv('ROAD_GRID_PATH', 'road_grid.bin'))
+    parser.add_argument('--cell-m', type=float, default=None, help='defaults to PAIR_CACHE_GRID_M')
+    parser.add_argument('--k', type=int, default=10, help='nearest permits kept per cell')
+    parser.add_argument('--bounds', default=','.join(map(str, SF_BOUNDS)),
+                        help='min_lat,max_lat,min_lon,max_lon')
+    parser.add_argument('--statuses', default='APPROVED', help='comma-separated')
+    args = parser.parse_args(argv)
+
+    # Imported here: the app reads DATABASE_URL, DISTANCE_MATRIX_URL and the budget settings
+    import app as app_module
+
+    bounds = tuple(float(v) for v in args.bounds.split(','))
+    statuses = {s.strip().upper() for s in args.statuses.split(',') if s.strip()}
+    with app_module.app.app_context():
+        permits = app_module.snapshot_store.get().with_status(statuses)
+    try:
+        build(args.out, permits, app_module.fetch_matrix_elements, budget=app_module.upstream_budget,
+              cell_m=args.cell_m or app_module.PAIR_CACHE_GRID_M, bounds=bounds, k=args.k,
+              statuses=statuses, max_elements=app_module.MATRIX_MAX_ELEMENTS)
+    except (QuotaExhausted, app_module.UpstreamUnavailable) as error:
+        print(f'stopped: {error}; run again to resume')
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Shared JSON shape and encoding for permit responses.
+
+Rows can be Core result rows, snapshot records or ORM instances, anything
+with the column attributes. One `attrgetter` call pulls a row's fields as
+a tuple, and that tuple is zipped straight into the response dict.
+Encoding uses orjson when it is installed and falls back to the standard
+library otherwise.
+"""
+import json
+from operator import attrgetter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Public permit fields, in response order
+PERMIT_FIELDS = ('applicant', 'status', 'address', 'latitude', 'longitude', 'zipcodes', 'fooditems',
+                 'dayshours')
+# What a response holds without `fields`; later columns are opt-in
+DEFAULT_FIELDS = PERMIT_FIELDS[:6]
+
+
+def parse_fields(fields):
+    """Validate a client's `fields` list; None means DEFAULT_FIELDS.
+
+    Returns the fields in canonical order without duplicates, or raises
+    ValueError.
+    """
+    if fields is None:
+        return DEFAULT_FIELDS
+    if not isinstance(fields, list) or not fields or not all(isinstance(f, str) for f in fields):
+        raise ValueError('fields must be a non-empty list of field names')
+    unknown = [f for f in fields if f not in PERMIT_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return tuple(f for f in PERMIT_FIELDS if f in fields)
+
+
+class RowSerializer:
+    """Turns rows into response dicts holding just `fields`."""
+
+    def __init__(self, fields=PERMIT_FIELDS):
+        self.fields = fields
+        getter = attrgetter(*fields)
+        # attrgetter of a single name returns the bare value, not a 1-tuple
+        self._values = getter if len(fields) > 1 else (lambda row: (getter(row),))
+
+    def __call__(self, row):
+        return dict(zip(self.fields, self._values(row)))
+
+    def many(self, rows):
+        return [dict(zip(self.fields, values)) for values in map(self._values, rows)]
+
+
+def project(results, fields):
+    """Drop the permit fields not in `fields` from already-built result dicts.
+
+    Computed keys such as `distance_km` are always kept.
+    """
+    if fields == PERMIT_FIELDS:
+        return results
+    dropped = set(PERMIT_FIELDS).difference(fields)
+    return [{k: v for k, v in result.items() if k not in dropped} for result in results]
+
+
+def dumps(obj):
+    """Compact JSON as bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
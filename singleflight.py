@@ -0,0 +1,145 @@
+"""Coalesce concurrent computations of the same key ("single flight").
+
+When many requests miss the cache for one key at once, only the first (the
+leader) computes; the rest wait for its result. A follower that waits
+longer than `wait` gives up and computes on its own, so one stuck leader
+can't hold everyone. A leader's exception is handed to its followers and
+nothing is stored, so the next request simply tries again.
+
+With a `shared` lock store (see `SQLiteCache.acquire_lock`) the leader also
+takes a host-wide lock, and leaders in other worker processes poll
+`shared_lookup` for the value instead of computing it again.
+
+`AsyncSingleFlight` does the same for coroutines on one event loop.
+"""
+import asyncio
+import threading
+import time
+
+
+class _Call:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run at most one computation per key at a time in this process."""
+
+    def __init__(self, wait=10.0, shared=None, shared_lookup=None, poll_interval=0.05):
+        self.wait = wait
+        self.shared = shared
+        self.shared_lookup = shared_lookup
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    def do(self, key, fn):
+        """Return `fn()`, sharing one execution among concurrent callers for `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            if not call.done.wait(self.wait):
+                with self._lock:
+                    self.timeouts += 1
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = self._lead(key, fn)
+            return call.value
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _lead(self, key, fn):
+        if self.shared is None:
+            return fn()
+
+        lock_name = f'singleflight:{key}'
+        deadline = time.monotonic() + self.wait
+        while not self.shared.acquire_lock(lock_name, ttl=self.wait):
+            # Another worker is computing it; take its result once it lands
+            if self.shared_lookup is not None:
+                value = self.shared_lookup(key)
+                if value is not None:
+                    return value
+            if time.monotonic() >= deadline:
+                with self._lock:
+                    self.timeouts += 1
+                return fn()
+            time.sleep(self.poll_interval)
+
+        try:
+            # The previous holder may have stored the value just before releasing
+            if self.shared_lookup is not None:
+                value = self.shared_lookup(key)
+                if value is not None:
+                    return value
+            return fn()
+        finally:
+            self.shared.release_lock(lock_name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'timeouts': self.timeouts,
+            }
+
+
+class AsyncSingleFlight:
+    """`SingleFlight` for coroutines sharing one event loop (no cross-process lock)."""
+
+    def __init__(self, wait=10.0):
+        self.wait = wait
+        self._tasks = {}
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    async def do(self, key, fn):
+        """Return `await fn()`, sharing one execution among concurrent callers for `key`."""
+        task = self._tasks.get(key)
+        if task is None:
+            self.leaders += 1
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            # A cancelled caller mustn't cancel the computation others are waiting for
+            return await asyncio.shield(task)
+
+        self.followers += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.wait)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return await fn()
+
+    def stats(self):
+        return {
+            'in_flight': len(self._tasks),
+            'leaders': self.leaders,
+            'followers': self.followers,
+            'timeouts': self.timeouts,
+        }
@@ -0,0 +1,164 @@
+"""In-process spatial index for nearest food truck lookups.
+
+Permits are bucketed into a uniform latitude/longitude grid. A k-nearest
+query looks at the square of cells around the caller's cell, doubling it
+until no cell outside can hold anything closer than the current k-th
+result, so a query only touches the handful of cells around the caller no
+matter how many permits are loaded.
+
+Entries live in read-only NumPy arrays sorted by cell, one contiguous run
+per grid row of the square, and distances are computed vectorised. Queries
+never touch the Python objects of the entries they pass over, so an index
+built before gunicorn forks stays in pages the workers share.
+"""
+from math import asin, cos, floor, radians, sin, sqrt
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.195
+
+# ~1.1 km of latitude per cell, a few permits per cell in downtown SF.
+DEFAULT_CELL_DEG = 0.01
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres."""
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+def haversine_km_many(lat, lon, lats, lons):
+    """`haversine_km` from one point to arrays of points."""
+    lat, lon = radians(lat), radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def has_coordinates(lat, lon):
+    """The CSV uses 0.0 (and the table NULL) for permits without a location."""
+    return bool(lat) and bool(lon)
+
+
+class SpatialIndex:
+    """Grid index answering k-nearest queries by great-circle distance.
+
+    `entries` is an iterable of (item, latitude, longitude, status) tuples.
+    Entries without coordinates are skipped; `item` is returned untouched.
+    `nearest` can also be limited to a boolean mask over entry positions.
+    """
+
+    def __init__(self, entries, cell_deg=DEFAULT_CELL_DEG):
+        self.cell_deg = cell_deg
+        items, lats, lons, statuses, sources = [], [], [], [], []
+        for source, (item, lat, lon, status) in enumerate(entries):
+            if not has_coordinates(lat, lon):
+                continue
+            sources.append(source)
+            items.append(item)
+            lats.append(float(lat))
+            lons.append(float(lon))
+            statuses.append(status)
+        self.size = len(items)
+
+        lats = np.array(lats, dtype=np.float64)
+        lons = np.array(lons, dtype=np.float64)
+        rows = np.floor(lats / cell_deg).astype(np.int64)
+        cols = np.floor(lons / cell_deg).astype(np.int64)
+        if self.size:
+            self.bounds = (int(rows.min()), int(rows.max()), int(cols.min()), int(cols.max()))
+            self.max_abs_lat = float(np.abs(lats).max())
+            keys = self._key(rows, cols)
+        else:
+            self.bounds = None
+            self.max_abs_lat = 0.0
+            keys = np.empty(0, dtype=np.int64)
+        self.status_names = tuple(sorted(set(statuses), key=str))
+        codes = {status: i for i, status in enumerate(self.status_names)}
+
+        # Sorted by cell, load order within a cell
+        order = np.argsort(keys, kind='stable')
+        self.items = tuple(items[i] for i in order)
+        self.keys = keys[order]
+        self.lat_rad = np.radians(lats)[order]
+        self.lon_rad = np.radians(lons)[order]
+        self.cos_lat = np.cos(self.lat_rad)
+        self.status_codes = np.array([codes[s] for s in statuses], dtype=np.int16)[order]
+        # Position in `entries` of each entry, for `allowed` masks
+        self.sources = np.array(sources, dtype=np.int64)[order]
+        for array in (self.keys, self.lat_rad, self.lon_rad, self.cos_lat, self.status_codes, self.sources):
+            array.flags.writeable = False
+
+    def __len__(self):
+        return self.size
+
+    def _cell(self, lat, lon):
+        return floor(lat / self.cell_deg), floor(lon / self.cell_deg)
+
+    def _key(self, i, j):
+        """Cells numbered row by row across the populated area."""
+        min_i, _, min_j, max_j = self.bounds
+        return (i - min_i) * (max_j - min_j + 1) + (j - min_j)
+
+    def _square(self, ci, cj, r):
+        """Positions of the entries within `r` cells of (ci, cj), row by row."""
+        min_i, max_i, min_j, max_j = self.bounds
+        lo_j, hi_j = max(cj - r, min_j), min(cj + r, max_j)
+        rows = np.arange(max(ci - r, min_i), min(ci + r, max_i) + 1)
+        if lo_j > hi_j or not len(rows):
+            return np.empty(0, dtype=np.intp)
+        # Each row of the square is one contiguous run of keys
+        starts = np.searchsorted(self.keys, self._key(rows, lo_j), side='left')
+        stops = np.searchsorted(self.keys, self._key(rows, hi_j), side='right')
+        lengths = stops - starts
+        return np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+    def _ring_min_km(self, r, query_lat):
+        """Lower bound on the distance to anything in ring `r` or beyond."""
+        # A longitude degree is shortest at the highest latitude involved; the
+        # 0.99 factor absorbs the gap between the parallel and the great circle.
+        max_lat = max(self.max_abs_lat, abs(query_lat))
+        lon_km = KM_PER_DEGREE * cos(radians(max_lat))
+        return (r - 1) * self.cell_deg * min(KM_PER_DEGREE, lon_km) * 0.99
+
+    def nearest(self, lat, lon, k=5, statuses=None, allowed=None):
+        """Return up to `k` (distance_km, item) pairs, closest first.
+
+        When `statuses` is given only entries whose status is in it count,
+        and when `allowed` is, only entries whose position in `entries` it
+        marks True.
+        """
+        if self.bounds is None or k <= 0:
+            return []
+
+        lat, lon = float(lat), float(lon)
+        ci, cj = self._cell(lat, lon)
+        min_i, max_i, min_j, max_j = self.bounds
+        # Squares smaller than `first_ring` miss the populated area entirely and
+        # one of `max_ring` covers all of it.
+        first_ring = max(min_i - ci, ci - max_i, min_j - cj, cj - max_j, 0)
+        max_ring = max(abs(ci - min_i), abs(ci - max_i), abs(cj - min_j), abs(cj - max_j))
+        wanted = None
+        if statuses is not None:
+            wanted = np.array([status in statuses for status in self.status_names], dtype=bool)
+        lat_rad, lon_rad = radians(lat), radians(lon)
+
+        r = max(first_ring, 1)
+        while True:
+            positions = self._square(ci, cj, r)
+            if wanted is not None:
+                positions = positions[wanted[self.status_codes[positions]]]
+            if allowed is not None:
+                positions = positions[allowed[self.sources[positions]]]
+            if len(positions) >= k or r >= max_ring:
+                # haversine_km, vectorised over the square
+                a = (np.sin((self.lat_rad[positions] - lat_rad) / 2) ** 2
+                     + cos(lat_rad) * self.cos_lat[positions]
+                     * np.sin((self.lon_rad[positions] - lon_rad) / 2) ** 2)
+                distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+                order = np.argsort(distances, kind='stable')[:k]
+                if r >= max_ring or distances[order[-1]] <= self._ring_min_km(r + 1, lat):
+                    return [(float(distances[i]), self.items[positions[i]]) for i in order]
+            r = min(r * 2, max_ring)
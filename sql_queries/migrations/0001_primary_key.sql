@@ -0,0 +1,6 @@
+-- locationid is unique in the city's export; make it the real key the model assumes.
+ALTER TABLE mobile_food_facility_permit
+    ALTER COLUMN locationid SET NOT NULL;
+
+ALTER TABLE mobile_food_facility_permit
+    ADD CONSTRAINT mobile_food_facility_permit_pkey PRIMARY KEY (locationid);
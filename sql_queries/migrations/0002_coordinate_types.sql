@@ -0,0 +1,4 @@
+-- The CSV load left coordinates as untyped NUMERIC; the app reads them as floats.
+ALTER TABLE mobile_food_facility_permit
+    ALTER COLUMN latitude TYPE double precision USING latitude::double precision,
+    ALTER COLUMN longitude TYPE double precision USING longitude::double precision;
@@ -0,0 +1,3 @@
+-- Every search filters on status.
+CREATE INDEX IF NOT EXISTS ix_permit_status
+    ON mobile_food_facility_permit (status);
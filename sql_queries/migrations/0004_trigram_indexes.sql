@@ -0,0 +1,8 @@
+-- ILIKE '%q%' has a leading wildcard, so only trigram GIN indexes can serve it.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_permit_applicant_trgm
+    ON mobile_food_facility_permit USING gin (applicant gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ix_permit_address_trgm
+    ON mobile_food_facility_permit USING gin (address gin_trgm_ops);
@@ -0,0 +1,15 @@
+-- A point per permit for index-assisted nearest-neighbour (<->) queries.
+-- The CSV uses 0/0 for permits without a location; those get no point.
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+ALTER TABLE mobile_food_facility_permit
+    ADD COLUMN IF NOT EXISTS geog geography(Point, 4326)
+    GENERATED ALWAYS AS (
+        CASE
+            WHEN latitude <> 0 AND longitude <> 0
+            THEN ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography
+        END
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_permit_geog
+    ON mobile_food_facility_permit USING gist (geog);
@@ -0,0 +1,12 @@
+-- Lets ingest.py skip unchanged rows and tell caches when the data moved on.
+ALTER TABLE mobile_food_facility_permit
+    ADD COLUMN IF NOT EXISTS row_hash TEXT;
+
+CREATE TABLE IF NOT EXISTS dataset_version (
+    version BIGSERIAL PRIMARY KEY,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    source TEXT,
+    rows_inserted INTEGER NOT NULL DEFAULT 0,
+    rows_updated INTEGER NOT NULL DEFAULT 0,
+    rows_deleted INTEGER NOT NULL DEFAULT 0
+);
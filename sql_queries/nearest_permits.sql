@@ -0,0 +1,7 @@
+SELECT applicant, status, address, latitude, longitude,
+       ST_Distance(geog, ST_SetSRID(ST_MakePoint(-122.4194, 37.7749), 4326)::geography) / 1000.0 AS distance_km
+FROM mobile_food_facility_permit
+WHERE geog IS NOT NULL
+  AND status IN ('APPROVED')
+ORDER BY geog <-> ST_SetSRID(ST_MakePoint(-122.4194, 37.7749), 4326)::geography
+LIMIT 5;
@@ -1,16 +1,24 @@
 import unittest
 from unittest.mock import patch, MagicMock, Mock
 import json
+import gc
 from time import time
 import hashlib
+import shutil
 import sys
 import os
+import tempfile
 
 # Add the parent directory to sys.path to import the main app
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from upstream_budget import MemoryBudget
+from road_grid import RoadGridStore, build
+from spatial_index import haversine_km
+from cache import quantize
+
 # Import the Flask app and components
-from app import app, db, MobileFoodFacilityPermit, distance_cache, make_cache_key, chunk_list, get_distance_batch
+from app import app, db, MobileFoodFacilityPermit, DatasetVersion, distance_cache, make_cache_key, chunk_list, encode_cursor, get_distance_batch, snapshot_store, pair_distance_cache, dataset_version_cache, warm_start
 
 
 class TestFlaskApp(unittest.TestCase):
@@ -28,6 +36,9 @@ class TestFlaskApp(unittest.TestCase):
         
         # Clear cache before each test
         distance_cache.clear()
+        pair_distance_cache.clear()
+        dataset_version_cache.clear()
+        snapshot_store.invalidate()
         
         # Add sample data
         self._add_sample_data()
@@ -38,6 +49,8 @@ class TestFlaskApp(unittest.TestCase):
         db.drop_all()
         self.app_context.pop()
         distance_cache.clear()
+        pair_distance_cache.clear()
+        snapshot_store.invalidate()
     
     def _add_sample_data(self):
         """Add sample data for testing."""
@@ -188,9 +201,108 @@ class TestSearchApplicantEndpoint(TestFlaskApp):
         self.assertEqual(data[0]['status'], 'APPROVED')
 
 
+class TestSearchApplicantPagination(TestFlaskApp):
+
+    ALL_STATUSES = ['APPROVED', 'EXPIRED', 'REQUESTED']
+
+    def _pages(self, engine, page_size):
+        payload = {'applicant': '', 'statuses': self.ALL_STATUSES, 'page_size': page_size, 'engine': engine}
+        pages = []
+        while True:
+            response = self.app.post('/search_applicant', json=payload)
+            self.assertEqual(response.status_code, 200)
+            page = json.loads(response.data)
+            pages.append([p['applicant'] for p in page['results']])
+            if page['next_cursor'] is None:
+                return pages
+            payload['cursor'] = page['next_cursor']
+
+    def test_pages_cover_every_match_once(self):
+        """Test following next_cursor walks all matches in locationid order, for every engine."""
+        expected = [['Taco Truck', 'Pizza Cart', 'Burrito Express'], ['Sandwich Shop']]
+        for engine in ('sql', 'index', 'scan'):
+            self.assertEqual(self._pages(engine, 3), expected, engine)
+
+    def test_exact_last_page_has_no_cursor(self):
+        """Test a page that ends on the last match doesn't hand out an empty next page."""
+        self.assertEqual(self._pages('sql', 2), [['Taco Truck', 'Pizza Cart'], ['Burrito Express', 'Sandwich Shop']])
+
+    def test_unpaged_request_keeps_list_shape(self):
+        """Test requests without cursor or page_size still get a plain list."""
+        response = self.app.post('/search_applicant', json={'applicant': ''})
+        self.assertIsInstance(json.loads(response.data), list)
+
+    def test_stream_ndjson(self):
+        """Test streaming returns every match as one JSON line each."""
+        for engine in ('sql', 'index'):
+            payload = {'applicant': '', 'statuses': self.ALL_STATUSES, 'stream': True, 'engine': engine}
+            response = self.app.post('/search_applicant', json=payload)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            rows = [json.loads(line) for line in response.data.decode().splitlines()]
+            self.assertEqual([r['applicant'] for r in rows],
+                             ['Taco Truck', 'Pizza Cart', 'Burrito Express', 'Sandwich Shop'])
+
+    def test_stream_resumes_from_cursor(self):
+        """Test a stream can start where a page left off."""
+        page = json.loads(self.app.post('/search_applicant', json={
+            'applicant': '', 'statuses': self.ALL_STATUSES, 'page_size': 3, 'engine': 'sql'
+        }).data)
+        response = self.app.post('/search_applicant', json={
+            'applicant': '', 'statuses': self.ALL_STATUSES, 'stream': True,
+            'cursor': page['next_cursor'], 'engine': 'sql'
+        })
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([r['applicant'] for r in rows], ['Sandwich Shop'])
+
+    def test_invalid_paging_parameters(self):
+        """Test bad cursors and page sizes are rejected."""
+        for extra in ({'cursor': 'not-a-cursor'}, {'cursor': 42}, {'page_size': 0}, {'page_size': '10'},
+                      {'page_size': True}, {'cursor': encode_cursor(True)}):
+            response = self.app.post('/search_applicant', json=dict({'applicant': ''}, **extra))
+            self.assertEqual(response.status_code, 400, extra)
+
+
+class TestFieldSelection(TestFlaskApp):
+
+    def test_search_applicant_fields(self):
+        """Test only the requested fields are returned, for every engine."""
+        for engine in ('sql', 'index'):
+            payload = {'applicant': 'Taco', 'fields': ['applicant', 'zipcodes'], 'engine': engine}
+            data = json.loads(self.app.post('/search_applicant', json=payload).data)
+            self.assertEqual(data, [{'applicant': 'Taco Truck', 'zipcodes': '94102'}])
+
+    def test_search_nearby_fields_keep_distance(self):
+        """Test a projected nearby result still carries its distance."""
+        payload = {'latitude': 37.7749, 'longitude': -122.4194, 'mode': 'straight_line', 'fields': ['applicant']}
+        data = json.loads(self.app.post('/search_nearby', json=payload).data)
+        self.assertEqual(data[0], {'applicant': 'Taco Truck', 'distance_km': 0.0})
+
+    def test_unknown_field(self):
+        """Test unknown field names are rejected."""
+        response = self.app.post('/search_applicant', json={'applicant': '', 'fields': ['locationid']})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.USE_PERMIT_SNAPSHOT', False)
+    @patch('app.distance_client.session.get')
+    def test_nearby_without_snapshot_reads_core_rows(self, mock_get):
+        """Test the database path ranks plain column rows."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "status": "OK",
+            "rows": [{"elements": [{"status": "OK", "distance": {"value": m}} for m in (2000, 1000)]}]
+        }
+        mock_get.return_value = mock_response
+        payload = {'latitude': 37.7749, 'longitude': -122.4194}
+
+        data = json.loads(self.app.post('/search_nearby', json=payload).data)
+
+        self.assertEqual([d['applicant'] for d in data], ['Pizza Cart', 'Taco Truck'])
+
+
 class TestSearchNearbyEndpoint(TestFlaskApp):
     
-    @patch('app.requests.get')
+    @patch('app.distance_client.session.get')
     def test_search_nearby_basic(self, mock_get):
         """Test basic nearby search functionality."""
         # Mock Google API response
@@ -244,6 +356,19 @@ class TestSearchNearbyEndpoint(TestFlaskApp):
         data = json.loads(response.data)
         self.assertEqual(data['error'], 'Latitude and longitude are required')
     
+    def test_search_nearby_invalid_coordinates(self):
+        """Test coordinates that aren't finite numbers on the globe are a 400, not a 500."""
+        for lat, lon in (('abc', 'x'), ([1], -122.4), (True, -122.4), (37.7, float('inf')),
+                         (91, -122.4), (37.7, -181), ('nan', '-122.4')):
+            response = self.app.post('/search_nearby', json={'latitude': lat, 'longitude': lon},
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 400, (lat, lon))
+        self.assertIn('numbers', json.loads(response.data)['error'])
+        # The frontend posts its inputs as strings
+        response = self.app.post('/search_nearby', json={'latitude': '37.7749', 'longitude': '-122.4194',
+                                                         'mode': 'straight_line'})
+        self.assertEqual(json.loads(response.data)[0]['applicant'], 'Taco Truck')
+
     def test_search_nearby_invalid_statuses(self):
         """Test nearby search with invalid statuses format."""
         payload = {
@@ -259,7 +384,7 @@ class TestSearchNearbyEndpoint(TestFlaskApp):
         data = json.loads(response.data)
         self.assertEqual(data['error'], 'statuses must be a list')
     
-    @patch('app.requests.get')
+    @patch('app.distance_client.session.get')
     def test_search_nearby_caching(self, mock_get):
         """Test that caching works for nearby searches."""
         # Mock Google API response
@@ -293,6 +418,897 @@ class TestSearchNearbyEndpoint(TestFlaskApp):
         self.assertEqual(mock_get.call_count, 1)
 
 
+class TestSearchNearbyStraightLine(TestFlaskApp):
+
+    @patch('app.distance_client.session.get')
+    def test_straight_line_no_upstream_call(self, mock_get):
+        """Test straight-line mode answers locally without calling Google."""
+        payload = {
+            'latitude': 37.7749,
+            'longitude': -122.4194,
+            'statuses': ['APPROVED'],
+            'mode': 'straight_line'
+        }
+        response = self.app.post('/search_nearby', json=payload)
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([d['applicant'] for d in data], ['Taco Truck', 'Pizza Cart'])
+        self.assertEqual(data[0]['distance_km'], 0.0)
+        self.assertLessEqual(data[0]['distance_km'], data[1]['distance_km'])
+        mock_get.assert_not_called()
+
+    def test_straight_line_status_filter(self):
+        """Test straight-line mode honours the status filter."""
+        payload = {
+            'latitude': 37.7749,
+            'longitude': -122.4194,
+            'statuses': ['EXPIRED', 'REQUESTED'],
+            'mode': 'straight_line'
+        }
+        response = self.app.post('/search_nearby', json=payload)
+
+        data = json.loads(response.data)
+        self.assertEqual({d['status'] for d in data}, {'EXPIRED', 'REQUESTED'})
+
+    def test_straight_line_skips_missing_coordinates(self):
+        """Test permits with 0.0 coordinates are never returned."""
+        db.session.add(MobileFoodFacilityPermit(
+            locationid=5, applicant="Nowhere Cart", status="APPROVED",
+            address="0 Unknown", latitude=0.0, longitude=0.0, zipcodes=None
+        ))
+        db.session.commit()
+        payload = {'latitude': 37.7749, 'longitude': -122.4194, 'mode': 'straight_line'}
+        response = self.app.post('/search_nearby', json=payload)
+
+        data = json.loads(response.data)
+        self.assertNotIn('Nowhere Cart', [d['applicant'] for d in data])
+
+    def test_invalid_mode(self):
+        """Test an unknown mode is rejected."""
+        payload = {'latitude': 37.7749, 'longitude': -122.4194, 'mode': 'teleport'}
+        response = self.app.post('/search_nearby', json=payload)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', json.loads(response.data))
+
+
+class TestSearchNearbyHybrid(TestFlaskApp):
+
+    def _mock_distances(self, mock_get, meters):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "status": "OK",
+            "rows": [{"elements": [{"status": "OK", "distance": {"value": m}} for m in meters]}]
+        }
+        mock_get.return_value = mock_response
+
+    @patch('app.HYBRID_CANDIDATES', 2)
+    @patch('app.distance_client.session.get')
+    def test_hybrid_sends_only_candidates(self, mock_get):
+        """Test hybrid mode asks Google only about the geometric candidates."""
+        self._mock_distances(mock_get, [3000, 1000])
+        payload = {
+            'latitude': 37.7749,
+            'longitude': -122.4194,
+            'statuses': ['APPROVED', 'EXPIRED', 'REQUESTED'],
+            'mode': 'hybrid'
+        }
+        response = self.app.post('/search_nearby', json=payload)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_get.call_count, 1)
+        destinations = mock_get.call_args.kwargs['params']['destinations']
+        self.assertEqual(len(destinations.split('|')), 2)
+
+    @patch('app.distance_client.session.get')
+    def test_hybrid_reranks_by_road_distance(self, mock_get):
+        """Test hybrid results are ordered by road distance and carry both distances."""
+        # Taco Truck is geometrically closest but further by road
+        self._mock_distances(mock_get, [3000, 1000])
+        payload = {
+            'latitude': 37.7749,
+            'longitude': -122.4194,
+            'statuses': ['APPROVED'],
+            'mode': 'hybrid'
+        }
+        response = self.app.post('/search_nearby', json=payload)
+
+        data = json.loads(response.data)
+        self.assertEqual([d['applicant'] for d in data], ['Pizza Cart', 'Taco Truck'])
+        self.assertEqual(data[0]['distance_km'], 1.0)
+        self.assertIn('straight_line_km', data[0])
+        self.assertEqual(data[1]['straight_line_km'], 0.0)
+
+
+class TestPairDistanceCache(TestFlaskApp):
+
+    def _mock_distances(self, mock_get):
+        def respond(url, params, **kwargs):
+            count = len(params['destinations'].split('|'))
+            mock_response = Mock()
+            mock_response.status_code = 200
+            mock_response.json.return_value = {
+                "status": "OK",
+                "rows": [{"elements": [
+                    {"status": "OK", "distance": {"value": 1000 * (i + 1)}} for i in range(count)
+                ]}]
+            }
+            return mock_response
+        mock_get.side_effect = respond
+
+    @patch('app.distance_client.session.get')
+    def test_overlapping_queries_only_fetch_new_pairs(self, mock_get):
+        """Test a second query from the same cell only asks for unseen permits."""
+        self._mock_distances(mock_get)
+        payload = {'latitude': 37.7749, 'longitude': -122.4194, 'statuses': ['APPROVED']}
+        self.app.post('/search_nearby', json=payload)
+        self.assertEqual(len(mock_get.call_args.kwargs['params']['destinations'].split('|')), 2)
+
+        payload['statuses'] = ['APPROVED', 'EXPIRED']
+        response = self.app.post('/search_nearby', json=payload)
+
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(len(mock_get.call_args.kwargs['params']['destinations'].split('|')), 1)
+        self.assertEqual(len(json.loads(response.data)), 3)
+
+    @patch('app.distance_client.session.get')
+    def test_fully_cached_pairs_skip_upstream(self, mock_get):
+        """Test a query whose pairs are all cached makes no upstream call."""
+        self._mock_distances(mock_get)
+        payload = {'latitude': 37.7749, 'longitude': -122.4194, 'statuses': ['APPROVED']}
+        self.app.post('/search_nearby', json=payload)
+        distance_cache.clear()
+
+        response = self.app.post('/search_nearby', json=payload)
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(len(json.loads(response.data)), 2)
+
+
+class TestPermitSnapshot(TestFlaskApp):
+
+    def test_search_applicant_matches_sql_path(self):
+        """Test the snapshot and the ILIKE query return the same permits."""
+        payloads = [
+            {'applicant': 'a', 'statuses': ['APPROVED', 'EXPIRED', 'REQUESTED']},
+            {'applicant': '', 'address': 'st', 'statuses': ['APPROVED', 'EXPIRED']},
+            {'applicant': 'TRUCK'},
+            {'applicant': 'co tr', 'address': 'main'},
+            {'applicant': 'zzz'},
+        ]
+        for payload in payloads:
+            with patch('app.USE_PERMIT_SNAPSHOT', False):
+                from_sql = json.loads(self.app.post('/search_applicant', json=payload).data)
+            for engine in ('index', 'scan'):
+                response = self.app.post('/search_applicant', json=dict(payload, engine=engine))
+                self.assertEqual(json.loads(response.data), from_sql)
+
+    def test_like_metacharacters_match_literally(self):
+        """Test `%`, `_` and `\\` in a query match themselves in every engine, not as wildcards."""
+        for locationid, applicant, address in ((5, '100% Tacos', '1_2 Mission St'), (6, 'Hot_Dog Stand', '12 Mission St'),
+                                               (7, 'Hot Dog Stand', 'A\\B Alley'), (8, 'Back\\Slash Cafe', 'AB Alley')):
+            db.session.add(MobileFoodFacilityPermit(
+                locationid=locationid, applicant=applicant, address=address, status='APPROVED'
+            ))
+        db.session.commit()
+        queries = [('%', ''), ('_', ''), ('\\', ''), ('hot_dog', ''), ('100%', ''), ('0% t', ''), ('o%t', ''),
+                   ('', '1_2'), ('', 'a\\b'), ('', '%'), ('hot', ''), ('stand', '')]
+        for applicant, address in queries:
+            results = {}
+            for engine in ('sql', 'index', 'scan'):
+                payload = {'applicant': applicant, 'address': address, 'engine': engine, 'fields': ['applicant']}
+                results[engine] = [r['applicant'] for r in json.loads(self.app.post('/search_applicant', json=payload).data)]
+            self.assertEqual(results['sql'], results['index'], (applicant, address))
+            self.assertEqual(results['sql'], results['scan'], (applicant, address))
+        self.assertEqual(results['sql'], ['Hot_Dog Stand', 'Hot Dog Stand'])
+        payload = {'applicant': 'hot_dog', 'engine': 'sql', 'fields': ['applicant']}
+        self.assertEqual(json.loads(self.app.post('/search_applicant', json=payload).data), [{'applicant': 'Hot_Dog Stand'}])
+
+    def test_invalid_engine(self):
+        """Test an unknown search engine is rejected."""
+        response = self.app.post('/search_applicant', json={'applicant': 'Taco', 'engine': 'grep'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_snapshot_serves_without_database(self):
+        """Test searches after the first load don't touch the database."""
+        self.app.post('/search_applicant', json={'applicant': 'Taco'})
+        with patch('app.load_permit_rows', side_effect=AssertionError('database hit')):
+            response = self.app.post('/search_applicant', json={'applicant': 'Taco'})
+            nearby = self.app.post('/search_nearby', json={
+                'latitude': 37.7749, 'longitude': -122.4194, 'mode': 'straight_line'
+            })
+        self.assertEqual(len(json.loads(response.data)), 1)
+        self.assertEqual(nearby.status_code, 200)
+
+    @patch('app.ADMIN_TOKEN', 'secret')
+    def test_reload_endpoint(self):
+        """Test the reload endpoint picks up new rows."""
+        self.app.post('/search_applicant', json={'applicant': 'Taco'})
+        db.session.add(MobileFoodFacilityPermit(
+            locationid=6, applicant="Taco Two", status="APPROVED",
+            address="1 New St", latitude=37.78, longitude=-122.41, zipcodes="94103"
+        ))
+        db.session.commit()
+
+        response = self.app.post('/admin/reload', headers={'X-Admin-Token': 'secret'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['permits'], 5)
+        data = json.loads(self.app.post('/search_applicant', json={'applicant': 'Taco'}).data)
+        self.assertEqual(len(data), 2)
+
+    @patch('app.ADMIN_TOKEN', 'secret')
+    def test_reload_requires_token(self):
+        """Test the reload endpoint rejects callers without the admin token."""
+        response = self.app.post('/admin/reload', headers={'X-Admin-Token': 'wrong'})
+        self.assertEqual(response.status_code, 403)
+
+
+class TestWarmStart(TestFlaskApp):
+
+    def tearDown(self):
+        gc.unfreeze()
+        super().tearDown()
+
+    def test_ready_only_once_warm(self):
+        """Test /ready answers 503 until warm_start has loaded the snapshot."""
+        response = self.app.get('/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.data), {'ready': False})
+
+        self.assertGreater(warm_start(), 0)
+        self.assertIsNotNone(snapshot_store.peek())
+        self.assertGreater(gc.get_freeze_count(), 0)
+
+        response = self.app.get('/ready')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertTrue(data['ready'])
+        self.assertEqual(data['permits'], len(snapshot_store.peek()))
+        self.assertGreater(data['permits'], 0)
+        self.assertEqual(data['version'], snapshot_store.peek().version)
+
+    def test_warm_start_is_repeatable(self):
+        warm_start()
+        snapshot = snapshot_store.peek()
+        warm_start()
+        self.assertIs(snapshot_store.peek(), snapshot)
+
+
+class TestSearchFood(TestFlaskApp):
+
+    FOOD = {1: 'Tacos: Burritos: Sodas', 2: 'Pizza: Soda', 3: 'Burritos', 4: 'Sandwiches: Tacos'}
+
+    def setUp(self):
+        super().setUp()
+        for locationid, items in self.FOOD.items():
+            db.session.get(MobileFoodFacilityPermit, locationid).fooditems = items
+        db.session.commit()
+
+    def search(self, **body):
+        return self.app.post('/search_food', json=body)
+
+    def test_ranked_by_bm25(self):
+        """Test matches come best first and stemming finds inflected items."""
+        data = json.loads(self.search(query='taco', statuses=['APPROVED', 'REQUESTED']).data)
+        # Both mention tacos once; BM25 ranks the shorter item list first
+        self.assertEqual([r['applicant'] for r in data], ['Sandwich Shop', 'Taco Truck'])
+        self.assertGreater(data[0]['score'], data[1]['score'])
+        self.assertNotIn('fooditems', data[1])
+        body = dict(query='taco', statuses=['APPROVED', 'REQUESTED'], fields=['applicant', 'fooditems'])
+        data = json.loads(self.search(**body).data)
+        self.assertEqual(data[1]['fooditems'], 'Tacos: Burritos: Sodas')
+
+    def test_status_filter_and_no_match(self):
+        data = json.loads(self.search(query='burrito').data)
+        self.assertEqual([r['applicant'] for r in data], ['Taco Truck'])
+        self.assertEqual(json.loads(self.search(query='sushi').data), [])
+
+    def test_near_location_orders_by_distance(self):
+        """Test with a location matches come nearest first, each with distance and score."""
+        body = dict(query='soda', latitude=37.7849, longitude=-122.4094, fields=['applicant'])
+        data = json.loads(self.search(**body).data)
+        self.assertEqual([r['applicant'] for r in data], ['Pizza Cart', 'Taco Truck'])
+        self.assertEqual(data[0]['distance_km'], 0.0)
+        self.assertIn('score', data[0])
+        self.assertEqual(len(json.loads(self.search(limit=1, **body).data)), 1)
+        # The frontend posts its text inputs as strings
+        as_text = json.loads(self.search(**dict(body, latitude='37.7849', longitude='-122.4094')).data)
+        self.assertEqual(as_text, data)
+
+    @patch('app.distance_client.session.get')
+    def test_hybrid_reranks_by_road(self, mock_get):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "status": "OK",
+            "rows": [{"elements": [{"status": "OK", "distance": {"value": m}} for m in (5000, 1000)]}]
+        }
+        mock_get.return_value = mock_response
+        data = json.loads(self.search(query='soda', latitude=37.7849, longitude=-122.4094, mode='hybrid').data)
+        self.assertEqual([r['distance_km'] for r in data], [1.0, 5.0])
+        self.assertEqual({r['distance_source'] for r in data}, {'road'})
+
+    def test_get_revalidation(self):
+        url = '/search_food?query=tacos&statuses=APPROVED,REQUESTED'
+        first = self.app.get(url)
+        self.assertEqual(len(json.loads(first.data)), 2)
+        self.assertEqual(self.app.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code, 304)
+
+    def test_invalid_requests(self):
+        for body in ({}, {'query': ' '}, {'query': 'taco', 'latitude': 'abc', 'longitude': -122.4},
+                     {'query': 'taco', 'latitude': 37.7}, {'query': 'taco', 'latitude': True, 'longitude': 1},
+                     {'query': 'taco', 'limit': 0}, {'query': 'taco', 'mode': 'road'},
+                     {'query': 'taco', 'statuses': 'APPROVED'}):
+            self.assertEqual(self.search(**body).status_code, 400, body)
+        self.assertEqual(self.app.get('/search_food?query=taco&latitude=abc&longitude=1').status_code, 400)
+
+
+class TestOpenFilter(TestFlaskApp):
+
+    HOURS = {1: 'Mo-Fr:10AM-2PM', 2: 'Mo-Su:12AM-12AM', 3: 'Mo-Fr:10AM-2PM', 4: 'Sa-Su:8PM-2AM'}
+    MONDAY_NOON = '2024-01-01T12:00'
+
+    def setUp(self):
+        super().setUp()
+        for locationid, hours in self.HOURS.items():
+            db.session.get(MobileFoodFacilityPermit, locationid).dayshours = hours
+        db.session.commit()
+
+    def applicants(self, response):
+        self.assertEqual(response.status_code, 200, response.data)
+        return [r['applicant'] for r in json.loads(response.data)]
+
+    def test_search_applicant_open_at(self):
+        statuses = ['APPROVED', 'REQUESTED']
+        body = dict(applicant='', statuses=statuses, open_at=self.MONDAY_NOON)
+        self.assertEqual(self.applicants(self.app.post('/search_applicant', json=body)), ['Taco Truck', 'Pizza Cart'])
+        # Sunday 1 AM is still Saturday night's shift
+        body['open_at'] = '2024-01-07T01:00'
+        for engine in ('index', 'scan'):
+            response = self.app.post('/search_applicant', json=dict(body, engine=engine))
+            self.assertEqual(self.applicants(response), ['Pizza Cart', 'Sandwich Shop'])
+        page = json.loads(self.app.post('/search_applicant', json=dict(body, page_size=1)).data)
+        self.assertEqual([r['applicant'] for r in page['results']], ['Pizza Cart'])
+
+    def test_search_nearby_open_at(self):
+        """Test the nearest open permits are returned, not the nearest permits filtered afterwards."""
+        body = dict(latitude=37.7749, longitude=-122.4194, mode='straight_line', statuses=['APPROVED', 'REQUESTED'])
+        everything = self.applicants(self.app.post('/search_nearby', json=body))
+        self.assertEqual(everything[0], 'Taco Truck')
+        late = self.applicants(self.app.post('/search_nearby', json=dict(body, open_at='2024-01-06T23:00')))
+        self.assertEqual(late, ['Pizza Cart', 'Sandwich Shop'])
+
+    def test_search_food_open_at(self):
+        for permit in db.session.query(MobileFoodFacilityPermit):
+            permit.fooditems = 'Tacos'
+        db.session.commit()
+        body = dict(query='taco', statuses=['APPROVED', 'REQUESTED'], open_at='2024-01-06T23:00')
+        self.assertEqual(sorted(self.applicants(self.app.post('/search_food', json=body))),
+                         ['Pizza Cart', 'Sandwich Shop'])
+        near = dict(body, latitude=37.7749, longitude=-122.4194)
+        self.assertEqual(self.applicants(self.app.post('/search_food', json=near)), ['Pizza Cart', 'Sandwich Shop'])
+        response = self.app.get('/search_food?query=taco&open_now=true')
+        self.assertEqual(self.applicants(response), ['Pizza Cart'])
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertIn('open_at=', response.headers['Content-Location'])
+        self.assertEqual(self.app.post('/search_food', json=dict(body, open_at='tomorrow')).status_code, 400)
+
+    def test_new_columns_are_opt_in(self):
+        """Test fooditems and dayshours only appear when asked for, leaving the default shape as it was."""
+        nearby = dict(latitude=37.7749, longitude=-122.4194, mode='straight_line')
+        for url, body in (('/search_applicant', dict(applicant='Taco')), ('/search_nearby', nearby)):
+            first = json.loads(self.app.post(url, json=body).data)[0]
+            self.assertNotIn('fooditems', first)
+            self.assertNotIn('dayshours', first)
+            first = json.loads(self.app.post(url, json=dict(body, fields=['applicant', 'dayshours'])).data)[0]
+            self.assertEqual(first['dayshours'], 'Mo-Fr:10AM-2PM')
+
+    def test_open_now_is_not_cached(self):
+        """Test open_now GETs revalidate and key their ETag on the slot they answered for."""
+        for url in ('/search_applicant?applicant=&open_now=true',
+                    '/search_nearby?latitude=37.7749&longitude=-122.4194&mode=straight_line&open_now=1'):
+            response = self.app.get(url)
+            self.assertEqual(self.applicants(response), ['Pizza Cart'])
+            self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+            self.assertIn('open_at=', response.headers['Content-Location'])
+            etag = response.headers['ETag']
+            self.assertEqual(self.app.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_cache_key_includes_slot(self):
+        from opening_hours import resolve_open_at
+        monday, week_later = resolve_open_at(self.MONDAY_NOON), resolve_open_at('2024-01-08T12:10')
+        key = make_cache_key(37.7749, -122.4194, {'APPROVED'})
+        self.assertNotEqual(make_cache_key(37.7749, -122.4194, {'APPROVED'}, open_at=monday), key)
+        self.assertEqual(make_cache_key(37.7749, -122.4194, {'APPROVED'}, open_at=monday),
+                         make_cache_key(37.7749, -122.4194, {'APPROVED'}, open_at=week_later))
+
+    def test_invalid(self):
+        for body in ({'applicant': '', 'open_at': 'noon'}, {'applicant': '', 'open_now': 'yes'},
+                     {'applicant': '', 'open_now': True, 'engine': 'sql'}):
+            self.assertEqual(self.app.post('/search_applicant', json=body).status_code, 400, body)
+        body = {'latitude': 37.77, 'longitude': -122.41, 'open_at': 'noon'}
+        self.assertEqual(self.app.post('/search_nearby', json=body).status_code, 400)
+
+
+class TestPermitsInBbox(TestFlaskApp):
+
+    CITY = 'bbox=-122.52,37.70,-122.36,37.82'
+
+    def test_zoomed_in_lists_permits(self):
+        response = self.app.get(f'/permits/in_bbox?{self.CITY}&zoom=16&statuses=APPROVED,EXPIRED&fields=applicant')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['total'], 3)
+        self.assertEqual([p['applicant'] for p in data['permits']],
+                         ['Taco Truck', 'Pizza Cart', 'Burrito Express'])
+        self.assertIn('ETag', response.headers)
+
+    def test_zoomed_out_returns_clusters(self):
+        """Test a city-wide view at low zoom is cluster counts and centroids, not permits."""
+        response = self.app.get(f'/permits/in_bbox?{self.CITY}&zoom=9')
+        data = json.loads(response.data)
+        self.assertNotIn('permits', data)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(sum(c['count'] for c in data['clusters']), 2)
+        cluster = data['clusters'][0]
+        self.assertAlmostEqual(cluster['latitude'], (37.7749 + 37.7849) / 2, places=5)
+
+    def test_too_many_permits_fall_back_to_clusters(self):
+        with patch('app.BBOX_MAX_PERMITS', 1):
+            data = json.loads(self.app.get(f'/permits/in_bbox?{self.CITY}&zoom=16').data)
+        self.assertIn('clusters', data)
+        self.assertEqual(data['total'], 2)
+
+    def test_box_filters_permits(self):
+        data = json.loads(self.app.get('/permits/in_bbox?bbox=-122.42,37.77,-122.41,37.78&zoom=17').data)
+        self.assertEqual([p['applicant'] for p in data['permits']], ['Taco Truck'])
+
+    def test_revalidation(self):
+        url = f'/permits/in_bbox?{self.CITY}&zoom=10'
+        etag = self.app.get(url).headers['ETag']
+        self.assertEqual(self.app.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_invalid_requests(self):
+        for query in ('zoom=10', f'{self.CITY}', f'{self.CITY}&zoom=x', 'bbox=1,2,3&zoom=5',
+                      'bbox=-122.36,37.70,-122.52,37.82&zoom=10', f'{self.CITY}&zoom=10&fields=nope'):
+            self.assertEqual(self.app.get(f'/permits/in_bbox?{query}').status_code, 400, query)
+
+
+class TestUpstreamBudgetFallback(TestFlaskApp):
+
+    @patch('app.distance_client.session.get')
+    def test_exhausted_budget_falls_back_to_estimate(self, mock_get):
+        """Test an exhausted budget yields straight-line results flagged as estimates."""
+        with patch('app.upstream_budget', MemoryBudget(per_day=1)):
+            payload = {'latitude': 37.7749, 'longitude': -122.4194, 'statuses': ['APPROVED']}
+            response = self.app.post('/search_nearby', json=payload)
+
+        mock_get.assert_not_called()
+        data = json.loads(response.data)
+        self.assertEqual([d['applicant'] for d in data], ['Taco Truck', 'Pizza Cart'])
+        self.assertEqual({d['distance_source'] for d in data}, {'estimate'})
+        self.assertEqual(len(distance_cache), 0)
+
+    @patch('app.distance_client.sleep')
+    @patch('app.distance_client.session.get')
+    def test_upstream_failure_falls_back_to_estimate(self, mock_get, mock_sleep):
+        """Test OVER_QUERY_LIMIT from Google degrades instead of returning nothing."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"status": "OVER_QUERY_LIMIT"}
+        mock_get.return_value = mock_response
+        payload = {'latitude': 37.7749, 'longitude': -122.4194, 'statuses': ['APPROVED']}
+
+        data = json.loads(self.app.post('/search_nearby', json=payload).data)
+
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0]['distance_source'], 'estimate')
+
+    @patch('app.distance_client.session.get')
+    def test_road_results_are_flagged(self, mock_get):
+        """Test road-distance results say where their distance came from."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "status": "OK",
+            "rows": [{"elements": [{"status": "OK", "distance": {"value": 1500}}]}]
+        }
+        mock_get.return_value = mock_response
+        payload = {'latitude': 37.7749, 'longitude': -122.4194, 'statuses': ['APPROVED']}
+
+        data = json.loads(self.app.post('/search_nearby', json=payload).data)
+
+        self.assertEqual(data[0]['distance_source'], 'road')
+
+    @patch('app.distance_client.session.get')
+    def test_query_larger_than_burst_is_served_in_parts(self, mock_get):
+        """Test a road query needing more than the bucket holds spends it batch by batch and gets there."""
+        for i in range(26):
+            db.session.add(MobileFoodFacilityPermit(
+                locationid=100 + i, applicant=f'Cart {i}', status='APPROVED',
+                latitude=37.70 + i * 0.001, longitude=-122.45
+            ))
+        db.session.commit()
+
+        def respond(url, params, **kwargs):
+            destinations = params['destinations'].split('|')
+            mock_response = Mock()
+            mock_response.status_code = 200
+            mock_response.json.return_value = {"status": "OK", "rows": [{"elements": [
+                {"status": "OK", "distance": {"value": 1000 + j}} for j in range(len(destinations))
+            ]}]}
+            return mock_response
+        mock_get.side_effect = respond
+        clock = [0.0]
+        payload = {'latitude': 37.7749, 'longitude': -122.4194, 'statuses': ['APPROVED']}
+        with patch('app.upstream_budget', MemoryBudget(per_second=1, burst=25, clock=lambda: clock[0])):
+            first = json.loads(self.app.post('/search_nearby', json=payload).data)
+            self.assertEqual(mock_get.call_count, 1)
+            self.assertEqual(len(pair_distance_cache), 25)
+            self.assertEqual({d['distance_source'] for d in first}, {'estimate'})
+            clock[0] += 3
+            second = json.loads(self.app.post('/search_nearby', json=payload).data)
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual({d['distance_source'] for d in second}, {'road'})
+
+    def test_budget_endpoint(self):
+        """Test the remaining budget is reported."""
+        with patch('app.upstream_budget', MemoryBudget(per_day=100)):
+            data = json.loads(self.app.get('/upstream/budget').data)
+        self.assertEqual(data['remaining_today'], 100)
+
+
+class TestSearchNearbyBatch(TestFlaskApp):
+
+    def _mock_matrix(self, mock_get):
+        """Answer any origins x destinations matrix with 1 km per destination position."""
+        def respond(url, params, **kwargs):
+            origins = params['origins'].split('|')
+            destinations = params['destinations'].split('|')
+            mock_response = Mock()
+            mock_response.status_code = 200
+            mock_response.json.return_value = {
+                "status": "OK",
+                "rows": [{"elements": [
+                    {"status": "OK", "distance": {"value": 1000 * (len(destinations) - j)}}
+                    for j in range(len(destinations))
+                ]} for _ in origins]
+            }
+            return mock_response
+        mock_get.side_effect = respond
+
+    def _post(self, payload):
+        response = self.app.post('/search_nearby/batch', json=payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        return [json.loads(line) for line in response.data.decode().splitlines()]
+
+    @patch('app.distance_client.session.get')
+    def test_results_stream_in_input_order(self, mock_get):
+        """Test each origin gets one NDJSON line, in the order it was sent."""
+        self._mock_matrix(mock_get)
+        origins = [
+            {'latitude': 37.7849, 'longitude': -122.4094},
+            {'latitude': 37.7749, 'longitude': -122.4194},
+            {'latitude': 37.7649, 'longitude': -122.4294},
+        ]
+        lines = self._post({'origins': origins, 'statuses': ['APPROVED'], 'k': 1})
+
+        self.assertEqual([line['index'] for line in lines], [0, 1, 2])
+        self.assertEqual(lines[2]['latitude'], 37.7649)
+        self.assertEqual(len(lines[0]['results']), 1)
+        self.assertEqual(lines[0]['results'][0]['applicant'], 'Pizza Cart')
+        self.assertEqual(lines[0]['results'][0]['distance_source'], 'road')
+
+    @patch('app.distance_client.session.get')
+    def test_origins_share_multi_origin_requests(self, mock_get):
+        """Test distinct origins are packed into one request and same-cell origins deduped."""
+        self._mock_matrix(mock_get)
+        origins = [
+            {'latitude': 37.7749, 'longitude': -122.4194},
+            {'latitude': 37.77491, 'longitude': -122.41941},
+            {'latitude': 37.7849, 'longitude': -122.4094},
+        ]
+        lines = self._post({'origins': origins, 'statuses': ['APPROVED']})
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(len(mock_get.call_args.kwargs['params']['origins'].split('|')), 2)
+        self.assertEqual(lines[0]['results'], lines[1]['results'])
+
+    @patch('app.MATRIX_MAX_ELEMENTS', 2)
+    @patch('app.distance_client.session.get')
+    def test_requests_respect_element_limit(self, mock_get):
+        """Test origins are split so no request exceeds the element cap."""
+        self._mock_matrix(mock_get)
+        origins = [
+            {'latitude': 37.7749, 'longitude': -122.4194},
+            {'latitude': 37.7849, 'longitude': -122.4094},
+        ]
+        self._post({'origins': origins, 'statuses': ['APPROVED']})
+
+        self.assertEqual(mock_get.call_count, 2)
+        for call in mock_get.call_args_list:
+            params = call.kwargs['params']
+            self.assertEqual(len(params['origins'].split('|')) * len(params['destinations'].split('|')), 2)
+
+    @patch('app.distance_client.session.get')
+    def test_cached_pairs_are_reused(self, mock_get):
+        """Test a repeated batch is answered without upstream calls."""
+        self._mock_matrix(mock_get)
+        payload = {'origins': [{'latitude': 37.7749, 'longitude': -122.4194}], 'k': 2}
+        first = self._post(payload)
+        second = self._post(payload)
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(first, second)
+
+    @patch('app.distance_client.session.get')
+    def test_exhausted_budget_falls_back_to_estimate(self, mock_get):
+        """Test origins that can't be routed get straight-line estimates."""
+        with patch('app.upstream_budget', MemoryBudget(per_day=1)):
+            lines = self._post({'origins': [{'latitude': 37.7749, 'longitude': -122.4194}]})
+
+        mock_get.assert_not_called()
+        self.assertEqual(lines[0]['results'][0]['applicant'], 'Taco Truck')
+        self.assertEqual(lines[0]['results'][0]['distance_source'], 'estimate')
+
+    def test_invalid_requests(self):
+        """Test malformed batches are rejected before any work is done."""
+        bad = [
+            {'origins': []},
+            {'origins': [{'latitude': 37.7749}]},
+            {'origins': [{'latitude': 37.7749, 'longitude': -122.4194}], 'k': 0},
+            {'origins': [{'latitude': 37.7749, 'longitude': -122.4194}], 'k': True},
+            {'origins': [{'latitude': 37.7749, 'longitude': -122.4194}], 'statuses': 'APPROVED'},
+            {'origins': [{'latitude': 37.7749, 'longitude': -122.4194}, {'latitude': 'abc', 'longitude': [1]}]},
+            {'origins': [{'latitude': 37.7749, 'longitude': -122.4194}, {'latitude': 100, 'longitude': 0}]},
+            {'origins': ['37.7749,-122.4194']},
+        ]
+        for payload in bad:
+            response = self.app.post('/search_nearby/batch', json=payload)
+            self.assertEqual(response.status_code, 400, payload)
+        response = self.app.post('/search_nearby/batch', json=bad[5])
+        self.assertEqual(json.loads(response.data)['error'],
+                         'origins[1]: latitude and longitude must be numbers within -90..90 and -180..180')
+
+
+class TestConditionalGet(TestFlaskApp):
+
+    def _mock_distances(self, mock_get):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "status": "OK",
+            "rows": [{"elements": [{"status": "OK", "distance": {"value": m}} for m in (2000, 1000)]}]
+        }
+        mock_get.return_value = mock_response
+
+    def test_search_applicant_get_matches_post(self):
+        """Test the GET form returns the POST answer with validators."""
+        post = self.app.post('/search_applicant', json={'applicant': 'a', 'statuses': ['APPROVED', 'EXPIRED']})
+        get = self.app.get('/search_applicant?applicant=a&statuses=EXPIRED,approved')
+
+        self.assertEqual(get.status_code, 200)
+        self.assertEqual(json.loads(get.data), json.loads(post.data))
+        self.assertTrue(get.headers['ETag'])
+        self.assertEqual(get.headers['Cache-Control'], 'public, max-age=900')
+
+    def test_statuses_are_canonicalised(self):
+        """Test status order, case and repetition don't change the ETag."""
+        first = self.app.get('/search_applicant?applicant=a&statuses=EXPIRED,approved')
+        second = self.app.get('/search_applicant?statuses=APPROVED&statuses=expired&applicant=a')
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertIn('statuses=APPROVED%2CEXPIRED', first.headers['Content-Location'])
+
+    def test_if_none_match_skips_the_database(self):
+        """Test a matching If-None-Match gets a 304 without running the search."""
+        first = self.app.get('/search_applicant?applicant=Taco&engine=sql')
+        with patch('app.search_statement', side_effect=AssertionError('searched')):
+            response = self.app.get('/search_applicant?applicant=Taco&engine=sql',
+                                    headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(response.data, b'')
+
+    def test_etag_follows_dataset_version(self):
+        """Test a data change invalidates the ETag."""
+        first = self.app.get('/search_applicant?applicant=Taco')
+        db.session.add(MobileFoodFacilityPermit(locationid=5, applicant='Taco Two', status='APPROVED'))
+        db.session.commit()
+        snapshot_store.reload()
+
+        response = self.app.get('/search_applicant?applicant=Taco', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(len(json.loads(response.data)), 2)
+
+    def test_sql_etag_follows_dataset_version(self):
+        """Test engine=sql ETags come from dataset_version, reused briefly, and never load the snapshot."""
+        url = '/search_applicant?applicant=Taco&engine=sql'
+        with patch.object(snapshot_store, 'get', side_effect=AssertionError('snapshot loaded')):
+            first = self.app.get(url)
+            self.assertEqual(first.status_code, 200)
+            db.session.add(DatasetVersion(source='test'))
+            db.session.commit()
+            cached = self.app.get(url, headers={'If-None-Match': first.headers['ETag']})
+            self.assertEqual(cached.status_code, 304)
+            dataset_version_cache.clear()
+            response = self.app.get(url, headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], first.headers['ETag'])
+
+    def test_sql_etag_without_dataset_version_table(self):
+        """Test a database loaded without migration 0006 still answers, validated by the snapshot."""
+        db.session.execute(db.text('DROP TABLE dataset_version'))
+        db.session.commit()
+        url = '/search_applicant?applicant=Taco&engine=sql'
+        first = self.app.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(len(json.loads(first.data)), 1)
+        dataset_version_cache.clear()
+        self.assertEqual(self.app.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code, 304)
+
+    @patch('app.distance_client.session.get')
+    def test_search_nearby_get_revalidates_without_upstream(self, mock_get):
+        """Test nearby GETs in one cell share an ETag and revalidate for free."""
+        self._mock_distances(mock_get)
+        first = self.app.get('/search_nearby?latitude=37.7749&longitude=-122.4194')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(json.loads(first.data)[0]['applicant'], 'Pizza Cart')
+
+        distance_cache.clear()
+        response = self.app.get('/search_nearby?latitude=37.77491&longitude=-122.41941',
+                                headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(mock_get.call_count, 1)
+
+    def test_search_nearby_get_straight_line_from_cell_centre(self):
+        """Test GET answers are computed for the cell centre, so any point in the cell gets the same body."""
+        first = self.app.get('/search_nearby?latitude=37.7749&longitude=-122.4194&mode=straight_line')
+        second = self.app.get('/search_nearby?latitude=37.77491&longitude=-122.41941&mode=straight_line')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+
+    @patch('app.distance_client.session.get')
+    def test_estimates_are_not_cacheable(self, mock_get):
+        """Test straight-line fallbacks are served without a validator."""
+        with patch('app.upstream_budget', MemoryBudget(per_day=1)):
+            response = self.app.get('/search_nearby?latitude=37.7749&longitude=-122.4194')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+
+    def test_invalid_get_parameters(self):
+        """Test malformed query parameters get the usual 400s."""
+        for url in ('/search_nearby?latitude=abc&longitude=-122.4', '/search_nearby?latitude=37.7',
+                    '/search_applicant?page_size=ten', '/search_applicant?fields=nope'):
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertNotIn('ETag', response.headers)
+
+
+class TestRoadGridServing(TestFlaskApp):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, 'grid.bin')
+        permits = snapshot_store.get().with_status({'APPROVED'})
+
+        def fetch(centres, chunk):
+            return [(c, p, round(haversine_km(c[0], c[1], p.latitude, p.longitude), 2)) for c in centres for p in chunk]
+
+        build(path, permits, fetch, bounds=(37.772, 37.777, -122.422, -122.416), k=5, log=lambda message: None)
+        self.store = RoadGridStore(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super().tearDown()
+
+    @patch('app.distance_client.session.get')
+    def test_default_search_answered_from_grid(self, mock_get):
+        """Test APPROVED road searches inside the grid make no upstream calls."""
+        with patch('app.road_grid', self.store):
+            response = self.app.post('/search_nearby', json={'latitude': 37.7749, 'longitude': -122.4194})
+        data = json.loads(response.data)
+        self.assertEqual([r['applicant'] for r in data], ['Taco Truck', 'Pizza Cart'])
+        self.assertEqual(data[0]['distance_source'], 'road')
+        centre = quantize(37.7749, -122.4194, 100)
+        self.assertEqual(data[0]['distance_km'], round(haversine_km(centre[0], centre[1], 37.7749, -122.4194), 2))
+        mock_get.assert_not_called()
+        self.assertEqual(self.store.hits, 1)
+
+    @patch('app.distance_client.session.get')
+    def test_falls_back_outside_grid_or_for_other_statuses(self, mock_get):
+        """Test other status sets and points outside the grid are computed live."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "status": "OK",
+            "rows": [{"elements": [{"status": "OK", "distance": {"value": 1000}}] * 3}]
+        }
+        mock_get.return_value = mock_response
+        with patch('app.road_grid', self.store):
+            self.app.post('/search_nearby', json={'latitude': 37.7749, 'longitude': -122.4194,
+                                                  'statuses': ['APPROVED', 'EXPIRED']})
+            self.app.post('/search_nearby', json={'latitude': 37.79, 'longitude': -122.40})
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(self.store.misses, 2)
+
+    @patch('app.distance_client.session.get')
+    def test_stale_grid_is_not_served(self, mock_get):
+        """Test a grid built for other permits is ignored."""
+        mock_get.return_value = Mock(status_code=200, json=Mock(return_value={"status": "OK", "rows": []}))
+        permit = db.session.get(MobileFoodFacilityPermit, 2)
+        permit.latitude = 37.7750
+        db.session.commit()
+        snapshot_store.reload()
+        with patch('app.road_grid', self.store):
+            self.app.post('/search_nearby', json={'latitude': 37.7749, 'longitude': -122.4194})
+        self.assertEqual(mock_get.call_count, 1)
+
+
+class TestMetricsEndpoint(TestFlaskApp):
+
+    def _metrics(self):
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        return response.data.decode()
+
+    def _value(self, text, series):
+        for line in text.splitlines():
+            if line.startswith(series + ' '):
+                return float(line.split()[-1])
+        return 0.0
+
+    def test_request_latency_by_route(self):
+        """Test requests are timed under their route template."""
+        series = 'http_request_duration_seconds_count{route="/search_applicant",method="POST",status="200"}'
+        before = self._value(self._metrics(), series)
+        self.app.post('/search_applicant', json={'applicant': 'Taco', 'engine': 'sql'})
+        text = self._metrics()
+        self.assertEqual(self._value(text, series), before + 1)
+        self.assertIn('stage_duration_seconds_count{stage="db_query"}', text)
+        self.assertIn('stage_duration_seconds_count{stage="serialize"}', text)
+
+    @patch('app.distance_client.session.get')
+    def test_upstream_and_cache_counters(self, mock_get):
+        """Test upstream calls, elements and cache misses are counted."""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "status": "OK",
+            "rows": [{"elements": [{"status": "OK", "distance": {"value": 1000}}] * 2}]
+        }
+        mock_get.return_value = mock_response
+        before = self._metrics()
+
+        self.app.post('/search_nearby', json={'latitude': 37.7749, 'longitude': -122.4194})
+        after = self._metrics()
+
+        self.assertEqual(self._value(after, 'upstream_requests_total') - self._value(before, 'upstream_requests_total'), 1)
+        self.assertEqual(self._value(after, 'upstream_elements_total') - self._value(before, 'upstream_elements_total'), 2)
+        misses = 'cache_misses_total{cache="nearby"}'
+        self.assertEqual(self._value(after, misses) - self._value(before, misses), 1)
+        self.assertIn('stage_duration_seconds_count{stage="upstream_batch"}', after)
+        self.assertIn('stage_duration_seconds_count{stage="cache_lookup"}', after)
+        self.assertIn('http_requests_in_flight 1', after)  # the scrape itself
+
+    @patch('app.distance_client.sleep')
+    @patch('app.distance_client.session.get')
+    def test_upstream_failures_counted(self, mock_get, mock_sleep):
+        """Test a failed Distance Matrix request is counted."""
+        mock_get.return_value = Mock(status_code=500)
+        before = self._value(self._metrics(), 'upstream_failures_total')
+        self.app.post('/search_nearby', json={'latitude': 37.7749, 'longitude': -122.4194})
+        self.assertEqual(self._value(self._metrics(), 'upstream_failures_total'), before + 1)
+
+
 class TestUtilityFunctions(unittest.TestCase):
     
     def test_chunk_list(self):
@@ -342,7 +1358,7 @@ class TestGetDistanceBatch(unittest.TestCase):
                  latitude=37.7849, longitude=-122.4094, zipcodes="94103")
         ]
     
-    @patch('app.requests.get')
+    @patch('app.distance_client.session.get')
     def test_get_distance_batch_success(self, mock_get):
         """Test successful distance batch calculation."""
         mock_response = Mock()
@@ -367,8 +1383,9 @@ class TestGetDistanceBatch(unittest.TestCase):
         self.assertEqual(result[1]['applicant'], 'Test 2')
         self.assertEqual(result[1]['distance_km'], 2.5)
     
-    @patch('app.requests.get')
-    def test_get_distance_batch_api_error(self, mock_get):
+    @patch('app.distance_client.sleep')
+    @patch('app.distance_client.session.get')
+    def test_get_distance_batch_api_error(self, mock_get, mock_sleep):
         """Test distance batch with API error."""
         mock_response = Mock()
         mock_response.status_code = 500
@@ -379,7 +1396,7 @@ class TestGetDistanceBatch(unittest.TestCase):
         
         self.assertEqual(result, [])
     
-    @patch('app.requests.get')
+    @patch('app.distance_client.session.get')
     def test_get_distance_batch_invalid_response(self, mock_get):
         """Test distance batch with invalid API response."""
         mock_response = Mock()
@@ -392,7 +1409,7 @@ class TestGetDistanceBatch(unittest.TestCase):
         
         self.assertEqual(result, [])
     
-    @patch('app.requests.get')
+    @patch('app.distance_client.session.get')
     def test_get_distance_batch_partial_success(self, mock_get):
         """Test distance batch with some failed elements."""
         mock_response = Mock()
@@ -453,32 +1470,41 @@ class TestCaching(unittest.TestCase):
         test_data = [{"test": "data"}]
         
         # Store in cache
-        distance_cache[cache_key] = {
-            'timestamp': time(),
-            'data': test_data
-        }
+        distance_cache.set(cache_key, test_data)
         
         # Retrieve from cache
         cached = distance_cache.get(cache_key)
         self.assertIsNotNone(cached)
-        self.assertEqual(cached['data'], test_data)
+        self.assertEqual(cached, test_data)
     
     def test_cache_expiration(self):
-        """Test that cache respects TTL."""
+        """Test that cache respects TTL and drops expired entries."""
         from app import CACHE_TTL
         
         cache_key = "test_key"
         test_data = [{"test": "data"}]
         
-        # Store with old timestamp (expired)
-        distance_cache[cache_key] = {
-            'timestamp': time() - CACHE_TTL - 1,
-            'data': test_data
-        }
+        distance_cache.set(cache_key, test_data)
         
-        # Should be considered expired
-        cached = distance_cache.get(cache_key)
-        self.assertTrue(time() - cached['timestamp'] >= CACHE_TTL)
+        # Should be considered expired and removed
+        with patch.object(distance_cache, 'clock', return_value=time() + CACHE_TTL + 1):
+            self.assertIsNone(distance_cache.get(cache_key))
+        self.assertEqual(len(distance_cache), 0)
+
+    def test_nearby_cache_key_shared_within_grid_cell(self):
+        """Test that callers a metre apart share a cache key."""
+        statuses = {'APPROVED'}
+        key1 = make_cache_key(37.774901, -122.419401, statuses)
+        key2 = make_cache_key(37.774905, -122.419405, statuses)
+        self.assertEqual(key1, key2)
+
+    def test_cache_stats_endpoint(self):
+        """Test the cache stats endpoint reports counters."""
+        distance_cache.get("missing")
+        response = app.test_client().get('/cache/stats')
+        data = json.loads(response.data)
+        self.assertGreaterEqual(data['nearby']['misses'], 1)
+        self.assertIn('evictions', data['nearby'])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+from time import perf_counter
+from unittest.mock import patch
+
+import httpx
+
+# Add the parent directory to sys.path to import the modules under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import asgi
+from app import app, db, MobileFoodFacilityPermit, distance_cache, pair_distance_cache, snapshot_store
+from distance_matrix_stub import DistanceMatrixStub
+from upstream_budget import MemoryBudget
+
+PERMITS = [
+    (1, 'Taco Truck', 'APPROVED', '123 Main St', 37.7749, -122.4194, '94102'),
+    (2, 'Pizza Cart', 'APPROVED', '456 Oak Ave', 37.7849, -122.4094, '94103'),
+    (3, 'Burrito Express', 'EXPIRED', '789 Pine St', 37.7949, -122.3994, '94104'),
+]
+
+
+class TestAsgiApp(unittest.TestCase):
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        for locationid, applicant, status, address, lat, lon, zipcodes in PERMITS:
+            db.session.add(MobileFoodFacilityPermit(
+                locationid=locationid, applicant=applicant, status=status, address=address,
+                latitude=lat, longitude=lon, zipcodes=zipcodes
+            ))
+        db.session.commit()
+        distance_cache.clear()
+        pair_distance_cache.clear()
+        snapshot_store.invalidate()
+
+        self.stub = DistanceMatrixStub(latency=0.2).start()
+        self.url = patch.object(asgi.async_client, 'url', self.stub.url)
+        self.url.start()
+        self.sync_url = patch.object(asgi.distance_client, 'url', self.stub.url)
+        self.sync_url.start()
+
+    def tearDown(self):
+        self.url.stop()
+        self.sync_url.stop()
+        self.stub.stop()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        distance_cache.clear()
+        pair_distance_cache.clear()
+        snapshot_store.invalidate()
+
+    def run_requests(self, *requests):
+        """Send (method, url, kwargs) requests concurrently through the ASGI app."""
+        async def go():
+            transport = httpx.ASGITransport(app=asgi.app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                responses = await asyncio.gather(*(client.request(m, u, **kw) for m, u, kw in requests))
+            await asgi.async_client.aclose()
+            return responses
+        return asyncio.run(go())
+
+    def test_matches_sync_response(self):
+        """Test the async path returns what the Flask view returns."""
+        body = {'latitude': 37.7749, 'longitude': -122.4194}
+        response, = self.run_requests(('POST', '/search_nearby', {'json': body}))
+        distance_cache.clear()
+        pair_distance_cache.clear()
+        expected = app.test_client().post('/search_nearby', json=body)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), json.loads(expected.data))
+        self.assertEqual(response.json()[0]['applicant'], 'Taco Truck')
+        self.assertEqual(response.json()[0]['distance_source'], 'road')
+
+    def test_cold_searches_overlap(self):
+        """Test concurrent cold searches wait on the upstream together, not one after another."""
+        requests = [
+            ('POST', '/search_nearby', {'json': {'latitude': 37.70 + i * 0.01, 'longitude': -122.45}})
+            for i in range(8)
+        ]
+        started = perf_counter()
+        responses = self.run_requests(*requests)
+        elapsed = perf_counter() - started
+
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        self.assertEqual(self.stub.requests, 8)
+        # Sequentially that's 8 x 200 ms
+        self.assertLess(elapsed, 8 * self.stub.latency / 2)
+
+    def test_same_cell_is_coalesced(self):
+        """Test concurrent misses for one cell share a single fan-out."""
+        body = {'json': {'latitude': 37.7749, 'longitude': -122.4194}}
+        responses = self.run_requests(*[('POST', '/search_nearby', body)] * 5)
+        self.assertEqual(len({r.content for r in responses}), 1)
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_budget_exhausted_falls_back_to_estimates(self):
+        with patch('app.upstream_budget', MemoryBudget(per_day=1)):
+            response, = self.run_requests(
+                ('GET', '/search_nearby?latitude=37.7749&longitude=-122.4194', {})
+            )
+        self.assertEqual(response.json()[0]['distance_source'], 'estimate')
+        self.assertEqual(response.headers['cache-control'], 'no-cache')
+        self.assertEqual(self.stub.requests, 0)
+
+    def test_get_revalidation(self):
+        """Test GET carries the same validators as the Flask view and answers 304s."""
+        url = '/search_nearby?latitude=37.7749&longitude=-122.4194&fields=applicant'
+        first, = self.run_requests(('GET', url, {}))
+        expected = app.test_client().get(url)
+        self.assertEqual(first.headers['etag'], expected.headers['ETag'])
+        self.assertEqual(first.headers['content-location'], expected.headers['Content-Location'])
+        self.assertEqual(first.json(), json.loads(expected.data))
+
+        second, = self.run_requests(('GET', url, {'headers': {'If-None-Match': first.headers['etag']}}))
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+
+    def test_open_now_revalidates(self):
+        """Test open_now GETs keep their validators but are marked no-cache, as in the Flask view."""
+        url = '/search_nearby?latitude=37.7749&longitude=-122.4194&mode=straight_line&open_now=true'
+        response, = self.run_requests(('GET', url, {}))
+        expected = app.test_client().get(url)
+        self.assertEqual(response.headers['cache-control'], 'no-cache')
+        self.assertEqual(response.headers['etag'], expected.headers['ETag'])
+        self.assertEqual(response.headers['content-location'], expected.headers['Content-Location'])
+
+    def test_invalid_requests(self):
+        responses = self.run_requests(
+            ('POST', '/search_nearby', {'json': {'latitude': 37.7}}),
+            ('POST', '/search_nearby', {'content': b'not json'}),
+            ('POST', '/search_nearby', {'json': {'latitude': 37.7, 'longitude': -122.4, 'mode': 'fly'}}),
+            ('GET', '/search_nearby?latitude=abc&longitude=-122.4', {}),
+            ('POST', '/search_nearby', {'json': {'latitude': 'abc', 'longitude': [1]}}),
+        )
+        self.assertEqual([r.status_code for r in responses], [400] * 5)
+        self.assertEqual(responses[0].json(), {'error': 'Latitude and longitude are required'})
+
+    def test_other_routes_are_served_by_flask(self):
+        """Test /search_applicant and CORS behave exactly as under the WSGI server."""
+        body = {'applicant': 'a', 'statuses': ['APPROVED', 'EXPIRED']}
+        headers = {'Origin': 'http://frontend.test'}
+        applicant, nearby = self.run_requests(
+            ('POST', '/search_applicant', {'json': body, 'headers': headers}),
+            ('POST', '/search_nearby', {'json': {'latitude': 37.7749, 'longitude': -122.4194,
+                                                 'mode': 'straight_line'}, 'headers': headers}),
+        )
+        expected = app.test_client().post('/search_applicant', json=body)
+        self.assertEqual(applicant.json(), json.loads(expected.data))
+        self.assertEqual(applicant.headers['access-control-allow-origin'], 'http://frontend.test')
+        self.assertEqual(nearby.headers['access-control-allow-origin'], 'http://frontend.test')
+
+
+if __name__ == '__main__':
+    unittest.main()
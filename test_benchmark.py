@@ -0,0 +1,124 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import benchmark
+from benchmark import SF_BOUNDS, compare, percentiles, synthetic_rows
+
+
+class TestSyntheticRows(unittest.TestCase):
+
+    def test_deterministic_and_inside_sf(self):
+        """Test the same seed gives the same rows, all inside the bounding box."""
+        rows = list(synthetic_rows(500, seed=1))
+        self.assertEqual(rows, list(synthetic_rows(500, seed=1)))
+        self.assertEqual([r['locationid'] for r in rows], list(range(1, 501)))
+        min_lat, max_lat, min_lon, max_lon = SF_BOUNDS
+        for row in rows:
+            if row['latitude'] is not None:
+                self.assertTrue(min_lat <= row['latitude'] <= max_lat)
+                self.assertTrue(min_lon <= row['longitude'] <= max_lon)
+
+
+class TestReport(unittest.TestCase):
+
+    def tearDown(self):
+        # run() loads synthetic permits into the app's database; leave it empty
+        import app
+        with app.app.app_context():
+            app.db.drop_all()
+        app.snapshot_store.invalidate()
+
+    def test_percentiles(self):
+        """Test nearest-rank percentiles in milliseconds."""
+        stats = percentiles([i / 1000.0 for i in range(1, 101)])
+        self.assertEqual((stats['p50'], stats['p95'], stats['p99'], stats['max']), (50.0, 95.0, 99.0, 100.0))
+        self.assertEqual(percentiles([]), {})
+
+    def test_compare(self):
+        """Test comparing two reports shows the change per scenario."""
+        before = {'scenarios': {'a': {'latency_ms': {'p50': 10.0, 'p95': 20.0, 'p99': 40.0}, 'throughput_rps': 100}}}
+        after = {'scenarios': {'a': {'latency_ms': {'p50': 5.0, 'p95': 20.0, 'p99': 40.0}, 'throughput_rps': 200},
+                               'b': {'skipped': 'too many rows'}}}
+        lines = compare(before, after)
+        self.assertEqual(len(lines), 1)
+        self.assertIn('p50 10.0->5.0ms (-50%)', lines[0])
+
+    def test_small_run(self):
+        """Test an end-to-end run against the stub produces a complete report."""
+        report = benchmark.run(rows=60, requests=4, scenarios=(
+            'search_applicant_index', 'search_nearby_road', 'search_nearby_batch', 'snapshot_build'
+        ), batch_size=2, road_max_rows=100)
+
+        self.assertEqual(report['meta']['rows'], 60)
+        road = report['scenarios']['search_nearby_road']
+        self.assertEqual((road['requests'], road['errors']), (4, 0))
+        self.assertGreater(road['upstream_elements'], 0)
+        self.assertIn('p99', road['latency_ms'])
+        self.assertEqual(report['scenarios']['search_nearby_batch']['requests'], 2)
+        self.assertGreater(report['meta']['peak_rss_mb'], 0)
+
+    def test_road_skipped_above_limit(self):
+        """Test road scenarios are skipped instead of fanning out over huge tables."""
+        report = benchmark.run(rows=60, requests=1, scenarios=('search_nearby_road',), road_max_rows=10)
+        self.assertIn('skipped', report['scenarios']['search_nearby_road'])
+
+
+class TestLoadTest(unittest.TestCase):
+
+    def test_sync_and_async_deployments(self):
+        """Test both deployments start on a file database and answer the same searches."""
+        from sqlalchemy import create_engine
+        from app import MobileFoodFacilityPermit
+        from distance_matrix_stub import DistanceMatrixStub
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            url = f"sqlite:///{os.path.join(tmpdir, 'load.sqlite3')}"
+            engine = create_engine(url)
+            MobileFoodFacilityPermit.__table__.create(engine)
+            with engine.begin() as conn:
+                conn.execute(MobileFoodFacilityPermit.__table__.insert(), list(synthetic_rows(60)))
+            engine.dispose()
+
+            with DistanceMatrixStub() as stub:
+                results = benchmark.load_test(url, stub, requests=4, concurrency=2)
+
+        for name in ('sync', 'async'):
+            self.assertEqual((results[name]['requests'], results[name]['errors']), (4, 0))
+            self.assertGreater(results[name]['upstream_elements'], 0)
+        self.assertIn('async_speedup', results)
+
+
+class TestStartupTest(unittest.TestCase):
+
+    def test_lazy_and_preload(self):
+        """Test both gunicorn modes warm every worker and report per-worker memory."""
+        from sqlalchemy import create_engine
+        from app import MobileFoodFacilityPermit
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            url = f"sqlite:///{os.path.join(tmpdir, 'startup.sqlite3')}"
+            engine = create_engine(url)
+            MobileFoodFacilityPermit.__table__.create(engine)
+            with engine.begin() as conn:
+                conn.execute(MobileFoodFacilityPermit.__table__.insert(), list(synthetic_rows(60)))
+            engine.dispose()
+
+            results = benchmark.startup_test(url, requests=4, workers=2)
+
+        for name in ('lazy', 'preload'):
+            self.assertEqual((results[name]['requests'], results[name]['errors']), (4, 0))
+            self.assertEqual(results[name]['workers'], 2)
+            self.assertGreater(results[name]['ready_seconds'], 0)
+            memory = results[name]['worker_memory_mb']
+            self.assertTrue(0 < memory['uss'] <= memory['pss'] <= memory['rss'])
+        # Warming once instead of once per worker
+        self.assertLess(results['preload']['startup_cpu_seconds'], results['lazy']['startup_cpu_seconds'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,162 @@
+import unittest
+import tempfile
+import sys
+import os
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cache import SQLiteCache, TTLCache, make_cache, quantize
+from fake_clock import FakeClock
+
+
+class TestQuantize(unittest.TestCase):
+
+    def test_nearby_points_share_cell(self):
+        """Test points a metre apart snap to the same cell."""
+        self.assertEqual(quantize(37.774900, -122.419400), quantize(37.774909, -122.419409))
+
+    def test_distant_points_differ(self):
+        """Test points further apart than the grid land in different cells."""
+        self.assertNotEqual(quantize(37.7749, -122.4194), quantize(37.7759, -122.4194))
+
+    def test_snapped_point_is_close(self):
+        """Test the snapped point stays within the grid cell size."""
+        lat, lon = quantize(37.7749, -122.4194, grid_m=50)
+        self.assertLess(abs(lat - 37.7749), 50 / 111195.0)
+        self.assertLess(abs(lon + 122.4194), 0.001)
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(max_entries=3, ttl=10, sweep_interval=5, clock=self.clock)
+
+    def test_hit_and_miss_counters(self):
+        """Test hits and misses are counted."""
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted first."""
+        for key in 'abc':
+            self.cache.set(key, key)
+        self.cache.get('a')
+        self.cache.set('d', 'd')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 'a')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(len(self.cache), 3)
+
+    def test_expired_entries_are_removed(self):
+        """Test expired entries are dropped on access."""
+        self.cache.set('a', 1)
+        self.clock.now += 11
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def test_sweep_purges_untouched_entries(self):
+        """Test the periodic sweep removes expired keys nobody asks for again."""
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.clock.now += 11
+        self.cache.set('c', 3)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_byte_budget(self):
+        """Test entries are evicted once the byte budget is exceeded."""
+        cache = TTLCache(max_entries=100, ttl=10, max_bytes=30, clock=self.clock)
+        cache.set('a', 'x' * 10)
+        cache.set('b', 'y' * 10)
+        cache.set('c', 'z' * 10)
+        self.assertIsNone(cache.get('a'))
+        self.assertLessEqual(cache.stats()['bytes'], 30)
+
+    def test_overwrite_refreshes_entry(self):
+        """Test setting an existing key replaces it without growing the cache."""
+        self.cache.set('a', 1)
+        self.cache.set('a', 2)
+        self.assertEqual(self.cache.get('a'), 2)
+        self.assertEqual(len(self.cache), 1)
+
+
+class TestSQLiteCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache.sqlite3')
+        self.clock = FakeClock()
+        self.cache = SQLiteCache(self.path, max_entries=3, ttl=10, sweep_interval=5,
+                                 touch_interval=0, clock=self.clock)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        """Test values survive a JSON round trip through the file."""
+        value = [{'applicant': 'Taco Truck', 'distance_km': 1.5}]
+        self.cache.set('a', value)
+        self.assertEqual(self.cache.get('a'), value)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_shared_between_instances(self):
+        """Test a second handle on the same file (another worker) sees the entry."""
+        self.cache.set('a', [1, 2])
+        other = SQLiteCache(self.path, max_entries=3, ttl=10, clock=self.clock)
+        self.assertEqual(other.get('a'), [1, 2])
+
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted first."""
+        for key in 'abc':
+            self.cache.set(key, key)
+            self.clock.now += 1
+        self.cache.get('a')
+        self.clock.now += 1
+        self.cache.set('d', 'd')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 'a')
+        self.assertEqual(len(self.cache), 3)
+
+    def test_expired_entries_are_removed(self):
+        """Test expired entries are dropped on access and by the sweep."""
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.clock.now += 11
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_byte_budget(self):
+        """Test entries are evicted once the byte budget is exceeded."""
+        cache = SQLiteCache(self.path, max_entries=100, ttl=10, max_bytes=30,
+                            touch_interval=0, clock=self.clock)
+        for key in 'abc':
+            cache.set(key, 'x' * 10)
+            self.clock.now += 1
+        self.assertIsNone(cache.get('a'))
+        self.assertLessEqual(cache.stats()['bytes'], 30)
+
+    def test_tuple_keys(self):
+        """Test non-string keys are accepted."""
+        self.cache.set((37.77, -122.41), 5)
+        self.assertEqual(self.cache.get((37.77, -122.41)), 5)
+
+
+class TestMakeCache(unittest.TestCase):
+
+    def test_memory_backend(self):
+        """Test the default backend is the in-process cache."""
+        self.assertIsInstance(make_cache(), TTLCache)
+
+    def test_unknown_backend(self):
+        """Test an unknown backend name is rejected."""
+        with self.assertRaises(ValueError):
+            make_cache('redis')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,86 @@
+import os
+import random
+import sys
+import unittest
+from math import floor
+
+import numpy as np
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from clusters import MAX_LEVEL, ClusterIndex, cell_deg
+
+STATUSES = ('APPROVED', 'EXPIRED', 'REQUESTED')
+SF = (37.70, -122.51, 37.81, -122.37)  # south, west, north, east
+
+
+class TestClusterIndex(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(3)
+        n = 3000
+        self.lats = np.array([rng.uniform(SF[0], SF[2]) for _ in range(n)])
+        self.lons = np.array([rng.uniform(SF[1], SF[3]) for _ in range(n)])
+        self.lats[:50] = np.nan  # no location
+        self.codes = np.array([rng.randrange(-1, 3) for _ in range(n)], dtype=np.int16)
+        self.index = ClusterIndex(self.lats, self.lons, self.codes, len(STATUSES))
+        self.wanted = np.array([True, False, True])
+
+    def located(self):
+        return [
+            i for i in range(len(self.lats))
+            if not np.isnan(self.lats[i]) and self.codes[i] >= 0 and self.wanted[self.codes[i]]
+        ]
+
+    def test_clusters_match_brute_force(self):
+        """Test each cluster's count and centroid equal a direct bucketing of the permits."""
+        zoom = 11
+        box = (37.74, -122.45, 37.79, -122.40)
+        cell = cell_deg(zoom)
+        expected = {}
+        for i in self.located():
+            row, col = floor((self.lats[i] + 90) / cell), floor((self.lons[i] + 180) / cell)
+            r0, c0 = floor((box[0] + 90) / cell), floor((box[1] + 180) / cell)
+            r1, c1 = floor((box[2] + 90) / cell), floor((box[3] + 180) / cell)
+            if r0 <= row <= r1 and c0 <= col <= c1:
+                expected.setdefault((row, col), []).append(i)
+        clusters = self.index.clusters(zoom, *box, self.wanted)
+        self.assertEqual(len(clusters), len(expected))
+        for (count, lat, lon), (_, members) in zip(clusters, sorted(expected.items())):
+            self.assertEqual(count, len(members))
+            self.assertAlmostEqual(lat, np.mean(self.lats[members]))
+            self.assertAlmostEqual(lon, np.mean(self.lons[members]))
+        self.assertEqual(self.index.count(zoom, *box, self.wanted), sum(c for c, _, _ in clusters))
+
+    def test_within_is_exact(self):
+        """Test permits are those strictly inside the box, whatever level they're read from."""
+        box = (37.75, -122.43, 37.76, -122.41)
+        expected = [
+            i for i in self.located()
+            if box[0] <= self.lats[i] <= box[2] and box[1] <= self.lons[i] <= box[3]
+        ]
+        for zoom in (8, 12, MAX_LEVEL):
+            self.assertEqual(self.index.within(zoom, *box, self.wanted).tolist(), expected)
+
+    def test_level_bounds_cells_across(self):
+        """Test a huge viewport is coarsened so it covers a bounded number of cells."""
+        self.assertEqual(self.index.level_for(14, 37.77, -122.42, 37.78, -122.41, 32), 14)
+        level = self.index.level_for(14, -60, -170, 70, 170, 32)
+        self.assertLessEqual(340 / cell_deg(level), 31)
+        self.assertLessEqual(len(self.index.clusters(level, -60, -170, 70, 170, self.wanted)), 32 * 32)
+        self.assertEqual(self.index.level_for(40, 37.77, -122.42, 37.771, -122.419, 32), MAX_LEVEL)
+
+    def test_total_is_the_same_at_every_level(self):
+        """Test the whole city adds up to every wanted, located permit at every zoom."""
+        for zoom in range(MAX_LEVEL + 1):
+            self.assertEqual(self.index.count(zoom, *SF, self.wanted), len(self.located()))
+
+    def test_empty(self):
+        index = ClusterIndex(np.empty(0), np.empty(0), np.empty(0, dtype=np.int16), 0)
+        self.assertEqual(index.clusters(5, *SF, np.empty(0, dtype=bool)), [])
+        self.assertEqual(index.within(15, *SF, np.empty(0, dtype=bool)).tolist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,162 @@
+import unittest
+from unittest.mock import Mock, patch
+import os
+import sys
+
+import asyncio
+
+import httpx
+import requests
+
+# Add the parent directory to sys.path to import the modules under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from distance_client import AsyncDistanceMatrixClient, DistanceMatrixClient
+from distance_matrix_stub import DistanceMatrixStub
+
+
+def mock_response(status_code=200, body=None):
+    response = Mock()
+    response.status_code = status_code
+    response.json.return_value = body if body is not None else {'status': 'OK', 'rows': []}
+    return response
+
+
+class TestDistanceMatrixClient(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.client = DistanceMatrixClient('key', url='http://upstream.test/json',
+                                           max_retries=2, sleep=self.sleeps.append)
+
+    def test_timeout_is_passed(self):
+        """Test every call carries a connect and read timeout."""
+        with patch.object(self.client.session, 'get', return_value=mock_response()) as get:
+            self.client.matrix('1,2', '3,4')
+        self.assertEqual(get.call_args.kwargs['timeout'], self.client.timeout)
+
+    def test_retries_server_errors(self):
+        """Test 5xx responses are retried with backoff, then succeed."""
+        responses = [mock_response(503), mock_response(200, {'status': 'OK', 'rows': [1]})]
+        with patch.object(self.client.session, 'get', side_effect=responses):
+            data = self.client.matrix('1,2', '3,4')
+        self.assertEqual(data['rows'], [1])
+        self.assertEqual(len(self.sleeps), 1)
+
+    def test_retries_over_query_limit(self):
+        """Test OVER_QUERY_LIMIT is retried until the retries run out."""
+        body = {'status': 'OVER_QUERY_LIMIT'}
+        with patch.object(self.client.session, 'get', return_value=mock_response(200, body)) as get:
+            data = self.client.matrix('1,2', '3,4')
+        self.assertEqual(data['status'], 'OVER_QUERY_LIMIT')
+        self.assertEqual(get.call_count, 3)
+
+    def test_connection_errors_give_up(self):
+        """Test network errors are retried and then reported as None."""
+        with patch.object(self.client.session, 'get', side_effect=requests.ConnectionError):
+            self.assertIsNone(self.client.matrix('1,2', '3,4'))
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_client_errors_not_retried(self):
+        """Test 4xx responses fail immediately."""
+        with patch.object(self.client.session, 'get', return_value=mock_response(403)) as get:
+            self.assertIsNone(self.client.matrix('1,2', '3,4'))
+        self.assertEqual(get.call_count, 1)
+
+    def test_backoff_is_jittered_and_bounded(self):
+        """Test backoff delays stay within the exponential cap."""
+        for attempt in range(4):
+            delay = self.client._backoff_delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, self.client.backoff * 2 ** attempt)
+
+    def test_executor_is_shared(self):
+        """Test the same executor is reused across calls."""
+        self.assertIs(self.client.executor, self.client.executor)
+
+
+class TestAsyncDistanceMatrixClient(unittest.TestCase):
+
+    def matrix(self, handler):
+        """Run one `matrix()` call against `handler`; returns (result, sleeps)."""
+        sleeps = []
+
+        async def sleep(seconds):
+            sleeps.append(seconds)
+
+        client = AsyncDistanceMatrixClient('key', url='http://upstream.test/json', max_retries=2,
+                                           sleep=sleep, transport=httpx.MockTransport(handler))
+
+        async def go():
+            try:
+                return await client.matrix('1,2', '3,4')
+            finally:
+                await client.aclose()
+        return asyncio.run(go()), sleeps
+
+    def test_retries_server_errors(self):
+        """Test 5xx responses are retried with backoff, as in the sync client."""
+        responses = iter([httpx.Response(503), httpx.Response(200, json={'status': 'OK', 'rows': [1]})])
+        data, sleeps = self.matrix(lambda request: next(responses))
+        self.assertEqual(data['rows'], [1])
+        self.assertEqual(len(sleeps), 1)
+
+    def test_connection_errors_give_up(self):
+        def fail(request):
+            raise httpx.ConnectError('refused')
+        data, sleeps = self.matrix(fail)
+        self.assertIsNone(data)
+        self.assertEqual(len(sleeps), 2)
+
+    def test_client_errors_not_retried(self):
+        calls = []
+
+        def forbidden(request):
+            calls.append(request)
+            return httpx.Response(403)
+        data, sleeps = self.matrix(forbidden)
+        self.assertIsNone(data)
+        self.assertEqual((len(calls), sleeps), (1, []))
+
+    def test_sends_query(self):
+        seen = []
+
+        def ok(request):
+            seen.append(dict(request.url.params))
+            return httpx.Response(200, json={'status': 'OK', 'rows': []})
+        self.matrix(ok)
+        self.assertEqual(seen[0], {'origins': '1,2', 'destinations': '3,4', 'key': 'key', 'units': 'metric'})
+
+
+class TestAgainstStubServer(unittest.TestCase):
+
+    def test_round_trip(self):
+        """Test a real HTTP round trip against the local stub."""
+        with DistanceMatrixStub() as stub:
+            client = DistanceMatrixClient('key', url=stub.url)
+            data = client.matrix('37.7749,-122.4194', '37.7849,-122.4094|37.7749,-122.4194')
+        self.assertEqual(data['status'], 'OK')
+        elements = data['rows'][0]['elements']
+        self.assertEqual(len(elements), 2)
+        self.assertGreater(elements[0]['distance']['value'], 1000)
+        self.assertEqual(elements[1]['distance']['value'], 0)
+
+    def test_connections_are_reused(self):
+        """Test consecutive calls reuse one keep-alive connection."""
+        with DistanceMatrixStub() as stub:
+            client = DistanceMatrixClient('key', url=stub.url)
+            for _ in range(3):
+                client.matrix('37.7749,-122.4194', '37.7849,-122.4094')
+        self.assertEqual(stub.requests, 3)
+        self.assertEqual(len(stub.peers), 1)
+
+    def test_retries_stub_errors(self):
+        """Test stub failures are retried until one succeeds."""
+        with DistanceMatrixStub(error_rate=0.5, seed=1) as stub:
+            client = DistanceMatrixClient('key', url=stub.url, max_retries=5, sleep=lambda _: None)
+            data = client.matrix('37.7749,-122.4194', '37.7849,-122.4094')
+        self.assertEqual(data['status'], 'OK')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,88 @@
+import os
+import random
+import sys
+import unittest
+from math import log
+
+import numpy as np
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from food_index import B, K1, FoodIndex, stem, tokenize
+
+ITEMS = (
+    'Tacos: Burritos: Quesadillas: Sodas',
+    'Hot dogs: chips: soda',
+    None,
+    'Snow Cones: Soft Serve Ice Cream & Frozen Virgin Daiquiris',
+    'Taco',
+    'Cold Truck: Sandwiches: Noodles: Pre-packaged Snacks: Candy: Desserts Various Beverages',
+)
+
+
+class TestTokenize(unittest.TestCase):
+
+    def test_inflections_share_a_stem(self):
+        """Test plurals and verb forms reduce to the same term."""
+        for words in (('tacos', 'taco', 'TACOS'), ('sandwiches', 'sandwich'), ('cookies', 'cookie'),
+                      ('fries', 'fried', 'fry'), ('noodles', 'noodle'), ('grilled', 'grill')):
+            self.assertEqual(len({stem(w.lower()) for w in words}), 1, words)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Hot Dogs & Soda: Various items'), ['hot', 'dog', 'soda'])
+        self.assertEqual(tokenize(''), [])
+
+
+class TestFoodIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = FoodIndex(ITEMS)
+
+    def test_postings_round_trip(self):
+        """Test decoded posting lists hold the rows and term frequencies that went in."""
+        ids, tfs = self.index.postings('taco')
+        self.assertEqual(ids.tolist(), [0, 4])
+        self.assertEqual(tfs.tolist(), [1, 1])
+        self.assertEqual(self.index.postings('soda')[0].tolist(), [0, 1])
+        self.assertEqual(len(self.index.postings('pizza')[0]), 0)
+
+    def test_wide_gaps(self):
+        """Test lists whose gaps need 2 and 4 bytes decode exactly."""
+        rng = random.Random(5)
+        values = [None] * 200000
+        expected = sorted(rng.sample(range(200000), 50)) + [199999]
+        for i in expected:
+            values[i] = 'kimchi'
+        values[0] = 'kimchi kimchi'
+        index = FoodIndex(values)
+        ids, tfs = index.postings('kimchi')
+        self.assertEqual(ids.tolist(), sorted(set([0] + expected)))
+        self.assertEqual(int(tfs[0]), 2)
+        self.assertGreater(int(index.widths[0]), 1)
+
+    def test_compressed(self):
+        """Test a dense list costs a byte per id, a quarter of int32."""
+        index = FoodIndex(['coffee'] * 1000)
+        self.assertEqual(index.nbytes(), 2000)
+
+    def test_bm25(self):
+        """Test scores follow BM25 and shorter matching rows rank higher."""
+        scores = self.index.scores('tacos')
+        n, df = len(ITEMS), 2
+        avg = np.mean([len(tokenize(text or '')) for text in ITEMS])
+        idf = log(1 + (n - df + 0.5) / (df + 0.5))
+        expected = idf * (K1 + 1) / (1 + K1 * (1 - B + B * 1 / avg))
+        self.assertAlmostEqual(scores[4], expected, places=5)
+        self.assertGreater(scores[4], scores[0])
+        self.assertEqual(np.flatnonzero(scores).tolist(), [0, 4])
+
+    def test_terms_add_up(self):
+        """Test a row matching more query terms scores higher."""
+        scores = self.index.scores('soda taco')
+        self.assertGreater(scores[0], scores[1])
+        self.assertEqual(self.index.scores('pizza').tolist(), [0.0] * len(ITEMS))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,80 @@
+import unittest
+import csv
+import io
+import sys
+import os
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ingest import (COLUMN_NAMES, batched, column_for_header, copy_buffer, iter_rows,
+                    normalise_row, row_hash)
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Mobile_Food_Facility_Permit.csv')
+
+
+class TestNormalisation(unittest.TestCase):
+
+    def test_column_for_header(self):
+        """Test CSV headers map onto table columns."""
+        self.assertEqual(column_for_header('Zip Codes'), 'zipcodes')
+        self.assertEqual(column_for_header('Fire Prevention Districts'), 'firepreventiondistricts')
+        self.assertEqual(column_for_header('Neighborhoods (old)'), 'neighborhoods')
+        self.assertEqual(column_for_header('locationid'), 'locationid')
+
+    def test_normalise_row(self):
+        """Test types, status case, blanks and 0/0 coordinates are normalised."""
+        row = dict(zip(COLUMN_NAMES, normalise_row({
+            'locationid': '42', 'applicant': ' Taco Truck ', 'status': 'approved',
+            'latitude': '0', 'longitude': '0', 'address': '', 'cnn': 'n/a'
+        })))
+        self.assertEqual(row['locationid'], 42)
+        self.assertEqual(row['applicant'], 'Taco Truck')
+        self.assertEqual(row['status'], 'APPROVED')
+        self.assertIsNone(row['latitude'])
+        self.assertIsNone(row['longitude'])
+        self.assertIsNone(row['address'])
+        self.assertIsNone(row['cnn'])
+
+    def test_rejects_missing_locationid(self):
+        """Test rows without a locationid are rejected."""
+        self.assertIsNone(normalise_row({'locationid': '', 'applicant': 'x'}))
+
+    def test_row_hash_tracks_content(self):
+        """Test the hash changes only when the row does."""
+        a = normalise_row({'locationid': '1', 'status': 'APPROVED'})
+        b = normalise_row({'locationid': '1', 'status': 'approved '})
+        c = normalise_row({'locationid': '1', 'status': 'EXPIRED'})
+        self.assertEqual(row_hash(a), row_hash(b))
+        self.assertNotEqual(row_hash(a), row_hash(c))
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_iter_rows_on_dataset(self):
+        """Test every row of the bundled CSV normalises."""
+        with open(CSV_PATH, newline='', encoding='utf-8') as f:
+            rows = list(iter_rows(f))
+        self.assertEqual(len(rows), 488)
+        self.assertNotIn(None, rows)
+        self.assertEqual(len(rows[0]), len(COLUMN_NAMES) + 1)
+        latitudes = [row[COLUMN_NAMES.index('latitude')] for row in rows]
+        self.assertNotIn(0.0, latitudes)
+
+    def test_iter_rows_is_lazy(self):
+        """Test rows are produced on demand rather than read up front."""
+        rows = iter_rows(io.StringIO('locationid,Status\n1,approved\n'))
+        self.assertEqual(next(rows)[COLUMN_NAMES.index('status')], 'APPROVED')
+
+    def test_batched(self):
+        """Test items are grouped into bounded batches."""
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    def test_copy_buffer(self):
+        """Test the COPY payload is CSV with NULLs as empty fields."""
+        buf = copy_buffer([(1, None, 'a, "b"'), (2, 'x\ny', 3.5)])
+        self.assertEqual(list(csv.reader(buf)), [['1', '', 'a, "b"'], ['2', 'x\ny', '3.5']])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,137 @@
+import unittest
+import tempfile
+import json
+import sys
+import os
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_clock import FakeClock
+from metrics import Registry, merge, render
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_and_gauge(self):
+        """Test counters and gauges render with their labels."""
+        hits = self.registry.counter('hits_total', 'Hits.', ('cache',))
+        hits.inc('nearby')
+        hits.inc('nearby', amount=2)
+        in_flight = self.registry.gauge('in_flight', 'In flight.')
+        in_flight.inc()
+        in_flight.dec()
+
+        text = self.registry.render()
+        self.assertIn('# TYPE hits_total counter', text)
+        self.assertIn('hits_total{cache="nearby"} 3', text)
+        self.assertIn('in_flight 0', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test histogram buckets, sum and count follow the exposition format."""
+        latency = self.registry.histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            latency.observe(value, '/x')
+
+        text = self.registry.render()
+        self.assertIn('latency_seconds_bucket{route="/x",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{route="/x",le="1.0"} 3', text)
+        self.assertIn('latency_seconds_bucket{route="/x",le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_count{route="/x"} 4', text)
+        self.assertIn('latency_seconds_sum{route="/x"} 6.05', text)
+
+    def test_timer(self):
+        """Test the timer context manager records one observation."""
+        stage = self.registry.histogram('stage_seconds', 'Stage.', ('stage',))
+        with stage.time('db_query'):
+            pass
+        self.assertEqual(stage.values[('db_query',)][-1], 1)
+
+    def test_label_escaping_and_arity(self):
+        """Test label values are escaped and the label count is checked."""
+        counter = self.registry.counter('c_total', 'C.', ('route',))
+        counter.inc('say "hi"\n')
+        self.assertIn('c_total{route="say \\"hi\\"\\n"} 1', self.registry.render())
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_collectors_run_before_snapshot(self):
+        """Test collectors copy in externally kept totals."""
+        hits = self.registry.counter('hits_total', 'Hits.')
+        self.registry.add_collector(lambda: hits.set(42))
+        self.assertIn('hits_total 42', self.registry.render())
+
+
+class TestSharedRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.clock = FakeClock()
+        self.registry = Registry(path=self.tmpdir.name, flush_interval=5, clock=self.clock)
+        self.requests = self.registry.counter('requests_total', 'Requests.')
+        self.in_flight = self.registry.gauge('in_flight', 'In flight.')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _sibling(self, pid, requests, in_flight, ppid=None):
+        other = Registry()
+        other.counter('requests_total', 'Requests.').inc(amount=requests)
+        other.gauge('in_flight', 'In flight.').inc(amount=in_flight)
+        data = {'pid': pid, 'ppid': os.getppid() if ppid is None else ppid, 'metrics': other.snapshot()}
+        with open(os.path.join(self.tmpdir.name, f'metrics-{pid}.json'), 'w') as f:
+            json.dump(data, f)
+
+    def test_sums_sibling_workers(self):
+        """Test a scrape adds up every worker of the same server."""
+        self.requests.inc(amount=2)
+        self.in_flight.inc()
+        self._sibling(pid=1, requests=3, in_flight=1)  # pid 1 is always alive
+
+        text = self.registry.render()
+        self.assertIn('requests_total 5', text)
+        self.assertIn('in_flight 2', text)
+
+    def test_dead_workers_keep_counters_not_gauges(self):
+        """Test an exited worker's counters still count but its gauges don't."""
+        self._sibling(pid=2 ** 22 + 12345, requests=3, in_flight=1)
+        text = self.registry.render()
+        self.assertIn('requests_total 3', text)
+        self.assertIn('in_flight 0', text)
+
+    def test_other_servers_are_ignored(self):
+        """Test files left by a previous server (another parent) are not merged."""
+        self._sibling(pid=1, requests=3, in_flight=1, ppid=-1)
+        self.assertNotIn('requests_total 3', self.registry.render())
+
+    def test_flush_is_rate_limited(self):
+        """Test maybe_flush writes at most once per interval."""
+        path = os.path.join(self.tmpdir.name, f'metrics-{os.getpid()}.json')
+        self.registry.maybe_flush()
+        self.assertTrue(os.path.exists(path))
+        os.remove(path)
+        self.clock.now += 1
+        self.registry.maybe_flush()
+        self.assertFalse(os.path.exists(path))
+        self.clock.now += 5
+        self.registry.maybe_flush()
+        self.assertTrue(os.path.exists(path))
+
+
+class TestMerge(unittest.TestCase):
+
+    def test_histograms_add_bucketwise(self):
+        """Test merging sums each bucket, the sum and the count."""
+        a, b = Registry(), Registry()
+        a.histogram('h', 'H.', buckets=(1.0,)).observe(0.5)
+        b.histogram('h', 'H.', buckets=(1.0,)).observe(2.0)
+        merged = merge([(a.snapshot(), True), (b.snapshot(), False)])
+        self.assertEqual(merged['h']['values'][()], [1, 2.5, 2])
+        self.assertIn('h_bucket{le="+Inf"} 2', render([(a.snapshot(), True), (b.snapshot(), True)]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
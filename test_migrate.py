@@ -0,0 +1,47 @@
+import unittest
+import sys
+import os
+
+# Add the parent directory to sys.path to import the modules under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from migrate import available_migrations
+from verify_indexes import CHECKS, plan_indexes
+
+
+class TestMigrations(unittest.TestCase):
+
+    def test_migrations_are_ordered_and_versioned(self):
+        """Test migration files carry unique, increasing version prefixes."""
+        versions = [version for version, _ in available_migrations()]
+        prefixes = [version.split('_', 1)[0] for version in versions]
+        self.assertEqual(prefixes, sorted(set(prefixes)))
+        self.assertTrue(all(prefix.isdigit() for prefix in prefixes))
+
+    def test_every_checked_index_is_created(self):
+        """Test each index the verifier expects is created by some migration."""
+        sql = ''.join(open(path).read() for _, path in available_migrations())
+        for _, _, index in CHECKS:
+            self.assertIn(index, sql)
+
+
+class TestPlanIndexes(unittest.TestCase):
+
+    def test_nested_plan(self):
+        """Test index names are collected from every level of a plan."""
+        plan = {
+            'Node Type': 'Limit',
+            'Plans': [{
+                'Node Type': 'Bitmap Heap Scan',
+                'Plans': [{'Node Type': 'Bitmap Index Scan', 'Index Name': 'ix_permit_status'}]
+            }]
+        }
+        self.assertEqual(plan_indexes(plan), {'ix_permit_status'})
+
+    def test_sequential_scan(self):
+        """Test a plan without index scans yields nothing."""
+        self.assertEqual(plan_indexes({'Node Type': 'Seq Scan'}), set())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,98 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from opening_hours import WEEK_BYTES, open_mask, parse_dayshours, resolve_open_at, slot_of
+
+
+def is_open(dayshours, when):
+    """Whether `dayshours` is open at the naive local time `when`."""
+    week = parse_dayshours(dayshours)
+    hours = np.frombuffer(week, dtype=np.uint8).reshape(1, WEEK_BYTES)
+    return bool(open_mask(hours, resolve_open_at(when))[0])
+
+
+# 2024-01-01 was a Monday
+MONDAY = '2024-01-01'
+FRIDAY = '2024-01-05'
+SATURDAY = '2024-01-06'
+SUNDAY = '2024-01-07'
+
+
+class TestParseDayshours(unittest.TestCase):
+
+    def test_day_range_and_several_intervals(self):
+        hours = 'Mo-Fr:7AM-8AM/10AM-11AM/12PM-1PM'
+        self.assertTrue(is_open(hours, f'{MONDAY}T07:00'))
+        self.assertTrue(is_open(hours, f'{FRIDAY}T12:45'))
+        self.assertFalse(is_open(hours, f'{MONDAY}T08:00'))
+        self.assertFalse(is_open(hours, f'{MONDAY}T09:30'))
+        self.assertFalse(is_open(hours, f'{SATURDAY}T07:30'))
+
+    def test_day_lists_and_clauses(self):
+        """Test `/` lists days and `;` separates clauses with their own hours."""
+        hours = 'Tu/Sa:8AM-3PM;Mo/We:10AM-2PM'
+        self.assertTrue(is_open(hours, f'{SATURDAY}T08:00'))
+        self.assertTrue(is_open(hours, f'{MONDAY}T13:59'))
+        self.assertFalse(is_open(hours, f'{MONDAY}T09:00'))
+        self.assertFalse(is_open(hours, f'{SUNDAY}T10:00'))
+
+    def test_overnight_runs_into_next_day(self):
+        """Test a range ending before it starts continues past midnight, Sunday into Monday."""
+        hours = 'Su/Fr:8PM-2AM'
+        self.assertTrue(is_open(hours, f'{FRIDAY}T23:00'))
+        self.assertTrue(is_open(hours, f'{SATURDAY}T01:45'))
+        self.assertFalse(is_open(hours, f'{SATURDAY}T02:00'))
+        self.assertTrue(is_open(hours, f'{MONDAY}T01:00'))
+        self.assertFalse(is_open(hours, f'{SATURDAY}T21:00'))
+
+    def test_midnight_and_noon(self):
+        hours = 'Sa-Su:10PM-12AM;Mo:12PM-12:30PM'
+        self.assertTrue(is_open(hours, f'{SUNDAY}T23:59'))
+        self.assertFalse(is_open(hours, f'{MONDAY}T00:00'))
+        self.assertTrue(is_open(hours, f'{MONDAY}T12:15'))
+        self.assertFalse(is_open(hours, f'{MONDAY}T12:30'))
+
+    def test_empty_or_unparseable(self):
+        for text in (None, '', '  ', 'Mo-Fr', 'Xx:8AM-9AM', 'Mo:25PM-2AM'):
+            self.assertIsNone(parse_dayshours(text), text)
+
+    def test_every_dataset_value_parses(self):
+        """Test the formats found in the published CSV all parse."""
+        for text in ('Mo-Su:12AM-12AM', 'Sa-Su:10AM-6PM;Mo-Fr:10AM-10PM', 'We/Th/Fr:6AM-7AM/9AM-10AM',
+                     'Mo-Fr:12:30PM-1:30PM'):
+            self.assertEqual(len(parse_dayshours(text)), WEEK_BYTES, text)
+
+
+class TestResolveOpenAt(unittest.TestCase):
+
+    def test_floors_to_slot_in_local_time(self):
+        """Test an aware time is converted to San Francisco time and floored to 15 minutes."""
+        moment = resolve_open_at('2024-01-01T20:37:10+00:00')
+        self.assertEqual(moment.isoformat(), '2024-01-01T12:30:00-08:00')
+        self.assertEqual(slot_of(moment), 12 * 4 + 2)
+
+    def test_open_now_uses_clock(self):
+        now = datetime(2024, 1, 7, 18, 0, tzinfo=timezone.utc).timestamp()
+        moment = resolve_open_at(open_now=True, clock=lambda: now)
+        self.assertEqual(moment.isoformat(), '2024-01-07T10:00:00-08:00')
+        self.assertEqual(slot_of(moment), 6 * 96 + 40)
+
+    def test_neither(self):
+        self.assertIsNone(resolve_open_at())
+        self.assertIsNone(resolve_open_at(open_now=False))
+
+    def test_invalid(self):
+        for open_at, open_now in (('tomorrow', False), (12, False), (None, 'yes')):
+            with self.assertRaises(ValueError):
+                resolve_open_at(open_at, open_now)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
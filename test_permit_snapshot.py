@@ -0,0 +1,166 @@
+import unittest
+import sys
+import os
+from datetime import datetime
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_clock import FakeClock
+from opening_hours import TIMEZONE
+from permit_snapshot import PermitSnapshot, SnapshotStore
+
+ROWS = [
+    (1, 'Taco Truck', 'APPROVED', '123 Main St', 37.7749, -122.4194, '94102'),
+    (2, 'Pizza Cart', 'APPROVED', '456 Oak Ave', 37.7849, -122.4094, '94103'),
+    (3, 'Burrito Express', 'EXPIRED', '789 Pine St', 37.7949, -122.3994, '94104'),
+    (4, 'No Location', 'APPROVED', None, None, None, None),
+]
+
+
+class TestPermitSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot = PermitSnapshot(ROWS)
+
+    def test_columns_loaded(self):
+        """Test coordinates land in read-only float arrays."""
+        self.assertEqual(len(self.snapshot), 4)
+        self.assertEqual(self.snapshot.latitudes[0], 37.7749)
+        self.assertFalse(self.snapshot.latitudes.flags.writeable)
+
+    def test_with_status(self):
+        """Test filtering by status returns records in locationid order."""
+        ids = [r.locationid for r in self.snapshot.with_status({'APPROVED'})]
+        self.assertEqual(ids, [1, 2, 4])
+        self.assertEqual(self.snapshot.with_status({'SUSPEND'}), [])
+
+    def test_record_by_locationid(self):
+        self.assertEqual(self.snapshot.record(3).applicant, 'Burrito Express')
+        self.assertIsNone(self.snapshot.record(99))
+
+    def test_search_is_case_insensitive_substring(self):
+        """Test search behaves like ILIKE '%q%'."""
+        results = self.snapshot.search('TRUCK', '', {'APPROVED'})
+        self.assertEqual([r.applicant for r in results], ['Taco Truck'])
+
+    def test_search_null_address_never_matches(self):
+        """Test a NULL address is excluded once an address filter is given."""
+        results = self.snapshot.search('', 'st', {'APPROVED'})
+        self.assertEqual([r.locationid for r in results], [1])
+
+    def test_search_limit(self):
+        """Test the result limit is honoured."""
+        self.assertEqual(len(self.snapshot.search('', '', {'APPROVED'}, limit=2)), 2)
+
+    def test_records_sorted_by_locationid(self):
+        """Test rows loaded out of order come back in locationid order."""
+        snapshot = PermitSnapshot(list(reversed(ROWS)))
+        self.assertEqual(list(snapshot.locationids), [1, 2, 3, 4])
+
+    def test_search_after(self):
+        """Test keyset paging resumes after the given locationid."""
+        first = self.snapshot.search('', '', {'APPROVED'}, limit=2)
+        rest = self.snapshot.search('', '', {'APPROVED'}, after=first[-1].locationid)
+        self.assertEqual([r.locationid for r in first + rest], [1, 2, 4])
+        self.assertEqual(self.snapshot.search('', '', {'APPROVED'}, after=4), [])
+
+    def test_spatial_index_skips_missing_coordinates(self):
+        """Test the snapshot's spatial index leaves out unlocated permits."""
+        self.assertEqual(len(self.snapshot.spatial_index), 3)
+
+    def test_open_at_filters_with_status(self):
+        """Test `open_at` keeps only permits open then; unknown hours never match."""
+        rows = [row + (None, hours) for row, hours in zip(ROWS, ('Mo-Fr:10AM-2PM', 'Sa-Su:6PM-2AM', None, ''))]
+        snapshot = PermitSnapshot(rows)
+        self.assertFalse(snapshot.hours.flags.writeable)
+        monday_noon = datetime(2024, 1, 1, 12, 0, tzinfo=TIMEZONE)
+        sunday_night = datetime(2024, 1, 8, 1, 0, tzinfo=TIMEZONE)
+        self.assertEqual([r.locationid for r in snapshot.with_status({'APPROVED'}, monday_noon)], [1])
+        self.assertEqual([r.locationid for r in snapshot.search('', '', {'APPROVED'}, open_at=sunday_night)], [2])
+        self.assertEqual(snapshot.search('', '', {'EXPIRED'}, open_at=monday_noon), [])
+        self.assertEqual([r.locationid for _, r in snapshot.nearest(37.7849, -122.4094, 5, {'APPROVED'}, monday_noon)],
+                         [1])
+
+    def test_version_tracks_content(self):
+        """Test the version changes with the data and only with the data."""
+        self.assertEqual(self.snapshot.version, PermitSnapshot(ROWS).version)
+        self.assertNotEqual(self.snapshot.version, PermitSnapshot(ROWS[:2]).version)
+
+
+class TestSnapshotStore(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.clock = FakeClock()
+
+        def loader():
+            self.calls += 1
+            return ROWS[:self.calls]
+
+        self.store = SnapshotStore(loader, refresh_interval=60, clock=self.clock)
+
+    def test_loads_once(self):
+        """Test the snapshot is loaded on first use and then reused."""
+        first = self.store.get()
+        self.assertIs(self.store.get(), first)
+        self.assertEqual(self.calls, 1)
+
+    def test_refreshes_after_interval(self):
+        """Test a stale snapshot is swapped for a fresh one."""
+        first = self.store.get()
+        self.clock.now += 61
+        second = self.store.get()
+        self.assertIsNot(second, first)
+        self.assertEqual(len(second), 2)
+        self.assertEqual(len(first), 1)
+
+    def test_failed_refresh_serves_stale_snapshot(self):
+        """Test a refresh error keeps the loaded snapshot and waits an interval before retrying."""
+        failing = [False]
+
+        def loader():
+            self.calls += 1
+            if failing[0]:
+                raise RuntimeError('database down')
+            return ROWS[:self.calls]
+
+        store = SnapshotStore(loader, refresh_interval=60, clock=self.clock)
+        first = store.get()
+        failing[0] = True
+        self.clock.now += 61
+        with self.assertLogs('permit_snapshot', 'ERROR'):
+            self.assertIs(store.get(), first)
+        self.assertIs(store.get(), first)
+        self.clock.now += 59
+        self.assertIs(store.get(), first)
+        self.assertEqual(self.calls, 2)
+        failing[0] = False
+        self.clock.now += 1
+        self.assertEqual(len(store.get()), 3)
+
+    def test_unchanged_rows_keep_snapshot(self):
+        """Test a refresh that reads the same rows keeps the snapshot and bumps loaded_at."""
+        store = SnapshotStore(lambda: list(reversed(ROWS)), refresh_interval=60, clock=self.clock)
+        first = store.get()
+        self.clock.now += 61
+        self.assertIs(store.get(), first)
+        self.assertEqual(first.loaded_at, self.clock.now)
+        self.assertIs(store.reload(), first)
+
+    def test_peek_never_loads(self):
+        self.assertIsNone(self.store.peek())
+        self.assertEqual(self.calls, 0)
+        snapshot = self.store.get()
+        self.assertIs(self.store.peek(), snapshot)
+
+    def test_reload_and_invalidate(self):
+        """Test explicit reload and invalidate both force a new load."""
+        self.store.get()
+        self.assertEqual(len(self.store.reload()), 2)
+        self.store.invalidate()
+        self.assertEqual(len(self.store.get()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,131 @@
+import unittest
+import tempfile
+import pstats
+import time
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, jsonify
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from profiling import RequestProfiler, record_timing, timing
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class TestRequestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _client(self, **kwargs):
+        app = Flask(__name__)
+
+        @app.route('/work')
+        def work():
+            with timing('db_query'):
+                busy(0.02)
+            record_timing('serialize', 0.001)
+            return jsonify(ok=True)
+
+        self.profiler = RequestProfiler(self.tmpdir.name, **kwargs)
+        self.profiler.init_app(app)
+        self.app = app
+        return app.test_client()
+
+    def _files(self):
+        return sorted(os.listdir(self.tmpdir.name))
+
+    def test_cprofile_on_request(self):
+        """Test a token-bearing X-Profile request is profiled and its stats written."""
+        client = self._client(token='secret')
+        response = client.get('/work', headers={'X-Profile': '1', 'X-Profile-Token': 'secret'})
+
+        self.assertIn('db_query;dur=', response.headers['Server-Timing'])
+        self.assertIn('serialize;dur=1.00', response.headers['Server-Timing'])
+        self.assertIn('total;dur=', response.headers['Server-Timing'])
+        files = self._files()
+        self.assertEqual(files, [response.headers['X-Profile-File']])
+        self.assertTrue(files[0].endswith('-work.pstats'))
+        stats = pstats.Stats(os.path.join(self.tmpdir.name, files[0]))
+        self.assertTrue(any(func[2] == 'busy' for func in stats.stats))
+
+    def test_sampling_profile_is_collapsed_stacks(self):
+        """Test the sampling mode writes folded stacks that reach the busy loop."""
+        client = self._client(token='secret', interval=0.001)
+        response = client.get('/work', headers={'X-Profile': 'sample', 'X-Profile-Token': 'secret'})
+
+        path = os.path.join(self.tmpdir.name, response.headers['X-Profile-File'])
+        self.assertTrue(path.endswith('.collapsed'))
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(any('work (test_profiling.py' in line and 'busy (' in line for line in lines))
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+
+    def test_sampling_follows_executor_threads(self):
+        """Test work handed to a named pool is sampled under the pool's name, and idle workers aren't."""
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='distance-matrix')
+        idle = ThreadPoolExecutor(max_workers=1, thread_name_prefix='idle-pool')
+        self.addCleanup(pool.shutdown)
+        self.addCleanup(idle.shutdown)
+        idle.submit(int).result()
+        client = self._client(token='secret', interval=0.001, thread_prefixes=('distance-matrix', 'idle-pool'))
+
+        @self.app.route('/fan_out')
+        def fan_out():
+            with timing('upstream_wait'):
+                pool.submit(busy, 0.05).result()
+            return jsonify(ok=True)
+
+        response = client.get('/fan_out', headers={'X-Profile': 'sample', 'X-Profile-Token': 'secret'})
+        with open(os.path.join(self.tmpdir.name, response.headers['X-Profile-File'])) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(any(line.startswith('distance-matrix;') and 'busy (' in line for line in lines))
+        self.assertFalse(any(line.startswith('idle-pool;') for line in lines))
+        self.assertIn('upstream_wait;dur=', response.headers['Server-Timing'])
+
+    def test_wrong_or_missing_token_is_ignored(self):
+        """Test X-Profile without the right token does nothing."""
+        client = self._client(token='secret')
+        for headers in ({'X-Profile': '1'}, {'X-Profile': '1', 'X-Profile-Token': 'nope'}):
+            response = client.get('/work', headers=headers)
+            self.assertNotIn('Server-Timing', response.headers)
+        self.assertEqual(self._files(), [])
+
+    def test_sampled_one_in_n(self):
+        """Test the sample rate profiles requests without any header."""
+        draws = iter([0.9, 0.1, 0.9])
+        client = self._client(sample_rate=4, rand=lambda: next(draws))
+        responses = [client.get('/work') for _ in range(3)]
+
+        self.assertEqual(['Server-Timing' in r.headers for r in responses], [False, True, False])
+        self.assertEqual(len(self._files()), 1)
+        self.assertTrue(self._files()[0].endswith('.collapsed'))
+
+    def test_disabled_registers_nothing(self):
+        """Test a profiler without token or sample rate leaves the app untouched."""
+        self._client()
+        self.assertFalse(self.profiler.enabled)
+        self.assertEqual(dict(self.app.before_request_funcs), {})
+        self.assertEqual(dict(self.app.after_request_funcs), {})
+
+    def test_timing_outside_profiled_request_is_dropped(self):
+        """Test stage timings outside a profiled request are a no-op."""
+        with timing('db_query'):
+            pass
+        record_timing('serialize', 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
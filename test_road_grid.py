@@ -0,0 +1,202 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cache import quantize
+from permit_snapshot import PermitSnapshot
+from road_grid import MISSING, QuotaExhausted, RoadGrid, RoadGridStore, build, fingerprint
+from spatial_index import haversine_km
+from upstream_budget import MemoryBudget
+
+BOUNDS = (37.770, 37.776, -122.425, -122.417)  # about 7 x 8 cells of 100 m
+ROWS = [
+    (1, 'Taco Truck', 'APPROVED', '123 Main St', 37.7749, -122.4194, '94102'),
+    (2, 'Pizza Cart', 'APPROVED', '456 Oak Ave', 37.7849, -122.4094, '94103'),
+    (3, 'Burrito Express', 'EXPIRED', '789 Pine St', 37.7949, -122.3994, '94104'),
+    (4, 'No Location', 'APPROVED', None, None, None, None),
+    (5, 'Coffee Cart', 'APPROVED', '1 Market St', 37.7712, -122.4230, '94105'),
+]
+
+
+def permits(rows=ROWS, statuses=('APPROVED',)):
+    return [SimpleNamespace(locationid=r[0], latitude=r[4], longitude=r[5]) for r in rows if r[2] in statuses]
+
+
+class FakeMatrix:
+    """Road distance = 1.3 x great-circle; optionally fails after `fail_after` calls."""
+
+    def __init__(self, fail_after=None, unreachable=()):
+        self.calls = 0
+        self.elements = 0
+        self.fail_after = fail_after
+        self.unreachable = set(unreachable)
+
+    def __call__(self, centres, chunk):
+        if self.fail_after is not None and self.calls >= self.fail_after:
+            raise RuntimeError('upstream down')
+        self.calls += 1
+        self.elements += len(centres) * len(chunk)
+        return [
+            (centre, p, round(1.3 * haversine_km(centre[0], centre[1], p.latitude, p.longitude), 2))
+            for centre in centres for p in chunk if p.locationid not in self.unreachable
+        ]
+
+
+class TestRoadGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'grid.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def build(self, fetch=None, **kwargs):
+        kwargs.setdefault('bounds', BOUNDS)
+        kwargs.setdefault('k', 2)
+        return build(self.path, kwargs.pop('permits', permits()), fetch or FakeMatrix(),
+                     log=lambda message: None, **kwargs)
+
+    def test_cells_match_quantize(self):
+        """Test grid cells are the cells live queries snap to."""
+        self.build()
+        grid = RoadGrid(self.path)
+        rng = random.Random(1)
+        for _ in range(200):
+            lat = rng.uniform(BOUNDS[0], BOUNDS[1])
+            lon = rng.uniform(BOUNDS[2], BOUNDS[3])
+            self.assertEqual(grid.centre(*grid.cell(lat, lon)), quantize(lat, lon, 100.0))
+
+    def test_lookup_returns_nearest_by_road(self):
+        """Test each cell keeps its k nearest permits, nearest first."""
+        self.build()
+        grid = RoadGrid(self.path)
+        lat, lon = 37.7731, -122.4212
+        centre = quantize(lat, lon, 100.0)
+        expected = sorted(
+            (round(1.3 * haversine_km(centre[0], centre[1], p.latitude, p.longitude), 2), p.locationid)
+            for p in permits() if p.latitude
+        )[:2]
+        self.assertEqual(grid.lookup(lat, lon), [(locationid, km) for km, locationid in expected])
+        self.assertIsNone(grid.lookup(37.80, -122.42))
+        self.assertIsNone(grid.lookup(37.773, -122.40))
+
+    def test_unreachable_permits_leave_empty_slots(self):
+        """Test cells with fewer reachable permits than k are padded, not filled with junk."""
+        self.build(FakeMatrix(unreachable={1, 2}))
+        grid = RoadGrid(self.path)
+        self.assertEqual([locationid for locationid, _ in grid.lookup(37.7731, -122.4212)], [5])
+        self.assertEqual(int(grid.entries[grid.cell(37.7731, -122.4212)][1]['distance_m']), MISSING)
+
+    def test_requests_respect_element_cap(self):
+        """Test origins are packed so no request exceeds max_elements."""
+        fetch = FakeMatrix()
+        cells = self.build(fetch, max_elements=9)
+        self.assertEqual(fetch.elements, cells * 3)
+        self.assertEqual(fetch.calls, -(-cells // 3))
+
+    def test_resumes_after_interruption(self):
+        """Test a failed run keeps finished cells and a rerun only computes the rest."""
+        with self.assertRaises(RuntimeError):
+            self.build(FakeMatrix(fail_after=5), max_elements=9)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(os.path.exists(self.path + '.partial'))
+
+        fetch = FakeMatrix()
+        resumed = self.build(fetch, max_elements=9)
+        total = RoadGrid(self.path).rows * RoadGrid(self.path).cols
+        self.assertEqual(resumed, total - 15)
+        self.assertFalse(os.path.exists(self.path + '.partial'))
+
+        fresh = os.path.join(self.tmpdir, 'fresh.bin')
+        build(fresh, permits(), FakeMatrix(), bounds=BOUNDS, k=2, log=lambda message: None)
+        self.assertEqual(RoadGrid(self.path).entries.tobytes(), RoadGrid(fresh).entries.tobytes())
+
+    def test_stops_when_daily_quota_runs_out(self):
+        """Test the job stops with QuotaExhausted and resumes with the next day's budget."""
+        with self.assertRaises(QuotaExhausted):
+            self.build(budget=MemoryBudget(per_day=30), max_elements=9)
+        self.assertTrue(os.path.exists(self.path + '.partial'))
+        self.assertGreater(self.build(budget=MemoryBudget(per_day=1000), max_elements=9), 0)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_gives_up_on_a_budget_that_cannot_cover_a_request(self):
+        """Test a burst below one request, or a bucket that never refills, stops the job instead of spinning."""
+        with self.assertRaises(QuotaExhausted):
+            self.build(budget=MemoryBudget(per_second=5, burst=5), max_elements=9)
+        budget = MemoryBudget(per_second=9, clock=lambda: 0.0)
+        sleeps = []
+        with self.assertRaises(QuotaExhausted):
+            self.build(budget=budget, max_elements=9, sleep=sleeps.append)
+        self.assertEqual(len(sleeps), 600)
+
+    def test_waits_for_per_second_budget(self):
+        """Test a per-second limit slows the job down instead of stopping it."""
+        clock = [0.0]
+        budget = MemoryBudget(per_second=9, clock=lambda: clock[0])
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        self.build(budget=budget, max_elements=9, sleep=sleep)
+        self.assertGreater(clock[0], 0)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_changed_permits_start_over(self):
+        """Test a partial file built for other permits is discarded."""
+        with self.assertRaises(RuntimeError):
+            self.build(FakeMatrix(fail_after=5), max_elements=9)
+        fetch = FakeMatrix()
+        cells = self.build(fetch, permits=permits()[:2], max_elements=9)
+        grid = RoadGrid(self.path)
+        self.assertEqual(cells, grid.rows * grid.cols)
+        self.assertEqual(grid.fingerprint, fingerprint(permits()[:2]))
+
+
+class TestRoadGridStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'grid.bin')
+        self.store = RoadGridStore(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_missing_file(self):
+        self.assertIsNone(self.store.get(PermitSnapshot(ROWS)))
+
+    def test_serves_only_matching_snapshot(self):
+        """Test the grid is used only while permit ids and coordinates are unchanged."""
+        build(self.path, permits(), FakeMatrix(), bounds=BOUNDS, k=2, log=lambda message: None)
+        self.assertIsNotNone(self.store.get(PermitSnapshot(ROWS)))
+
+        # Renamed applicant: same permits, same places
+        renamed = [ROWS[0][:1] + ('Taco Palace',) + ROWS[0][2:]] + ROWS[1:]
+        self.assertIsNotNone(self.store.get(PermitSnapshot(renamed)))
+
+        moved = ROWS[:4] + [ROWS[4][:4] + (37.7800, -122.4230, '94105')]
+        self.assertIsNone(self.store.get(PermitSnapshot(moved)))
+
+    def test_reopens_replaced_file(self):
+        """Test a rebuilt grid is picked up without a restart."""
+        build(self.path, permits(), FakeMatrix(), bounds=BOUNDS, k=2, log=lambda message: None)
+        self.assertEqual(self.store.get(PermitSnapshot(ROWS)).k, 2)
+        build(self.path, permits(), FakeMatrix(), bounds=BOUNDS, k=3, log=lambda message: None)
+        self.assertEqual(self.store.get(PermitSnapshot(ROWS)).k, 3)
+
+    def test_corrupt_file_is_ignored(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a grid')
+        self.assertIsNone(self.store.get(PermitSnapshot(ROWS)))
+
+
+if __name__ == '__main__':
+    unittest.main()
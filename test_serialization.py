@@ -0,0 +1,74 @@
+import unittest
+from collections import namedtuple
+from unittest.mock import patch
+import json
+import sys
+import os
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import serialization
+from serialization import DEFAULT_FIELDS, PERMIT_FIELDS, RowSerializer, dumps, parse_fields, project
+
+Row = namedtuple('Row', ('locationid',) + PERMIT_FIELDS)
+ROW = Row(1, 'Taco Truck', 'APPROVED', '123 Main St', 37.7749, -122.4194, '94102', 'Tacos: Burritos',
+          'Mo-Fr:10AM-2PM')
+
+
+class TestParseFields(unittest.TestCase):
+
+    def test_default_leaves_out_opt_in_fields(self):
+        """Test no fields selects the original shape; newer columns must be asked for."""
+        self.assertEqual(parse_fields(None), DEFAULT_FIELDS)
+        self.assertNotIn('fooditems', DEFAULT_FIELDS)
+        self.assertNotIn('dayshours', DEFAULT_FIELDS)
+        self.assertEqual(parse_fields(['dayshours', 'applicant', 'fooditems']),
+                         ('applicant', 'fooditems', 'dayshours'))
+
+    def test_canonical_order_without_duplicates(self):
+        """Test requested fields come back in response order, once each."""
+        self.assertEqual(parse_fields(['zipcodes', 'applicant', 'zipcodes']), ('applicant', 'zipcodes'))
+
+    def test_rejects_bad_fields(self):
+        """Test unknown, private or malformed field lists are rejected."""
+        for fields in (['locationid'], ['nope'], [], 'applicant', [1]):
+            with self.assertRaises(ValueError):
+                parse_fields(fields)
+
+
+class TestRowSerializer(unittest.TestCase):
+
+    def test_full_row(self):
+        """Test a row becomes the public dict without private columns."""
+        self.assertEqual(RowSerializer()(ROW), {
+            'applicant': 'Taco Truck', 'status': 'APPROVED', 'address': '123 Main St',
+            'latitude': 37.7749, 'longitude': -122.4194, 'zipcodes': '94102', 'fooditems': 'Tacos: Burritos',
+            'dayshours': 'Mo-Fr:10AM-2PM'
+        })
+
+    def test_single_field(self):
+        """Test a one-field projection still yields a dict."""
+        self.assertEqual(RowSerializer(('applicant',)).many([ROW, ROW]), [{'applicant': 'Taco Truck'}] * 2)
+
+    def test_project_keeps_computed_keys(self):
+        """Test projecting built results keeps distances."""
+        results = [dict(RowSerializer()(ROW), distance_km=1.5)]
+        self.assertEqual(project(results, ('address',)), [{'address': '123 Main St', 'distance_km': 1.5}])
+        self.assertIs(project(results, PERMIT_FIELDS), results)
+        self.assertEqual(list(project(results, DEFAULT_FIELDS)[0]), list(DEFAULT_FIELDS) + ['distance_km'])
+
+
+class TestDumps(unittest.TestCase):
+
+    def test_stdlib_fallback_matches(self):
+        """Test the json fallback produces the same document as orjson."""
+        payload = {'results': [RowSerializer()(ROW)], 'next_cursor': None}
+        with patch.object(serialization, 'orjson', None):
+            fallback = dumps(payload)
+        self.assertIsInstance(fallback, bytes)
+        self.assertEqual(json.loads(fallback), json.loads(dumps(payload)))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,190 @@
+import asyncio
+import unittest
+import tempfile
+import threading
+import time
+import sys
+import os
+
+# Add the parent directory to sys.path to import the modules under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cache import SQLiteCache
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def run_concurrently(count, target):
+    """Start `count` threads on `target` and collect their results or errors."""
+    results = [None] * count
+    barrier = threading.Barrier(count)
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = target()
+        except Exception as error:
+            results[i] = error
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        """Test a burst of identical calls runs the function once."""
+        flight = SingleFlight(wait=5)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'result'
+
+        results = run_concurrently(8, lambda: flight.do('key', compute))
+
+        self.assertEqual(results, ['result'] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats()['followers'], 7)
+        self.assertEqual(flight.stats()['in_flight'], 0)
+
+    def test_errors_propagate_and_are_not_kept(self):
+        """Test followers see the leader's error and the next call retries."""
+        flight = SingleFlight(wait=5)
+
+        def fail():
+            time.sleep(0.2)
+            raise RuntimeError('upstream down')
+
+        results = run_concurrently(4, lambda: flight.do('key', fail))
+
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(flight.do('key', lambda: 'recovered'), 'recovered')
+
+    def test_follower_wait_is_bounded(self):
+        """Test a follower computes on its own once the wait runs out."""
+        flight = SingleFlight(wait=0.05)
+        release = threading.Event()
+        leader = threading.Thread(target=flight.do, args=('key', lambda: release.wait(5)))
+        leader.start()
+        time.sleep(0.02)
+
+        self.assertEqual(flight.do('key', lambda: 'own result'), 'own result')
+        self.assertEqual(flight.stats()['timeouts'], 1)
+        release.set()
+        leader.join()
+
+    def test_different_keys_run_independently(self):
+        """Test calls for different keys don't wait on each other."""
+        flight = SingleFlight(wait=5)
+        results = run_concurrently(3, lambda: flight.do(threading.get_ident(), lambda: 1))
+        self.assertEqual(results, [1, 1, 1])
+        self.assertEqual(flight.stats()['followers'], 0)
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 42
+
+        async def go():
+            return await asyncio.gather(*(flight.do('k', compute) for _ in range(10)))
+
+        self.assertEqual(asyncio.run(go()), [42] * 10)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats(), {'in_flight': 0, 'leaders': 1, 'followers': 9, 'timeouts': 0})
+
+    def test_errors_propagate_and_are_not_kept(self):
+        flight = AsyncSingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError('boom')
+
+        async def go():
+            return await asyncio.gather(flight.do('k', fail), flight.do('k', fail), return_exceptions=True)
+
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in asyncio.run(go())))
+        self.assertEqual(flight.stats()['in_flight'], 0)
+
+    def test_follower_wait_is_bounded(self):
+        flight = AsyncSingleFlight(wait=0.01)
+
+        async def slow():
+            await asyncio.sleep(0.2)
+            return 'slow'
+
+        async def fast():
+            return 'fast'
+
+        async def go():
+            leader = asyncio.ensure_future(flight.do('k', slow))
+            await asyncio.sleep(0)
+            follower = await flight.do('k', fast)
+            return follower, await leader
+
+        self.assertEqual(asyncio.run(go()), ('fast', 'slow'))
+        self.assertEqual(flight.timeouts, 1)
+
+
+class TestSharedSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache.sqlite3')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_locks_are_exclusive_and_expire(self):
+        """Test a named lock has one holder until released or expired."""
+        cache = SQLiteCache(self.path)
+        self.assertTrue(cache.acquire_lock('a', ttl=10))
+        other = run_concurrently(1, lambda: cache.acquire_lock('a', ttl=10))
+        self.assertEqual(other, [False])
+        cache.release_lock('a')
+        self.assertTrue(cache.acquire_lock('a', ttl=-1))
+        self.assertTrue(cache.acquire_lock('a', ttl=10))
+
+    def test_workers_share_one_computation(self):
+        """Test two "workers" on one cache file compute a key once."""
+        caches = [SQLiteCache(self.path), SQLiteCache(self.path)]
+        calls = []
+
+        def make_worker(cache):
+            flight = SingleFlight(wait=5, shared=cache, shared_lookup=cache.get, poll_interval=0.01)
+
+            def compute():
+                calls.append(1)
+                time.sleep(0.2)
+                cache.set('key', 'result')
+                return 'result'
+
+            return lambda: cache.get('key') or flight.do('key', compute)
+
+        workers = [make_worker(cache) for cache in caches]
+        lock = threading.Lock()
+
+        def next_worker():
+            with lock:
+                worker = workers.pop()
+            return worker()
+
+        results = run_concurrently(2, next_worker)
+
+        self.assertEqual(results, ['result', 'result'])
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,110 @@
+import unittest
+import random
+import sys
+import os
+
+import numpy as np
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from spatial_index import SpatialIndex, haversine_km, has_coordinates
+
+
+class TestHaversine(unittest.TestCase):
+
+    def test_zero_distance(self):
+        """Test that a point is zero km from itself."""
+        self.assertEqual(haversine_km(37.7749, -122.4194, 37.7749, -122.4194), 0)
+
+    def test_known_distance(self):
+        """Test one degree of latitude is roughly 111 km."""
+        self.assertAlmostEqual(haversine_km(37.0, -122.0, 38.0, -122.0), 111.19, places=1)
+
+    def test_has_coordinates(self):
+        """Test that 0.0 and None coordinates are treated as missing."""
+        self.assertTrue(has_coordinates(37.7, -122.4))
+        self.assertFalse(has_coordinates(0.0, 0.0))
+        self.assertFalse(has_coordinates(None, -122.4))
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        """Build an index over random points in an SF-sized bounding box."""
+        rng = random.Random(42)
+        statuses = ['APPROVED', 'EXPIRED', 'REQUESTED']
+        self.entries = [
+            (i, rng.uniform(37.70, 37.81), rng.uniform(-122.51, -122.37), rng.choice(statuses))
+            for i in range(2000)
+        ]
+        self.index = SpatialIndex(self.entries)
+
+    def _brute_force(self, lat, lon, k, statuses=None):
+        candidates = [
+            (haversine_km(lat, lon, p_lat, p_lon), item)
+            for item, p_lat, p_lon, status in self.entries
+            if statuses is None or status in statuses
+        ]
+        return sorted(candidates)[:k]
+
+    def test_matches_brute_force(self):
+        """Test that k-nearest results match an exhaustive scan."""
+        rng = random.Random(7)
+        for _ in range(50):
+            lat, lon = rng.uniform(37.65, 37.85), rng.uniform(-122.55, -122.33)
+            expected = [item for _, item in self._brute_force(lat, lon, 5)]
+            actual = [item for _, item in self.index.nearest(lat, lon, k=5)]
+            self.assertEqual(actual, expected)
+
+    def test_status_filter(self):
+        """Test that only entries with a requested status are returned."""
+        statuses = {'EXPIRED'}
+        results = self.index.nearest(37.7749, -122.4194, k=10, statuses=statuses)
+        expected = [item for _, item in self._brute_force(37.7749, -122.4194, 10, statuses)]
+        self.assertEqual([item for _, item in results], expected)
+
+    def test_allowed_mask(self):
+        """Test `allowed` keeps only the entries it marks, still nearest first."""
+        allowed = np.array([i % 3 == 0 for i in range(len(self.entries))])
+        results = self.index.nearest(37.7749, -122.4194, k=10, statuses={'APPROVED'}, allowed=allowed)
+        expected = sorted(
+            (haversine_km(37.7749, -122.4194, lat, lon), item)
+            for item, lat, lon, status in self.entries if status == 'APPROVED' and allowed[item]
+        )[:10]
+        self.assertEqual([item for _, item in results], [item for _, item in expected])
+
+    def test_results_sorted_by_distance(self):
+        """Test that results come back closest first."""
+        distances = [d for d, _ in self.index.nearest(37.7749, -122.4194, k=20)]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_arrays_are_read_only(self):
+        """Test the index can't be modified after it's built."""
+        with self.assertRaises(ValueError):
+            self.index.lat_rad[0] = 0.0
+        self.assertIsInstance(self.index.items, tuple)
+
+    def test_far_away_query(self):
+        """Test that a query far outside the data still finds the closest points."""
+        expected = [item for _, item in self._brute_force(40.7128, -74.0060, 3)]
+        actual = [item for _, item in self.index.nearest(40.7128, -74.0060, k=3)]
+        self.assertEqual(actual, expected)
+
+    def test_skips_missing_coordinates(self):
+        """Test that rows with 0/NULL coordinates are not indexed."""
+        index = SpatialIndex([
+            ('a', 37.77, -122.41, 'APPROVED'),
+            ('b', 0.0, 0.0, 'APPROVED'),
+            ('c', None, None, 'APPROVED'),
+        ])
+        self.assertEqual(len(index), 1)
+        self.assertEqual([item for _, item in index.nearest(0.0, 0.0, k=5)], ['a'])
+
+    def test_empty_index(self):
+        """Test that an empty index returns no results."""
+        self.assertEqual(SpatialIndex([]).nearest(37.77, -122.41), [])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,54 @@
+import unittest
+import random
+import sys
+import os
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from text_index import TrigramIndex, trigrams
+
+
+class TestTrigrams(unittest.TestCase):
+
+    def test_trigrams(self):
+        """Test a string is split into its distinct 3-grams."""
+        self.assertEqual(trigrams('sansome'), {'san', 'ans', 'nso', 'som', 'ome'})
+
+    def test_short_string(self):
+        """Test strings shorter than a gram have none."""
+        self.assertEqual(trigrams('sa'), set())
+
+
+class TestTrigramIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.values = ['sansome st', 'san bruno ave', 'market st', None, 'mission st']
+        self.index = TrigramIndex(self.values)
+
+    def test_candidates_contain_matches(self):
+        """Test the candidates include every row containing the query."""
+        self.assertEqual(list(self.index.candidates('san')), [0, 1])
+
+    def test_short_query_does_not_narrow(self):
+        """Test queries under three characters return None (scan instead)."""
+        self.assertIsNone(self.index.candidates('st'))
+
+    def test_unknown_gram(self):
+        """Test a query with an unseen gram has no candidates."""
+        self.assertEqual(len(self.index.candidates('xyz')), 0)
+
+    def test_matches_brute_force(self):
+        """Test verified candidates equal a substring scan on random data."""
+        rng = random.Random(3)
+        values = [''.join(rng.choice('abc ') for _ in range(rng.randint(0, 12))) for _ in range(300)]
+        index = TrigramIndex(values)
+        for _ in range(200):
+            query = ''.join(rng.choice('abc ') for _ in range(rng.randint(3, 5)))
+            expected = [i for i, v in enumerate(values) if query in v]
+            actual = [int(i) for i in index.candidates(query) if query in values[i]]
+            self.assertEqual(actual, expected)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
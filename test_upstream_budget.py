@@ -0,0 +1,105 @@
+import unittest
+import tempfile
+import sys
+import os
+
+# Add the parent directory to sys.path to import the module under test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_clock import FakeClock
+from upstream_budget import MemoryBudget, SQLiteBudget, make_budget
+
+
+class BudgetTests:
+    """Shared behaviour checks; subclasses provide `make`."""
+
+    def setUp(self):
+        self.clock = FakeClock(1_700_000_000.0)
+
+    def test_unlimited_by_default(self):
+        """Test a budget with no limits always allows."""
+        budget = self.make()
+        self.assertTrue(budget.try_consume(10 ** 6))
+
+    def test_per_second_bucket(self):
+        """Test the bucket empties and refills at the configured rate."""
+        budget = self.make(per_second=50)
+        self.assertTrue(budget.try_consume(50))
+        self.assertFalse(budget.try_consume(1))
+        self.clock.now += 0.5
+        self.assertTrue(budget.try_consume(25))
+        self.assertFalse(budget.try_consume(1))
+
+    def test_daily_cap_and_rollover(self):
+        """Test the daily cap denies all-or-nothing and resets the next day."""
+        budget = self.make(per_day=100)
+        self.assertTrue(budget.try_consume(75))
+        self.assertFalse(budget.try_consume(50))
+        self.assertTrue(budget.try_consume(25))
+        self.assertEqual(budget.remaining()['remaining_today'], 0)
+        self.clock.now += 86400
+        self.assertEqual(budget.remaining()['remaining_today'], 100)
+        self.assertTrue(budget.try_consume(100))
+
+    def test_denials_are_counted(self):
+        """Test refused requests show up in the report."""
+        budget = self.make(per_day=1)
+        budget.try_consume(2)
+        self.assertEqual(budget.remaining()['denied'], 1)
+
+
+class TestMemoryBudget(BudgetTests, unittest.TestCase):
+
+    def make(self, **kwargs):
+        return MemoryBudget(clock=self.clock, **kwargs)
+
+
+class TestSQLiteBudget(BudgetTests, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'budget.sqlite3')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make(self, **kwargs):
+        return SQLiteBudget(self.path, clock=self.clock, **kwargs)
+
+    def test_shared_between_workers(self):
+        """Test two handles on one file draw from the same daily budget."""
+        first = self.make(per_day=100)
+        second = self.make(per_day=100)
+        self.assertTrue(first.try_consume(60))
+        self.assertFalse(second.try_consume(60))
+        self.assertEqual(second.remaining()['remaining_today'], 40)
+
+
+class TestBurstFloor(unittest.TestCase):
+
+    def test_default_burst_holds_largest_request(self):
+        """Test the default burst is raised so the largest request can ever be granted."""
+        budget = MemoryBudget(per_second=10, max_request=100)
+        self.assertEqual(budget.burst, 100)
+        self.assertTrue(budget.try_consume(100))
+        self.assertEqual(MemoryBudget(per_second=500, max_request=100).burst, 500)
+
+    def test_smaller_burst_is_rejected(self):
+        with self.assertRaises(ValueError):
+            MemoryBudget(per_second=10, burst=50, max_request=100)
+        with self.assertRaises(ValueError):
+            make_budget('memory', per_second=10, burst=24, max_request=25)
+        self.assertEqual(MemoryBudget(burst=5, max_request=100).burst, 5)
+
+
+class TestMakeBudget(unittest.TestCase):
+
+    def test_unknown_backend(self):
+        """Test an unknown backend name is rejected."""
+        with self.assertRaises(ValueError):
+            make_budget('redis')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,61 @@
+"""Trigram inverted index for case-insensitive substring search.
+
+`ILIKE '%q%'` can't use a btree, so every applicant/address search is a full
+scan. Here every row's lower-cased text is split into overlapping 3-character
+grams with a sorted posting list of row ids per gram. A query of three or
+more characters intersects the posting lists of its own grams, shortest
+first, and only the surviving rows are checked with a real substring test,
+so the work follows the number of matches instead of the table size.
+"""
+import numpy as np
+
+GRAM = 3
+
+
+def trigrams(text):
+    """The distinct 3-character substrings of `text`."""
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+class TrigramIndex:
+    """Posting lists over `values`, a sequence of lower-cased strings or None.
+
+    Row ids are positions in `values`; posting lists are ascending int32
+    arrays so intersections keep load order.
+    """
+
+    def __init__(self, values):
+        postings = {}
+        for row_id, text in enumerate(values):
+            if text is None:
+                continue
+            for gram in trigrams(text):
+                postings.setdefault(gram, []).append(row_id)
+        self.postings = {
+            gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()
+        }
+        for array in self.postings.values():
+            array.flags.writeable = False
+
+    def candidates(self, query):
+        """Ascending row ids that may contain `query`, or None if it's too short to narrow.
+
+        Every id returned contains all of the query's trigrams; callers still
+        verify the substring since the grams can appear out of order.
+        """
+        grams = trigrams(query)
+        if not grams:
+            return None
+        lists = []
+        for gram in grams:
+            ids = self.postings.get(gram)
+            if ids is None:
+                return np.empty(0, dtype=np.int32)
+            lists.append(ids)
+        lists.sort(key=len)
+        result = lists[0]
+        for ids in lists[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, ids, assume_unique=True)
+        return result
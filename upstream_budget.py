@@ -0,0 +1,169 @@
+"""Budget for Distance Matrix elements, per second and per day.
+
+A token bucket refilled at `per_second` elements a second (holding at most
+`burst`) smooths bursts, and a daily counter enforces the plan's quota;
+either limit set to 0 is unlimited. `try_consume(n)` either takes all `n`
+elements or none, so callers can fall back before spending anything.
+A request larger than `burst` could never be granted, so callers consume
+per upstream request and `max_request` (the largest one they send) is a
+floor on `burst`: the default is raised to it and a smaller explicit
+`burst` is rejected.
+
+`MemoryBudget` is per process; `SQLiteBudget` keeps the same state in a
+local file so every gunicorn worker on a host draws from one budget.
+The day rolls over at midnight UTC.
+"""
+import os
+import sqlite3
+import threading
+from time import gmtime, strftime, time
+
+
+def _day(now):
+    return strftime('%Y-%m-%d', gmtime(now))
+
+
+class MemoryBudget:
+    """Token bucket plus daily cap, held in this process."""
+
+    def __init__(self, per_second=0, burst=None, per_day=0, clock=time, max_request=0):
+        if per_second and burst is not None and burst < max_request:
+            raise ValueError(f'burst ({burst}) must hold the largest single request ({max_request} elements)')
+        self.per_second = per_second
+        self.burst = burst if burst is not None else max(per_second, max_request)
+        self.per_day = per_day
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._day = _day(self._updated)
+        self._used_today = 0
+        self.denied = 0
+
+    def _refill(self, tokens, updated, day, used_today, now):
+        if self.per_second:
+            tokens = min(float(self.burst), tokens + (now - updated) * self.per_second)
+        if _day(now) != day:
+            day, used_today = _day(now), 0
+        return tokens, now, day, used_today
+
+    def _allowed(self, tokens, used_today, elements):
+        if self.per_second and tokens < elements:
+            return False
+        if self.per_day and used_today + elements > self.per_day:
+            return False
+        return True
+
+    def try_consume(self, elements):
+        """Take `elements` from the budget if all of them are available."""
+        with self._lock:
+            now = self.clock()
+            self._tokens, self._updated, self._day, self._used_today = self._refill(
+                self._tokens, self._updated, self._day, self._used_today, now
+            )
+            if not self._allowed(self._tokens, self._used_today, elements):
+                self.denied += 1
+                return False
+            if self.per_second:
+                self._tokens -= elements
+            self._used_today += elements
+            return True
+
+    def remaining(self):
+        with self._lock:
+            tokens, _, day, used_today = self._refill(
+                self._tokens, self._updated, self._day, self._used_today, self.clock()
+            )
+            return self._report(tokens, day, used_today)
+
+    def _report(self, tokens, day, used_today):
+        return {
+            'day': day,
+            'used_today': used_today,
+            'remaining_today': max(self.per_day - used_today, 0) if self.per_day else None,
+            'remaining_this_second': int(tokens) if self.per_second else None,
+            'per_second': self.per_second,
+            'per_day': self.per_day,
+            'denied': self.denied,
+        }
+
+
+class SQLiteBudget(MemoryBudget):
+    """`MemoryBudget` whose state lives in a SQLite file shared by workers.
+
+    Each consume runs in a `BEGIN IMMEDIATE` transaction, so concurrent
+    workers can't both spend the last elements.
+    """
+
+    def __init__(self, path, per_second=0, burst=None, per_day=0, clock=time, max_request=0,
+                 name='distance_matrix'):
+        super().__init__(per_second=per_second, burst=burst, per_day=per_day, clock=clock,
+                         max_request=max_request)
+        self.path = path
+        self.name = name
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS budget ('
+            ' name TEXT PRIMARY KEY,'
+            ' tokens REAL NOT NULL,'
+            ' updated REAL NOT NULL,'
+            ' day TEXT NOT NULL,'
+            ' used_today INTEGER NOT NULL)'
+        )
+        now = clock()
+        conn.execute(
+            'INSERT OR IGNORE INTO budget (name, tokens, updated, day, used_today) VALUES (?, ?, ?, ?, 0)',
+            (name, float(self.burst), now, _day(now))
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _load(self, conn):
+        return conn.execute(
+            'SELECT tokens, updated, day, used_today FROM budget WHERE name = ?', (self.name,)
+        ).fetchone()
+
+    def try_consume(self, elements):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            tokens, updated, day, used_today = self._refill(*self._load(conn), self.clock())
+            allowed = self._allowed(tokens, used_today, elements)
+            if allowed:
+                if self.per_second:
+                    tokens -= elements
+                used_today += elements
+            conn.execute(
+                'UPDATE budget SET tokens = ?, updated = ?, day = ?, used_today = ? WHERE name = ?',
+                (tokens, updated, day, used_today, self.name)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if not allowed:
+            self.denied += 1
+        return allowed
+
+    def remaining(self):
+        tokens, _, day, used_today = self._refill(*self._load(self._connect()), self.clock())
+        return self._report(tokens, day, used_today)
+
+
+def make_budget(backend='memory', path=None, **kwargs):
+    """Build a budget for `backend`: 'memory' (per process) or 'sqlite' (per host)."""
+    if backend == 'memory':
+        return MemoryBudget(**kwargs)
+    if backend == 'sqlite':
+        if not path:
+            raise ValueError('the sqlite budget backend needs a path')
+        return SQLiteBudget(path, **kwargs)
+    raise ValueError(f'unknown budget backend: {backend}')